@@ -0,0 +1,247 @@
+#!/usr/bin/python
+
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..', 'controller'))
+
+from ryu.ofproto import ofproto_v1_3, ofproto_v1_3_parser
+from ryu.topology import switches, event
+from network_topology import NetworkTopology
+
+__author__ = 'Dario Banfi'
+__license__ = 'Apache 2.0'
+__version__ = '1.0'
+__email__ = 'dario.banfi@tum.de'
+
+'''
+Offline topologies for the controller benchmarks. Switches, ports and
+links are the real Ryu/controller objects, only the datapaths are not
+connected to a switch and the messages are counted instead of sent
+'''
+
+
+class BenchmarkDatapath(object):
+
+    ofproto = ofproto_v1_3
+    ofproto_parser = ofproto_v1_3_parser
+
+    def __init__(self, dpid):
+        self.id = dpid
+        self.xid = 0
+        self.sent_messages = 0
+
+    def set_xid(self, msg):
+        self.xid += 1
+        msg.set_xid(self.xid)
+        return self.xid
+
+    def send_msg(self, msg):
+        if msg.xid is None:
+            self.set_xid(msg)
+        self.sent_messages += 1
+        return True
+
+
+class CountingSender(object):
+
+    ''' Replaces the controller send queue, counts the messages '''
+
+    def __init__(self):
+        self.messages = 0
+
+    def send(self, datapath, msg):
+        self.messages += 1
+
+    def when_applied(self, datapath, callback):
+        callback()
+
+    def forget_datapath(self, dpid):
+        pass
+
+
+class BenchmarkController(object):
+
+    ''' Controller parameters used by NetworkTopology '''
+
+    def __init__(self):
+        self.MDI_REORDERING_THRESHOLD = 0.2
+        self.MDI_DROP_THRESHOLD = 0.25
+        self.MAX_HOP_DIFFERENCE = -1
+        self.MIN_MULTIPATH_CAPACITY = 100
+        self.MAX_PATHS_PER_MULTIPATH_FLOW = 2
+        self.PATH_FINDING_ALGORITHM = 'snapshot_dijkstra'
+        self.USE_PATH_MATRICES = False
+        self.PATH_COMPUTATION_WORKERS = 0
+        self.K_SHORTEST_PATHS = 8
+        self.PATH_DISJOINTNESS = None
+        self.SHARED_RISK_LINK_GROUPS = {}
+        self.GLOBAL_MULTICOMMODITY_FLOW = False
+        self.MULTICOMMODITY_FLOW_EPSILON = 0.2
+        self.MULTICOMMODITY_FLOW_MAX_PHASES = 200
+        self.PATH_CACHE_SIZE = 10000
+        self.PATH_CACHE_LATENCY_TOLERANCE = 0.1
+        self.UPDATE_FORWARDING_ON_TOPOLOGY_CHANGE_ONLY = False
+        self.USE_FAST_FAILOVER = False
+        self.sender = CountingSender()
+
+    def add_flow(self, datapath, priority, match, actions, buffer_id=None,
+                 command=None, meter_id=None, cookie=0):
+        self.sender.send(datapath, None)
+
+    def delete_flow(self, datapath, priority, match):
+        self.sender.send(datapath, None)
+
+    def delete_flows_by_cookie(self, datapath, cookie, cookie_mask):
+        self.sender.send(datapath, None)
+
+    def request_recomputation(self, reason):
+        pass
+
+
+class BenchmarkNetwork(object):
+
+    '''
+    Builds a NetworkTopology through the same add_switch/add_link calls
+    used by the controller event handlers
+    '''
+
+    def __init__(self, topology_class=NetworkTopology):
+        self.controller = BenchmarkController()
+        self.topology = topology_class(self.controller)
+        self.ryu_switches = {}
+
+    def add_switch(self, dpid, port_count):
+        dp = BenchmarkDatapath(dpid)
+        ryu_switch = switches.Switch(dp)
+        for port_no in range(1, port_count + 1):
+            ryu_switch.add_port(ofproto_v1_3_parser.OFPPort(
+                port_no, '00:00:00:00:%02x:%02x' % (dpid % 256, port_no),
+                's%d-eth%d' % (dpid, port_no), 0, 0, 0, 0, 0, 0, 0, 0))
+        self.ryu_switches[dpid] = ryu_switch
+        self.topology.add_switch(ryu_switch)
+
+    def add_link(self, dpid_1, port_1, dpid_2, port_2, latency=0.001):
+        src = self._port(dpid_1, port_1)
+        dst = self._port(dpid_2, port_2)
+        self.topology.add_link(event.EventLinkAdd(switches.Link(src, dst)))
+        self.topology.add_link(event.EventLinkAdd(switches.Link(dst, src)))
+        for dpid, port_no in ((dpid_1, port_1), (dpid_2, port_2)):
+            self.topology.dpid_to_switch[dpid].ports[port_no].latency = \
+                latency
+
+    def set_edge(self, dpid, port_no):
+        switch = self.topology.dpid_to_switch[dpid]
+        switch.edge_port = port_no
+        switch.ip_network = '10.%d.%d.0' % (dpid / 256, dpid % 256)
+        switch.ip_netmask = '255.255.255.0'
+
+    def _port(self, dpid, port_no):
+        for port in self.ryu_switches[dpid].ports:
+            if port.port_no == port_no:
+                return port
+        raise KeyError((dpid, port_no))
+
+
+def leaf_spine(edges, spines=4, topology_class=NetworkTopology):
+    '''
+    Every leaf is an edge switch connected to every spine, the
+    host port of a leaf is the one after the spine ports
+    '''
+    network = BenchmarkNetwork(topology_class)
+    leaf_dpids = range(1, edges + 1)
+    spine_dpids = range(edges + 1, edges + spines + 1)
+
+    for dpid in leaf_dpids:
+        network.add_switch(dpid, spines + 1)
+    for dpid in spine_dpids:
+        network.add_switch(dpid, edges)
+
+    for leaf_index, leaf in enumerate(leaf_dpids):
+        for spine_index, spine in enumerate(spine_dpids):
+            network.add_link(leaf, spine_index + 1, spine, leaf_index + 1,
+                             latency=0.001 * (spine_index + 1))
+        network.set_edge(leaf, spines + 1)
+
+    return network
+
+
+def fat_tree(k, topology_class=NetworkTopology):
+    '''
+    k-ary fat-tree: k pods of k/2 edge and k/2 aggregation switches
+    and (k/2)^2 core switches. Edge switches use port k/2 + 1 as host
+    port
+    '''
+    half = k / 2
+    network = BenchmarkNetwork(topology_class)
+    dpid = 1
+
+    core = []
+    for _ in range(half * half):
+        network.add_switch(dpid, k)
+        core.append(dpid)
+        dpid += 1
+
+    for pod in range(k):
+        aggregation = []
+        for _ in range(half):
+            network.add_switch(dpid, k)
+            aggregation.append(dpid)
+            dpid += 1
+
+        for edge_index in range(half):
+            network.add_switch(dpid, half + 1)
+            for agg_index, agg in enumerate(aggregation):
+                network.add_link(dpid, agg_index + 1, agg, edge_index + 1)
+            network.set_edge(dpid, half + 1)
+            dpid += 1
+
+        for agg_index, agg in enumerate(aggregation):
+            for core_index in range(half):
+                network.add_link(agg, half + core_index + 1,
+                                 core[agg_index * half + core_index],
+                                 pod + 1)
+
+    return network
+
+
+def random_graph(switch_count, degree, seed=0,
+                 topology_class=NetworkTopology):
+    '''
+    Connected random graph: a ring plus random links until the average
+    degree is reached, with random latencies. Every switch is an edge
+    switch
+    '''
+    rng = random.Random(seed)
+    dpids = range(1, switch_count + 1)
+
+    links = set()
+    for index, dpid in enumerate(dpids):
+        peer = dpids[(index + 1) % switch_count]
+        links.add((min(dpid, peer), max(dpid, peer)))
+    while len(links) < switch_count * degree / 2:
+        dpid_1, dpid_2 = rng.sample(dpids, 2)
+        links.add((min(dpid_1, dpid_2), max(dpid_1, dpid_2)))
+
+    port_count = dict((dpid, 1) for dpid in dpids)
+    for dpid_1, dpid_2 in links:
+        port_count[dpid_1] += 1
+        port_count[dpid_2] += 1
+
+    network = BenchmarkNetwork(topology_class)
+    for dpid in dpids:
+        network.add_switch(dpid, port_count[dpid])
+
+    next_port = dict((dpid, 1) for dpid in dpids)
+    for dpid_1, dpid_2 in sorted(links):
+        network.add_link(dpid_1, next_port[dpid_1], dpid_2, next_port[dpid_2],
+                         latency=rng.uniform(0.0005, 0.01))
+        next_port[dpid_1] += 1
+        next_port[dpid_2] += 1
+
+    for dpid in dpids:
+        network.set_edge(dpid, port_count[dpid])
+
+    return network
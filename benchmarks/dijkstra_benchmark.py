@@ -0,0 +1,79 @@
+#!/usr/bin/python
+
+from benchmark_network import fat_tree, random_graph
+from graph_snapshot import GraphSnapshot
+from network_topology import Dijkstra, HeapqDijkstra, SnapshotDijkstra
+import argparse
+import random
+import time
+
+__author__ = 'Dario Banfi'
+__license__ = 'Apache 2.0'
+__version__ = '1.0'
+__email__ = 'dario.banfi@tum.de'
+
+'''
+Micro-benchmark of the path search engines behind Algorithm.find_route:
+the hand-written binary heap Dijkstra, the heapq Dijkstra with lazy
+deletion and the Dijkstra on the GraphSnapshot arrays.
+
+Usage: python benchmarks/dijkstra_benchmark.py --queries 2000
+'''
+
+ENGINES = [
+    ('binary heap', Dijkstra),
+    ('heapq', HeapqDijkstra),
+    ('snapshot heapq', SnapshotDijkstra),
+]
+
+
+def run(network, engine_class, queries):
+    topology = network.topology
+    controller = network.controller
+    engine = engine_class(
+        topology.dpid_to_switch,
+        controller.MIN_MULTIPATH_CAPACITY,
+        controller.UPDATE_FORWARDING_ON_TOPOLOGY_CHANGE_ONLY
+    )
+    engine.set_snapshot(GraphSnapshot(topology.dpid_to_switch))
+
+    start = time.time()
+    found = 0
+    for src, dst in queries:
+        if engine.find_route(src, dst) is not None:
+            found += 1
+    return time.time() - start, found
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Path search engine benchmark')
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    networks = [
+        ('random n=100 d=4', random_graph(100, 4, args.seed)),
+        ('random n=500 d=6', random_graph(500, 6, args.seed)),
+        ('fat-tree k=8', fat_tree(8)),
+        ('fat-tree k=16', fat_tree(16)),
+    ]
+
+    rng = random.Random(args.seed)
+    print '%-18s %-15s %10s %12s %8s' % (
+        'topology', 'engine', 'total (s)', 'per query', 'found')
+    for name, network in networks:
+        edges = [switch for switch in
+                 network.topology.dpid_to_switch.itervalues()
+                 if switch.edge_port]
+        queries = [tuple(rng.sample(edges, 2)) for _ in range(args.queries)]
+
+        for engine_name, engine_class in ENGINES:
+            elapsed, found = run(network, engine_class, queries)
+            print '%-18s %-15s %10.3f %10.1fus %8d' % (
+                name, engine_name, elapsed,
+                elapsed / len(queries) * 1e6, found)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/python
+
+from benchmark_network import leaf_spine
+from network_topology import NetworkTopology
+import argparse
+import time
+
+__author__ = 'Dario Banfi'
+__license__ = 'Apache 2.0'
+__version__ = '1.0'
+__email__ = 'dario.banfi@tum.de'
+
+'''
+Total multipath computation time on leaf-spine topologies of growing
+size, with the indexed mp_config and with the former flat mp_config
+which was rebuilt into a nested dictionary on every create_flow_rules
+call.
+
+Usage: python benchmarks/mp_config_benchmark.py --edges 10 25 50 100
+'''
+
+
+class FlatConfigTopology(NetworkTopology):
+
+    '''
+    Keeps the former flat (dst, src, node, in_port, out_port) config
+    next to the index and rebuilds it in create_flow_rules like the
+    controller did before
+    '''
+
+    def __init__(self, *args, **kwargs):
+        NetworkTopology.__init__(self, *args, **kwargs)
+        self.flat_config = {}
+
+    def multipath_computation(self):
+        if self.full_recompute_needed:
+            self.flat_config = {}
+        NetworkTopology.multipath_computation(self)
+
+    def save_path(self, src, dst, path, capacity, latency):
+        NetworkTopology.save_path(self, src, dst, path, capacity, latency)
+        for previous_node, node, next_node in path.iter_previous_and_next():
+            if node == src:
+                input_intf = node.edge_port
+            else:
+                input_intf = node.peer_to_local_port[previous_node]
+
+            if node == dst:
+                output_intf = node.edge_port
+            else:
+                output_intf = node.peer_to_local_port[next_node]
+
+            key = (dst, src, node, input_intf, output_intf)
+            if key in self.flat_config:
+                self.flat_config[key] += (capacity, latency)
+            else:
+                self.flat_config[key] = (capacity, latency)
+
+    def create_flow_rules(self, src, dst):
+        mp_dict = {}
+        for k, v in self.flat_config.iteritems():
+            reduce(
+                lambda a, b: a.setdefault(b, {}), k[:-1], mp_dict)[k[-1]] = v
+        NetworkTopology.create_flow_rules(self, src, dst)
+
+
+def run(edges, topology_class, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        network = leaf_spine(edges, topology_class=topology_class)
+        start = time.time()
+        network.topology.multipath_computation()
+        best = min(best, time.time() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Multipath config index benchmark')
+    parser.add_argument('--edges', type=int, nargs='+',
+                        default=[10, 25, 50, 100])
+    parser.add_argument('--repeat', type=int, default=1)
+    args = parser.parse_args()
+
+    print '%6s %8s %12s %12s %8s' % (
+        'edges', 'pairs', 'flat (s)', 'indexed (s)', 'speedup')
+    for edges in args.edges:
+        flat = run(edges, FlatConfigTopology, args.repeat)
+        indexed = run(edges, NetworkTopology, args.repeat)
+        print '%6d %8d %12.3f %12.3f %7.1fx' % (
+            edges, edges * (edges - 1), flat, indexed, flat / indexed)
+
+
+if __name__ == '__main__':
+    main()
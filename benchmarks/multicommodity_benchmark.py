@@ -0,0 +1,118 @@
+#!/usr/bin/python
+
+from benchmark_network import random_graph
+from network_topology import NetworkTopology
+from traffic_matrix import RateCounter
+import argparse
+import random
+import time
+
+__author__ = 'Dario Banfi'
+__license__ = 'Apache 2.0'
+__version__ = '1.0'
+__email__ = 'dario.banfi@tum.de'
+
+'''
+Throughput delivered under contention by the per-couple computation,
+where every couple is routed on the full link capacities, and by the
+global multi-commodity flow. Every couple sends its random demand split
+among its paths like the SELECT group buckets, an oversubscribed link
+delivers only its capacity, shared proportionally among its flows.
+
+Usage: python benchmarks/multicommodity_benchmark.py --switches 10 20 40
+'''
+
+
+class RecordingTopology(NetworkTopology):
+
+    ''' Keeps the links and capacity of every saved path '''
+
+    def __init__(self, *args, **kwargs):
+        NetworkTopology.__init__(self, *args, **kwargs)
+        self.saved_paths = []
+
+    def multipath_computation(self):
+        self.saved_paths = []
+        NetworkTopology.multipath_computation(self)
+
+    def save_path(self, src, dst, path, capacity, latency):
+        NetworkTopology.save_path(self, src, dst, path, capacity, latency)
+        self.saved_paths.append(
+            ((src.dp.id, dst.dp.id), path.link_ports(), capacity))
+
+
+def delivered_throughput(topology, demands):
+    '''
+    Total rate delivered when every couple sends its demand, capped by
+    the capacity allocated to its paths
+    '''
+    allocated = {}
+    for pair, links, capacity in topology.saved_paths:
+        allocated[pair] = allocated.get(pair, 0) + capacity
+
+    sent = []
+    load = {}
+    for pair, links, capacity in topology.saved_paths:
+        rate = min(demands[pair], allocated[pair]) * \
+            capacity / allocated[pair]
+        sent.append((links, rate))
+        for link in links:
+            load[link] = load.get(link, 0) + rate
+
+    delivered = 0
+    for links, rate in sent:
+        scale = 1
+        for dpid, port_no in links:
+            port = topology.dpid_to_switch[dpid].ports[port_no]
+            scale = min(scale, port.max_capacity / load[dpid, port_no])
+        delivered += rate * scale
+    return delivered
+
+
+def run(switch_count, degree, global_flow, seed):
+    network = random_graph(switch_count, degree, seed,
+                           topology_class=RecordingTopology)
+    network.controller.GLOBAL_MULTICOMMODITY_FLOW = global_flow
+    topology = network.topology
+
+    rng = random.Random(seed)
+    demands = {}
+    for src in topology.dpid_to_switch:
+        for dst in topology.dpid_to_switch:
+            if src != dst:
+                counter = RateCounter()
+                counter.ewma = rng.uniform(0, 2.5e6)
+                topology.traffic_matrix.pairs[src, dst] = counter
+                demands[src, dst] = counter.ewma
+
+    start = time.time()
+    topology.multipath_computation()
+    elapsed = time.time() - start
+    return delivered_throughput(topology, demands), sum(
+        demands.itervalues()), elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Multi-commodity flow benchmark')
+    parser.add_argument('--switches', type=int, nargs='+',
+                        default=[10, 20, 40])
+    parser.add_argument('--degree', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print '%8s %12s %14s %14s %10s %10s' % (
+        'switches', 'demand', 'per couple', 'global', 'couple (s)',
+        'global (s)')
+    for switch_count in args.switches:
+        per_couple, demand, couple_time = run(
+            switch_count, args.degree, False, args.seed)
+        global_flow, demand, global_time = run(
+            switch_count, args.degree, True, args.seed)
+        print '%8d %12.0f %14.0f %14.0f %10.3f %10.3f' % (
+            switch_count, demand, per_couple, global_flow, couple_time,
+            global_time)
+
+
+if __name__ == '__main__':
+    main()
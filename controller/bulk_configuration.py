@@ -0,0 +1,370 @@
+#!/usr/bin/python
+
+from network_topology import ALGORITHMS
+from port_stats import check_estimate
+import logging
+
+__author__ = 'Dario Banfi'
+__license__ = 'Apache 2.0'
+__version__ = '1.0'
+__email__ = 'dario.banfi@tum.de'
+
+'''
+Validation and application of configuration documents. A whole
+document is checked against the current topology before anything is
+changed, then applied without yielding to the other greenthreads, so a
+computation never sees it half applied. A document looks like:
+
+{
+    "parameters": {"max_paths": 2, "algorithm": "snapshot_dijkstra"},
+    "port_capacities": [{"dpid": 2, "port_no": 2, "capacity": 876000}],
+    "edge_ports": [{"dpid": 1, "port_no": 3}],
+    "ip_networks": [{"dpid": 1, "ip": "10.0.0.1",
+                     "netmask": "255.255.255.255"}],
+    "recompute": true
+}
+
+where parameters takes the keys of /multipath/configuration
+'''
+
+logger = logging.getLogger(__name__)
+
+# Values of PATH_DISJOINTNESS, see YenKShortestPaths
+DISJOINTNESS_MODES = (None, 'link', 'node', 'srlg')
+
+
+def boolean(value):
+    # bool('false') is True, only JSON booleans are accepted
+    if not isinstance(value, bool):
+        raise ValueError('%r is not a boolean' % (value,))
+    return value
+
+
+def at_least(conversion, minimum):
+    '''
+    Conversion rejecting the values below minimum
+    '''
+    def convert(value):
+        value = conversion(value)
+        if value < minimum:
+            raise ValueError('%s is below %s' % (value, minimum))
+        return value
+    return convert
+
+
+def positive(conversion):
+    '''
+    Conversion rejecting zero and the negative values
+    '''
+    def convert(value):
+        value = conversion(value)
+        if value <= 0:
+            raise ValueError('%s is not positive' % (value,))
+        return value
+    return convert
+
+
+def fraction(value):
+    # Epsilon of the multi-commodity flow, 0 divides by zero and the
+    # approximation bound holds below 1 only
+    value = float(value)
+    if not 0 < value < 1:
+        raise ValueError('%s is not between 0 and 1' % value)
+    return value
+
+
+def disjointness(mode):
+    if mode not in DISJOINTNESS_MODES:
+        raise ValueError('unknown disjointness %s' % mode)
+    return mode
+
+
+def algorithm(name):
+    if name not in ALGORITHMS:
+        raise ValueError('unknown algorithm %s' % name)
+    return name
+
+
+def shared_risk_link_groups(groups):
+    return dict(
+        (name, [(int(dpid), int(port_no)) for dpid, port_no in links])
+        for name, links in groups.items()
+    )
+
+
+def ipv4_address(address):
+    octets = str(address).split('.')
+    if len(octets) != 4 or not all(
+            octet.isdigit() and int(octet) <= 255 for octet in octets):
+        raise ValueError('invalid IPv4 address %s' % address)
+    return str(address)
+
+
+# Configuration key - (controller attribute, conversion)
+PARAMETERS = {
+    # -1 disables the hop difference limit
+    'max_hop_difference': ('MAX_HOP_DIFFERENCE', at_least(int, -1)),
+    'mdi_reordering': ('MDI_REORDERING_THRESHOLD', at_least(float, 0)),
+    'mdi_drop': ('MDI_DROP_THRESHOLD', at_least(float, 0)),
+    'use_recompute_trigger': ('USE_RECOMPUTE_TRIGGER', boolean),
+    'recompute_quiet_period': ('RECOMPUTE_QUIET_PERIOD', at_least(float, 0)),
+    'recompute_max_delay': ('RECOMPUTE_MAX_DELAY', at_least(float, 0)),
+    'use_fast_failover': ('USE_FAST_FAILOVER', boolean),
+    'max_paths': ('MAX_PATHS_PER_MULTIPATH_FLOW', at_least(int, 1)),
+    'min_multipath_capacity': ('MIN_MULTIPATH_CAPACITY', at_least(int, 0)),
+    'monitoring_frequency_seconds': ('MONITORING_PORT_STATS_FREQUENCY',
+                                     at_least(int, 1)),
+    'use_path_matrices': ('USE_PATH_MATRICES', boolean),
+    'path_computation_workers': ('PATH_COMPUTATION_WORKERS',
+                                 at_least(int, 0)),
+    'global_multicommodity_flow': ('GLOBAL_MULTICOMMODITY_FLOW', boolean),
+    'multicommodity_flow_epsilon': ('MULTICOMMODITY_FLOW_EPSILON', fraction),
+    'multicommodity_flow_max_phases': ('MULTICOMMODITY_FLOW_MAX_PHASES',
+                                       at_least(int, 1)),
+    # 0 disables the cache
+    'path_cache_size': ('PATH_CACHE_SIZE', at_least(int, 0)),
+    'k_shortest_paths': ('K_SHORTEST_PATHS', at_least(int, 1)),
+    'path_disjointness': ('PATH_DISJOINTNESS', disjointness),
+    'shared_risk_link_groups': ('SHARED_RISK_LINK_GROUPS',
+                                shared_risk_link_groups),
+    'port_utilization_estimate': ('PORT_UTILIZATION_ESTIMATE',
+                                  check_estimate),
+    'port_stats_window': ('PORT_STATS_WINDOW', positive(float)),
+    # A bucket needs a whole token to let a packet through
+    'punt_budget_rate': ('PUNT_BUDGET_RATE', positive(float)),
+    'punt_budget_burst': ('PUNT_BUDGET_BURST', at_least(float, 1)),
+    'probe_budget_rate': ('PROBE_BUDGET_RATE', positive(float)),
+    'probe_budget_burst': ('PROBE_BUDGET_BURST', at_least(float, 1)),
+    'algorithm': ('PATH_FINDING_ALGORITHM', algorithm),
+}
+
+
+def resize_path_cache(controller):
+    controller.topo_shape.path_cache.max_size = controller.PATH_CACHE_SIZE
+
+
+def change_algorithm(controller):
+    controller.topo_shape.set_algorithm(controller.PATH_FINDING_ALGORITHM)
+
+
+def change_topology(controller):
+    controller.topo_shape.mark_topology_changed()
+
+
+# Configuration key - function run after the parameters are set
+PARAMETER_HOOKS = {
+    'use_fast_failover': change_topology,
+    'path_cache_size': resize_path_cache,
+    'algorithm': change_algorithm,
+}
+
+SECTIONS = ('parameters', 'port_capacities', 'edge_ports', 'ip_networks',
+            'recompute')
+
+
+class ConfigurationError(Exception):
+
+    def __init__(self, errors):
+        Exception.__init__(self, '; '.join(errors))
+        self.errors = errors
+
+
+class Configuration(object):
+
+    '''
+    A validated configuration document, nothing is changed until apply
+    '''
+
+    def __init__(self, controller):
+        self.controller = controller
+        self.topology = controller.topo_shape
+
+        self.errors = []
+
+        # Configuration key - converted value
+        self.parameters = {}
+
+        # (dpid, port_no) - capacity
+        self.port_capacities = {}
+
+        # dpid - edge port_no
+        self.edge_ports = {}
+
+        # dpid - (ip, netmask)
+        self.ip_networks = {}
+
+        self.recompute = False
+
+    def load(self, document):
+        '''
+        Validates a whole document, raises ConfigurationError listing
+        every problem found
+        '''
+        if not isinstance(document, dict):
+            raise ConfigurationError(['the document must be an object'])
+
+        for section in document:
+            if section not in SECTIONS:
+                self.errors.append('unknown section %s' % section)
+
+        self.load_parameters(document.get('parameters', {}))
+        for entry in self.entries(document, 'port_capacities'):
+            self.load_port_capacity(entry)
+        for entry in self.entries(document, 'edge_ports'):
+            self.load_edge_port(entry)
+        for entry in self.entries(document, 'ip_networks'):
+            self.load_ip_network(entry)
+        try:
+            self.recompute = boolean(document.get('recompute', False))
+        except ValueError as e:
+            self.errors.append('recompute: %s' % e)
+
+        if self.errors:
+            raise ConfigurationError(self.errors)
+
+    def load_parameters(self, parameters, ignore_unknown=False):
+        if not isinstance(parameters, dict):
+            self.errors.append('parameters must be an object')
+            return
+        for key, value in parameters.iteritems():
+            if key not in PARAMETERS:
+                if not ignore_unknown:
+                    self.errors.append('unknown parameter %s' % key)
+                continue
+            _, conversion = PARAMETERS[key]
+            try:
+                self.parameters[key] = conversion(value)
+            except (ValueError, TypeError, AttributeError) as e:
+                self.errors.append('parameter %s: %s' % (key, e))
+
+    def entries(self, document, section):
+        entries = document.get(section, [])
+        if not isinstance(entries, list):
+            self.errors.append('%s must be a list' % section)
+            return []
+        return entries
+
+    def switch(self, entry, section):
+        '''
+        Returns the switch an entry refers to or None, recording the
+        error
+        '''
+        try:
+            dpid = int(entry['dpid'])
+        except (KeyError, ValueError, TypeError):
+            self.errors.append('%s: invalid dpid in %s' % (section, entry))
+            return None
+        switch = self.topology.dpid_to_switch.get(dpid)
+        if switch is None:
+            self.errors.append('%s: unknown switch %d' % (section, dpid))
+        return switch
+
+    def port(self, entry, section):
+        '''
+        Returns the (switch, port_no) an entry refers to or None,
+        recording the error
+        '''
+        switch = self.switch(entry, section)
+        if switch is None:
+            return None
+        try:
+            port_no = int(entry['port_no'])
+        except (KeyError, ValueError, TypeError):
+            self.errors.append('%s: invalid port_no in %s' % (section, entry))
+            return None
+        if port_no not in switch.ports:
+            self.errors.append('%s: unknown port %d on switch %d' % (
+                section, port_no, switch.dp.id))
+            return None
+        return switch, port_no
+
+    def load_port_capacity(self, entry):
+        port = self.port(entry, 'port_capacities')
+        if port is None:
+            return
+        switch, port_no = port
+        try:
+            capacity = int(entry['capacity'])
+            if capacity < 0:
+                raise ValueError
+        except (KeyError, ValueError, TypeError):
+            self.errors.append('port_capacities: invalid capacity in %s' %
+                               entry)
+            return
+        if (switch.dp.id, port_no) in self.port_capacities:
+            self.errors.append('port_capacities: port %d on switch %d set '
+                               'twice' % (port_no, switch.dp.id))
+        self.port_capacities[switch.dp.id, port_no] = capacity
+
+    def load_edge_port(self, entry):
+        port = self.port(entry, 'edge_ports')
+        if port is None:
+            return
+        switch, port_no = port
+        if switch.dp.id in self.edge_ports:
+            self.errors.append('edge_ports: switch %d set twice' %
+                               switch.dp.id)
+        self.edge_ports[switch.dp.id] = port_no
+
+    def load_ip_network(self, entry):
+        switch = self.switch(entry, 'ip_networks')
+        if switch is None:
+            return
+        try:
+            network = (ipv4_address(entry['ip']),
+                       ipv4_address(entry['netmask']))
+        except KeyError as e:
+            self.errors.append('ip_networks: missing %s in %s' % (e, entry))
+            return
+        except ValueError as e:
+            self.errors.append('ip_networks: %s' % e)
+            return
+        if switch.dp.id in self.ip_networks:
+            self.errors.append('ip_networks: switch %d set twice' %
+                               switch.dp.id)
+        self.ip_networks[switch.dp.id] = network
+
+    def apply(self):
+        '''
+        Applies the validated document. Does not yield, the changes are
+        seen all together by the computations and the recompute trigger
+        '''
+        controller = self.controller
+        topology = self.topology
+
+        for key, value in self.parameters.iteritems():
+            attribute, _ = PARAMETERS[key]
+            setattr(controller, attribute, value)
+        for key in self.parameters:
+            if key in PARAMETER_HOOKS:
+                PARAMETER_HOOKS[key](controller)
+
+        for (dpid, port_no), capacity in self.port_capacities.iteritems():
+            topology.dpid_to_switch[dpid].ports[port_no].set_max_capacity(
+                capacity)
+            topology.port_capacity_changed(dpid, port_no)
+
+        for dpid, port_no in self.edge_ports.iteritems():
+            topology.dpid_to_switch[dpid].edge_port = port_no
+
+        for dpid, (ip, netmask) in self.ip_networks.iteritems():
+            switch = topology.dpid_to_switch[dpid]
+            switch.ip_network = ip
+            switch.ip_netmask = netmask
+
+        if self.edge_ports or self.ip_networks:
+            topology.mark_topology_changed()
+
+        logger.info('Configuration applied: %d parameters, %d port '
+                    'capacities, %d edge ports, %d ip networks',
+                    len(self.parameters), len(self.port_capacities),
+                    len(self.edge_ports), len(self.ip_networks))
+
+    def summary(self):
+        return {
+            'parameters': sorted(self.parameters),
+            'port_capacities': len(self.port_capacities),
+            'edge_ports': len(self.edge_ports),
+            'ip_networks': len(self.ip_networks),
+            'recompute': self.recompute,
+        }
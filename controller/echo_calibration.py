@@ -0,0 +1,83 @@
+#!/usr/bin/python
+
+from latency_probe import monotonic_ns
+import logging
+import struct
+
+__author__ = 'Dario Banfi'
+__license__ = 'Apache 2.0'
+__version__ = '1.0'
+__email__ = 'dario.banfi@tum.de'
+
+'''
+Calibration of the controller to switch delay with OpenFlow echo
+requests. The echo payload carries the send time, replies are answered
+by the switch agent without collecting statistics so their RTT is not
+inflated like the stats RTT. Smoothed RTT and RTT variance are kept per
+datapath as in TCP (RFC 6298), half of the smoothed RTT is the delay
+subtracted from the link latency probes
+'''
+
+logger = logging.getLogger(__name__)
+
+# Marks the echo requests sent by the calibration
+ECHO_MAGIC = 'MPSD'
+
+# magic, send time (ns)
+ECHO_PAYLOAD = struct.Struct('!4sQ')
+
+RTT_ALPHA = 0.125
+RTT_BETA = 0.25
+
+
+class EchoCalibrator(object):
+
+    def __init__(self):
+        # Dpid - smoothed RTT and RTT variance in seconds
+        self.srtt = {}
+        self.rttvar = {}
+        self.samples = {}
+
+    def calibrated(self, dpid):
+        return dpid in self.srtt
+
+    def send(self, datapath):
+        data = ECHO_PAYLOAD.pack(ECHO_MAGIC, monotonic_ns())
+        datapath.send_msg(
+            datapath.ofproto_parser.OFPEchoRequest(datapath, data=data))
+
+    def reply(self, dpid, data):
+        '''
+        Updates the RTT of the datapath with an echo reply, returns the
+        smoothed RTT or None if the reply is not a calibration one
+        '''
+        receive_time = monotonic_ns()
+        if data is None or len(data) < ECHO_PAYLOAD.size:
+            return None
+        magic, send_time = ECHO_PAYLOAD.unpack_from(data)
+        if magic != ECHO_MAGIC:
+            return None
+
+        rtt = (receive_time - send_time) / 1e9
+        srtt = self.srtt.get(dpid)
+        if srtt is None:
+            self.srtt[dpid] = rtt
+            self.rttvar[dpid] = rtt / 2
+        else:
+            self.rttvar[dpid] = (1 - RTT_BETA) * self.rttvar[dpid] + \
+                RTT_BETA * abs(srtt - rtt)
+            self.srtt[dpid] = (1 - RTT_ALPHA) * srtt + RTT_ALPHA * rtt
+        self.samples[dpid] = self.samples.get(dpid, 0) + 1
+        return self.srtt[dpid]
+
+    def forget_datapath(self, dpid):
+        for values in (self.srtt, self.rttvar, self.samples):
+            values.pop(dpid, None)
+
+    def stats(self):
+        return dict(
+            (dpid, {'srtt': self.srtt[dpid],
+                    'rttvar': self.rttvar[dpid],
+                    'samples': self.samples[dpid]})
+            for dpid in self.srtt
+        )
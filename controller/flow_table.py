@@ -0,0 +1,319 @@
+#!/usr/bin/python
+
+import functools
+import logging
+
+__author__ = 'Dario Banfi'
+__license__ = 'Apache 2.0'
+__version__ = '1.0'
+__email__ = 'dario.banfi@tum.de'
+
+'''
+Shadow copy of the flow rules and groups installed by the controller
+on every datapath. Computations describe the rules they want in a
+FlowPlan and only the differences with the shadow are sent to the
+switches.
+Flows carry a cookie with the generation of the computation which
+added them. Once no flow of an old generation is left in the shadow of
+a datapath and the queued messages are confirmed, the generation is
+swept with a cookie-masked delete, removing what the controller lost
+track of, and the groups no plan uses are deleted
+'''
+
+logger = logging.getLogger(__name__)
+
+# Cookie of the multipath flows: tag in the high 32 bits, generation in
+# the low 32 bits
+COOKIE_TAG = 0x4d504154 << 32
+TAG_MASK = 0xffffffff << 32
+GENERATION_MASK = 0xffffffff
+COOKIE_MASK = TAG_MASK | GENERATION_MASK
+
+
+def generation_cookie(generation):
+    return COOKIE_TAG | generation
+
+
+def match_key(match):
+    '''
+    Returns a hashable representation of an OFPMatch
+    '''
+    return tuple(sorted(match.items()))
+
+
+def actions_key(actions):
+    '''
+    Returns a hashable representation of a list of actions or buckets
+    '''
+    return tuple(str(action) for action in actions)
+
+
+class FlowPlan(object):
+
+    '''
+    Flow rules and groups that a computation wants installed for
+    one owner (a src, dst edge couple)
+    '''
+
+    def __init__(self, owner):
+        self.owner = owner
+
+        # (dpid, priority, match_key) - (datapath, priority, match, actions)
+        self.flows = {}
+
+        # (dpid, group_id) - (datapath, group_type, buckets)
+        self.groups = {}
+
+    def add_flow(self, datapath, priority, match, actions):
+        self.flows[datapath.id, priority, match_key(match)] = (
+            datapath, priority, match, actions)
+
+    def add_group(self, datapath, group_type, group_id, buckets):
+        self.groups[datapath.id, group_id] = (datapath, group_type, buckets)
+
+
+class ShadowTable(object):
+
+    '''
+    What the controller has installed on a single datapath
+    '''
+
+    def __init__(self, datapath):
+        self.dp = datapath
+
+        # (priority, match_key) - (match, actions_key, generation)
+        self.flows = {}
+
+        # group_id - (group_type, buckets_key)
+        self.groups = {}
+
+        # Generation - number of flows installed with its cookie
+        self.generation_flows = {}
+
+    def add_generation_flow(self, generation):
+        self.generation_flows[generation] = \
+            self.generation_flows.get(generation, 0) + 1
+
+    def remove_generation_flow(self, generation):
+        '''
+        Returns True if it was the last flow of the generation
+        '''
+        self.generation_flows[generation] -= 1
+        if self.generation_flows[generation] > 0:
+            return False
+        del self.generation_flows[generation]
+        return True
+
+
+class FlowTableManager(object):
+
+    '''
+    Keeps a ShadowTable per datapath and applies FlowPlans sending
+    only adds, modifies and deletes for what changed
+    '''
+
+    def __init__(self, controller):
+        self.controller = controller
+
+        # dpid - ShadowTable
+        self.shadows = {}
+
+        # owner - set of (dpid, priority, match_key) installed for it
+        self.owner_flows = {}
+
+        # owner - set of (dpid, group_id) installed for it
+        self.owner_groups = {}
+
+        # Messages sent and skipped because already installed
+        self.sent_messages = 0
+        self.skipped_messages = 0
+
+        # Generation of the flows added by the current computation
+        self.generation = 0
+
+        # dpid - generations without flows left, not swept yet
+        self.dead_generations = {}
+
+        self.swept_generations = 0
+        self.swept_groups = 0
+
+    def shadow(self, datapath):
+        '''
+        Returns the shadow table of a datapath, creating it if needed
+        '''
+        shadow = self.shadows.get(datapath.id)
+        if shadow is None or shadow.dp is not datapath:
+            shadow = ShadowTable(datapath)
+            self.shadows[datapath.id] = shadow
+        return shadow
+
+    def forget_datapath(self, dpid):
+        '''
+        Drops the shadow of a datapath, everything will be sent again
+        the next time a plan touches it
+        '''
+        self.shadows.pop(dpid, None)
+        self.dead_generations.pop(dpid, None)
+
+    def new_generation(self):
+        '''
+        Starts the generation of a new computation, flows added from now
+        on carry its cookie
+        '''
+        self.generation = (self.generation + 1) & GENERATION_MASK
+        return self.generation
+
+    def commit(self, plan):
+        '''
+        Compares the plan with the shadow tables and sends to the
+        switches only the messages needed to reach the planned state
+        '''
+        sent = self.sent_messages
+        skipped = self.skipped_messages
+
+        old_flows = self.owner_flows.pop(plan.owner, set())
+        old_groups = self.owner_groups.pop(plan.owner, set())
+
+        # Groups first, flows can point to them
+        for (dpid, group_id), (dp, group_type, buckets) in \
+                plan.groups.iteritems():
+            self._apply_group(dp, group_type, group_id, buckets)
+
+        for (dpid, _, key), (dp, priority, match, actions) in \
+                plan.flows.iteritems():
+            self._apply_flow(dp, priority, key, match, actions)
+
+        for dpid, priority, key in old_flows.difference(plan.flows):
+            self._remove_flow(dpid, priority, key)
+
+        for dpid, group_id in old_groups.difference(plan.groups):
+            self._remove_group(dpid, group_id)
+
+        if plan.flows:
+            self.owner_flows[plan.owner] = set(plan.flows)
+        if plan.groups:
+            self.owner_groups[plan.owner] = set(plan.groups)
+
+        logger.info('Plan for %s: %d messages sent, %d already installed',
+                    plan.owner, self.sent_messages - sent,
+                    self.skipped_messages - skipped)
+
+    def _apply_group(self, dp, group_type, group_id, buckets):
+        shadow = self.shadow(dp)
+        installed = shadow.groups.get(group_id)
+        wanted = (group_type, actions_key(buckets))
+
+        if installed == wanted:
+            self.skipped_messages += 1
+            return
+
+        ofp = dp.ofproto
+        ofp_parser = dp.ofproto_parser
+        if installed is None:
+            command = ofp.OFPGC_ADD
+            logger.info('GROUP_ADD at %s GROUP_ID %d buckets %s',
+                        dp.id, group_id, buckets)
+        else:
+            command = ofp.OFPGC_MODIFY
+            logger.info('GROUP_MOD at %s GROUP_ID %d buckets %s',
+                        dp.id, group_id, buckets)
+
+        req = ofp_parser.OFPGroupMod(
+            dp, command, group_type, group_id, buckets)
+        self.controller.sender.send(dp, req)
+        shadow.groups[group_id] = wanted
+        self.sent_messages += 1
+
+    def _apply_flow(self, dp, priority, key, match, actions):
+        shadow = self.shadow(dp)
+        installed = shadow.flows.get((priority, key))
+        wanted = actions_key(actions)
+
+        if installed is not None and installed[1] == wanted:
+            self.skipped_messages += 1
+            return
+
+        if installed is None:
+            generation = self.generation
+            self.controller.add_flow(dp, priority, match, actions,
+                                     buffer_id=None,
+                                     cookie=generation_cookie(generation))
+            shadow.add_generation_flow(generation)
+        else:
+            # A modify keeps the cookie of the installed flow
+            generation = installed[2]
+            self.controller.add_flow(dp, priority, match, actions,
+                                     buffer_id=None,
+                                     command=dp.ofproto.OFPFC_MODIFY_STRICT)
+        shadow.flows[priority, key] = (match, wanted, generation)
+        self.sent_messages += 1
+
+    def _remove_flow(self, dpid, priority, key):
+        shadow = self.shadows.get(dpid)
+        if shadow is None or (priority, key) not in shadow.flows:
+            return
+        match, _, generation = shadow.flows.pop((priority, key))
+        self.controller.delete_flow(shadow.dp, priority, match)
+        self.sent_messages += 1
+        if shadow.remove_generation_flow(generation):
+            self.dead_generations.setdefault(dpid, set()).add(generation)
+
+    def _remove_group(self, dpid, group_id):
+        shadow = self.shadows.get(dpid)
+        if shadow is None or group_id not in shadow.groups:
+            return
+        group_type, _ = shadow.groups.pop(group_id)
+        ofp = shadow.dp.ofproto
+        ofp_parser = shadow.dp.ofproto_parser
+        req = ofp_parser.OFPGroupMod(
+            shadow.dp, ofp.OFPGC_DELETE, group_type, group_id, [])
+        self.controller.sender.send(shadow.dp, req)
+        logger.info('GROUP_DELETE at %s GROUP_ID %d', dpid, group_id)
+        self.sent_messages += 1
+
+    def sweep(self):
+        '''
+        Schedules the garbage collection of the datapaths with dead
+        generations, it runs once their queued messages are confirmed
+        '''
+        dead_generations = self.dead_generations
+        self.dead_generations = {}
+        for dpid, generations in dead_generations.iteritems():
+            shadow = self.shadows.get(dpid)
+            if shadow is None:
+                continue
+            self.controller.sender.when_applied(
+                shadow.dp,
+                functools.partial(self._sweep_datapath, shadow, generations))
+
+    def _sweep_datapath(self, shadow, generations):
+        if self.shadows.get(shadow.dp.id) is not shadow:
+            return
+
+        for generation in generations:
+            # Flows of the generation may have been added since
+            if generation == self.generation or \
+                    generation in shadow.generation_flows:
+                continue
+            logger.info('Sweeping generation %d at %s',
+                        generation, shadow.dp.id)
+            self.controller.delete_flows_by_cookie(
+                shadow.dp, generation_cookie(generation), COOKIE_MASK)
+            self.swept_generations += 1
+
+        used_groups = set()
+        for groups in self.owner_groups.itervalues():
+            used_groups.update(group_id for dpid, group_id in groups
+                               if dpid == shadow.dp.id)
+        for group_id in set(shadow.groups).difference(used_groups):
+            self._remove_group(shadow.dp.id, group_id)
+            self.swept_groups += 1
+
+    def stats(self):
+        return {
+            'generation': self.generation,
+            'sent_messages': self.sent_messages,
+            'skipped_messages': self.skipped_messages,
+            'swept_generations': self.swept_generations,
+            'swept_groups': self.swept_groups,
+        }
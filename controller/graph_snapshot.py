@@ -0,0 +1,205 @@
+#!/usr/bin/python
+
+from array import array
+import heapq
+import logging
+
+__author__ = 'Dario Banfi'
+__license__ = 'Apache 2.0'
+__version__ = '1.0'
+__email__ = 'dario.banfi@tum.de'
+
+'''
+Compact snapshot of the topology used by the path computation.
+Switches are numbered 0..n-1 and the links are stored in CSR form:
+the links leaving switch i are offsets[i]..offsets[i+1]-1 in the
+sources, targets, ports, latency, capacity, max_capacity and
+capacity_maxflow arrays
+'''
+
+logger = logging.getLogger(__name__)
+
+
+class GraphSnapshot(object):
+
+    def __init__(self, dpid_to_switch):
+
+        # Index - dpid and Switch, index order is the dpid order
+        self.dpids = sorted(dpid_to_switch)
+        self.switches = [dpid_to_switch[dpid] for dpid in self.dpids]
+
+        # Dpid - index
+        self.index_of = dict(
+            (dpid, index) for index, dpid in enumerate(self.dpids))
+
+        # (dpid, port_no) - link index
+        self.link_of = {}
+
+        self.offsets = array('l', [0])
+        self.sources = array('l')
+        self.targets = array('l')
+        self.ports = array('l')
+        self.latency = array('d')
+        self.capacity = array('d')
+        self.max_capacity = array('d')
+
+        for index, switch in enumerate(self.switches):
+            for port_no in sorted(switch.ports):
+                port = switch.ports[port_no]
+                peer = self.index_of.get(port.peer_switch_dpid)
+                if peer is None:
+                    continue
+                self.link_of[self.dpids[index], port_no] = len(self.targets)
+                self.sources.append(index)
+                self.targets.append(peer)
+                self.ports.append(port_no)
+                self.latency.append(port.latency)
+                self.capacity.append(port.capacity)
+                self.max_capacity.append(port.max_capacity)
+            self.offsets.append(len(self.targets))
+
+        # Residual capacity, modified by the algorithm
+        self.capacity_maxflow = array('d', self.capacity)
+
+        # Index - links entering the switch, built on first use
+        self.incoming = None
+
+    def __getstate__(self):
+        # Switches hold the datapath connections, worker processes
+        # only get the arrays
+        state = dict(self.__dict__)
+        state['switches'] = None
+        return state
+
+    def __len__(self):
+        return len(self.dpids)
+
+    def link_count(self):
+        return len(self.targets)
+
+    def latency_tree(self, destination):
+        '''
+        Lowest latency tree towards destination over all the links.
+        Returns (distance, next_link) dicts by switch index, next_link
+        is the first link of the path of every switch
+        '''
+        if self.incoming is None:
+            self.incoming = [[] for _ in self.dpids]
+            for link, target in enumerate(self.targets):
+                self.incoming[target].append(link)
+
+        sources = self.sources
+        latency = self.latency
+        distance = {destination: 0}
+        next_link = {}
+        done = set()
+        heap = [(0, destination)]
+        while heap:
+            dist, node = heapq.heappop(heap)
+            if node in done:
+                continue
+            done.add(node)
+            for link in self.incoming[node]:
+                peer = sources[link]
+                peer_dist = dist + latency[link]
+                if peer_dist < distance.get(peer, float('inf')):
+                    distance[peer] = peer_dist
+                    next_link[peer] = link
+                    heapq.heappush(heap, (peer_dist, peer))
+        return distance, next_link
+
+    def has_peer_capacity(self, node):
+        ''' Same as Switch.has_peer_capacity on the snapshot '''
+        capacity = self.capacity_maxflow
+        for link in xrange(self.offsets[node], self.offsets[node + 1]):
+            if capacity[link] > 0:
+                return True
+        return False
+
+    def shortest_path(self, source, destination, min_capacity,
+                      max_latency=None, lower_bound=None):
+        '''
+        Lowest latency path from source to destination using only links
+        with more than min_capacity residual capacity.
+        If max_latency is given, switches which cannot reach destination
+        within it are not explored, lower_bound[i] is a lower bound of
+        the latency from switch i to destination.
+        Returns (node indices, link indices) or None
+        '''
+        offsets = self.offsets
+        targets = self.targets
+        latency = self.latency
+        capacity = self.capacity_maxflow
+
+        distance = {source: 0}
+        previous_link = {}
+        done = set()
+        heap = [(0, source)]
+
+        while heap:
+            dist, node = heapq.heappop(heap)
+            if node in done:
+                continue
+            done.add(node)
+
+            if not self.has_peer_capacity(node):
+                return None
+
+            if node == destination:
+                break
+
+            for link in xrange(offsets[node], offsets[node + 1]):
+                if capacity[link] <= min_capacity:
+                    continue
+                peer = targets[link]
+                peer_dist = dist + latency[link]
+                if max_latency is not None:
+                    bound = peer_dist
+                    if lower_bound is not None:
+                        bound += lower_bound[peer]
+                    if bound > max_latency:
+                        continue
+                if peer_dist < distance.get(peer, float('inf')):
+                    distance[peer] = peer_dist
+                    previous_link[peer] = link
+                    heapq.heappush(heap, (peer_dist, peer))
+        else:
+            return None
+
+        if destination == source:
+            return None
+
+        nodes = [destination]
+        links = []
+        node = destination
+        while node != source:
+            link = previous_link[node]
+            links.append(link)
+            node = self.sources[link]
+            nodes.append(node)
+        nodes.reverse()
+        links.reverse()
+        return nodes, links
+
+    def link_port(self, link):
+        ''' Returns the (dpid, port_no) of a link index '''
+        return self.dpids[self.sources[link]], self.ports[link]
+
+    def path_capacity(self, links):
+        capacity = self.capacity_maxflow
+        return min(capacity[link] for link in links)
+
+    def path_latency(self, links):
+        latency = self.latency
+        return sum(latency[link] for link in links)
+
+    def decrease_capacity(self, links, amount):
+        capacity = self.capacity_maxflow
+        for link in links:
+            capacity[link] -= amount
+
+    def restore_capacities(self):
+        '''
+        Resets the residual capacities decreased by the algorithm
+        '''
+        self.capacity_maxflow = array('d', self.capacity)
@@ -0,0 +1,149 @@
+#!/usr/bin/python
+
+import heapq
+import logging
+
+__author__ = 'Dario Banfi'
+__license__ = 'Apache 2.0'
+__version__ = '1.0'
+__email__ = 'dario.banfi@tum.de'
+
+'''
+OpenFlow group id allocation. Every datapath has its own id space,
+ids are handed out from a free list (lowest first) and then from a
+counter, so they stay dense and are reused once their group is
+deleted. Groups are identified by a key, e.g. (node, src, dst, in_port),
+and reference counted: the id is freed when the last holder releases
+its key. A freed id is retired until the switch confirms the deletion
+of its group, otherwise the deletion and the creation of the next group
+using it would be sent together
+'''
+
+logger = logging.getLogger(__name__)
+
+# Highest group id a switch accepts, OFPG_MAX in OpenFlow 1.3
+MAX_GROUP_ID = 0xffffff00
+
+
+class GroupIdAllocator(object):
+
+    ''' Group ids of a single datapath '''
+
+    def __init__(self, first_id=1, max_id=MAX_GROUP_ID):
+        self.next_id = first_id
+        self.max_id = max_id
+
+        # Heap of the freed ids
+        self.free = []
+
+        # Freed ids whose group deletion is not confirmed yet
+        self.retired = []
+
+        self.used = 0
+
+    def allocate(self):
+        if self.free:
+            group_id = heapq.heappop(self.free)
+        elif self.next_id <= self.max_id:
+            group_id = self.next_id
+            self.next_id += 1
+        else:
+            raise ValueError('No group id left')
+        self.used += 1
+        return group_id
+
+    def release(self, group_id):
+        self.retired.append(group_id)
+        self.used -= 1
+
+    def take_retired(self):
+        retired = self.retired
+        self.retired = []
+        return retired
+
+    def recycle(self, group_ids):
+        '''
+        Makes retired ids available again
+        '''
+        for group_id in group_ids:
+            heapq.heappush(self.free, group_id)
+
+
+class GroupIds(object):
+
+    def __init__(self):
+        # Dpid - GroupIdAllocator
+        self.allocators = {}
+
+        # (dpid, key) - group id
+        self.ids = {}
+
+        # (dpid, key) - number of holders
+        self.references = {}
+
+    def acquire(self, dpid, key):
+        '''
+        Returns the group id of a key on a datapath, allocating it for
+        the first holder
+        '''
+        group_key = (dpid, key)
+        group_id = self.ids.get(group_key)
+        if group_id is None:
+            allocator = self.allocators.get(dpid)
+            if allocator is None:
+                allocator = self.allocators[dpid] = GroupIdAllocator()
+            group_id = self.ids[group_key] = allocator.allocate()
+            self.references[group_key] = 0
+        self.references[group_key] += 1
+        return group_id
+
+    def release(self, dpid, key):
+        '''
+        Drops a holder of a key, the id is freed with the last one.
+        Returns the freed group id or None
+        '''
+        group_key = (dpid, key)
+        if group_key not in self.references:
+            return None
+        self.references[group_key] -= 1
+        if self.references[group_key] > 0:
+            return None
+        del self.references[group_key]
+        group_id = self.ids.pop(group_key)
+        self.allocators[dpid].release(group_id)
+        return group_id
+
+    def take_retired(self):
+        '''
+        Returns the (dpid, allocator, retired ids) of the datapaths with
+        ids to recycle
+        '''
+        retired = []
+        for dpid, allocator in self.allocators.iteritems():
+            group_ids = allocator.take_retired()
+            if group_ids:
+                retired.append((dpid, allocator, group_ids))
+        return retired
+
+    def get(self, dpid, key):
+        return self.ids.get((dpid, key))
+
+    def forget_datapath(self, dpid):
+        '''
+        Drops the ids of a datapath, its group table is cleared when it
+        connects again
+        '''
+        self.allocators.pop(dpid, None)
+        for group_key in [group_key for group_key in self.ids
+                          if group_key[0] == dpid]:
+            del self.ids[group_key]
+            del self.references[group_key]
+
+    def stats(self):
+        return dict(
+            (dpid, {'used': allocator.used,
+                    'free': len(allocator.free),
+                    'retired': len(allocator.retired),
+                    'next_id': allocator.next_id})
+            for dpid, allocator in self.allocators.iteritems()
+        )
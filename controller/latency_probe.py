@@ -0,0 +1,142 @@
+#!/usr/bin/python
+
+import ctypes
+import ctypes.util
+import logging
+import struct
+import time
+
+__author__ = 'Dario Banfi'
+__license__ = 'Apache 2.0'
+__version__ = '1.0'
+__email__ = 'dario.banfi@tum.de'
+
+'''
+Binary format of the latency probe packets.
+A probe is an Ethernet header with the probe ethertype followed by
+the send dpid, the receive dpid, the output port, a sequence number
+and the monotonic send time in nanoseconds, all in network order
+'''
+
+logger = logging.getLogger(__name__)
+
+# Destination MAC of the probes, the source MAC is the send dpid
+PROBE_DST_MAC = '\x00\x00\x00\x00\x00\x01'
+
+ETHERNET_HEADER = struct.Struct('!6s6sH')
+
+# send dpid, receive dpid, output port, sequence number, send time (ns)
+PROBE_HEADER = struct.Struct('!QQIIQ')
+
+PROBE_LENGTH = ETHERNET_HEADER.size + PROBE_HEADER.size
+
+SEQUENCE_MASK = 0xffffffff
+
+
+class _Timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+def _clock_gettime_ns():
+    '''
+    Returns a monotonic_ns function using clock_gettime(CLOCK_MONOTONIC)
+    through ctypes, None if libc does not provide it
+    '''
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        clock_gettime = libc.clock_gettime
+    except (OSError, AttributeError):
+        return None
+    clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_Timespec)]
+    CLOCK_MONOTONIC = 1
+    timespec = _Timespec()
+
+    def monotonic_ns():
+        clock_gettime(CLOCK_MONOTONIC, ctypes.byref(timespec))
+        return timespec.tv_sec * 1000000000 + timespec.tv_nsec
+
+    return monotonic_ns
+
+
+if hasattr(time, 'monotonic_ns'):
+    monotonic_ns = time.monotonic_ns
+else:
+    monotonic_ns = _clock_gettime_ns()
+    if monotonic_ns is None:
+        logger.warning('No monotonic clock, probes use the wall clock')
+
+        def monotonic_ns():
+            return int(time.time() * 1000000000)
+
+
+class LatencyProbes(object):
+
+    '''
+    Builds and parses the probe packets. The Ethernet header of every
+    switch is built once, the last sequence number received on every
+    link is kept to drop duplicated and reordered probes
+    '''
+
+    def __init__(self, ethertype):
+        self.ethertype = ethertype
+
+        # Dpid - Ethernet header of the probes sent by the switch
+        self.headers = {}
+
+        self.sequence = 0
+
+        # (send dpid, port) - last received sequence number
+        self.last_sequence = {}
+
+    def ethernet_header(self, dpid):
+        header = self.headers.get(dpid)
+        if header is None:
+            src = struct.pack('!Q', dpid)[2:]
+            header = ETHERNET_HEADER.pack(PROBE_DST_MAC, src, self.ethertype)
+            self.headers[dpid] = header
+        return header
+
+    def forget_datapath(self, dpid):
+        self.headers.pop(dpid, None)
+        for link in [link for link in self.last_sequence if link[0] == dpid]:
+            del self.last_sequence[link]
+
+    def build(self, send_dpid, recv_dpid, port_no):
+        '''
+        Returns the probe packet bytes, stamped with the current time
+        '''
+        self.sequence = (self.sequence + 1) & SEQUENCE_MASK
+        return self.ethernet_header(send_dpid) + PROBE_HEADER.pack(
+            send_dpid, recv_dpid, port_no, self.sequence, monotonic_ns())
+
+    def parse(self, data):
+        '''
+        Returns (send dpid, recv dpid, port_no, sequence, delay in
+        seconds) of a probe, None if it is truncated. Nothing is
+        trusted yet, see accept
+        '''
+        receive_time = monotonic_ns()
+        if len(data) < PROBE_LENGTH:
+            return None
+        send_dpid, recv_dpid, port_no, sequence, send_time = \
+            PROBE_HEADER.unpack_from(data, ETHERNET_HEADER.size)
+
+        return send_dpid, recv_dpid, port_no, sequence, \
+            (receive_time - send_time) / 1e9
+
+    def accept(self, send_dpid, port_no, sequence):
+        '''
+        Records the sequence of a probe received on its link, False if
+        it is older than the last probe received on the same link.
+        Only probes checked against the receiving port are accepted,
+        a forged sequence would otherwise reject the genuine probes
+        '''
+        link = (send_dpid, port_no)
+        last = self.last_sequence.get(link)
+        if last is not None:
+            # Serial number arithmetic, the counter wraps around
+            step = (sequence - last) & SEQUENCE_MASK
+            if step == 0 or step > SEQUENCE_MASK >> 1:
+                return False
+        self.last_sequence[link] = sequence
+        return True
@@ -0,0 +1,147 @@
+#!/usr/bin/python
+
+import heapq
+import logging
+import random
+
+__author__ = 'Dario Banfi'
+__license__ = 'Apache 2.0'
+__version__ = '1.0'
+__email__ = 'dario.banfi@tum.de'
+
+'''
+Scheduler of the network monitor requests. Port stats and echo
+requests are sent per switch, flow and group stats per edge switch and
+latency probes per link, each task with its own jittered deadline so
+that the requests are spread over time instead of being sent in
+bursts. The port stats interval of a switch adapts to the utilization
+and volatility of its ports: from MONITORING_MAX_INTERVAL when idle to
+MONITORING_MIN_INTERVAL when busy
+'''
+
+logger = logging.getLogger(__name__)
+
+# A port whose rate moves away from its average by 1/VOLATILITY_WEIGHT
+# of the port capacity counts as fully active
+VOLATILITY_WEIGHT = 4
+
+# Longest sleep of the monitor loop, new switches and stop requests
+# are seen within it
+MAX_SLEEP = 1.0
+
+STATS = 'stats'
+PROBE = 'probe'
+ECHO = 'echo'
+FLOWS = 'flows'
+
+
+class MonitorScheduler(object):
+
+    def __init__(self, controller, seed=None):
+        self.controller = controller
+        self.rng = random.Random(seed)
+
+        # (due time, task), tasks are (STATS, dpid), (ECHO, dpid),
+        # (FLOWS, dpid) for the edge switches and (PROBE, dpid, port_no)
+        self.heap = []
+
+        # Task - deadline, only the tasks of the current topology.
+        # Heap entries without a matching deadline are dropped
+        self.deadlines = {}
+
+        # Dpid - activity of the ports between 0 (idle) and 1 (busy)
+        self.activity = {}
+
+    def _jitter(self, interval):
+        jitter = self.controller.MONITORING_JITTER
+        return interval * self.rng.uniform(1 - jitter, 1 + jitter)
+
+    def stats_interval(self, dpid):
+        '''
+        Port stats interval of a switch, MONITORING_PORT_STATS_FREQUENCY
+        until its activity is known
+        '''
+        activity = self.activity.get(dpid)
+        if activity is None:
+            return self.controller.MONITORING_PORT_STATS_FREQUENCY
+        low = self.controller.MONITORING_MIN_INTERVAL
+        high = self.controller.MONITORING_MAX_INTERVAL
+        return high - activity * (high - low)
+
+    def interval(self, task):
+        if task[0] == STATS:
+            return self.stats_interval(task[1])
+        if task[0] == ECHO:
+            return self.controller.MONITORING_ECHO_INTERVAL
+        if task[0] == FLOWS:
+            return self.controller.MONITORING_FLOW_STATS_INTERVAL
+        return self.controller.MONITORING_PROBE_INTERVAL
+
+    def sync(self, dpid_to_switch, now):
+        '''
+        Schedules the tasks of new switches and links, the first
+        deadline is random within the first port stats interval. Called
+        by the monitor when the topology changed
+        '''
+        tasks = set()
+        for dpid, switch in dpid_to_switch.iteritems():
+            tasks.add((STATS, dpid))
+            tasks.add((ECHO, dpid))
+            if switch.edge_port:
+                tasks.add((FLOWS, dpid))
+            for port_no in switch.peer_to_local_port.itervalues():
+                tasks.add((PROBE, dpid, port_no))
+
+        spread = self.controller.MONITORING_PORT_STATS_FREQUENCY
+        for task in tasks.difference(self.deadlines):
+            self._schedule(task, now + self.rng.uniform(0, spread))
+        for task in set(self.deadlines).difference(tasks):
+            del self.deadlines[task]
+            if task[0] == STATS:
+                self.activity.pop(task[1], None)
+
+    def _schedule(self, task, deadline):
+        self.deadlines[task] = deadline
+        heapq.heappush(self.heap, (deadline, task))
+
+    def pop_due(self, now):
+        '''
+        Returns the tasks due at now and schedules their next run
+        '''
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            deadline, task = heapq.heappop(self.heap)
+            if self.deadlines.get(task) != deadline:
+                continue
+            due.append(task)
+            self._schedule(task, now + self._jitter(self.interval(task)))
+        return due
+
+    def sleep_time(self, now):
+        if not self.heap:
+            return MAX_SLEEP
+        return min(max(self.heap[0][0] - now, 0), MAX_SLEEP)
+
+    def update_activity(self, switch):
+        '''
+        Computes the activity of a switch from the port statistics,
+        the highest utilization or weighted volatility of its ports
+        '''
+        activity = 0
+        for port in switch.ports.itervalues():
+            stats = port.stats
+            last = stats.last_rate()
+            if last is None or stats.ewma is None or not port.max_capacity:
+                continue
+            utilization = stats.ewma / port.max_capacity
+            volatility = abs(last - stats.ewma) / port.max_capacity
+            activity = max(activity, utilization,
+                           volatility * VOLATILITY_WEIGHT)
+        self.activity[switch.dp.id] = min(max(activity, 0), 1)
+
+    def stats(self):
+        return dict(
+            (task[1], {'activity': self.activity.get(task[1]),
+                       'interval': self.stats_interval(task[1])})
+            for task in self.deadlines if task[0] == STATS
+        )
@@ -8,11 +8,21 @@ from ryu.ofproto import ofproto_v1_3
 from ryu.lib import hub
 from ryu.topology import event
 from network_topology import NetworkTopology
-from ryu.topology.switches import LLDPPacket
-from ryu.lib.packet import (packet, ethernet, arp, icmp, icmpv6, ipv4, ipv6)
+from send_queue import OpenFlowSender
+from flow_table import COOKIE_TAG, TAG_MASK
+from latency_probe import LatencyProbes
+from punt_budget import PuntBudgets
+from monitor_scheduler import MonitorScheduler, STATS, PROBE, ECHO, FLOWS
+from echo_calibration import EchoCalibrator
+from stats_requests import StatsRequestTracker
+from recompute_trigger import RecomputeTrigger
+from bulk_configuration import Configuration, ConfigurationError
+from ryu.lib.packet import (packet, ethernet, arp, icmp, icmpv6, ipv4, ipv6,
+                            ether_types)
 from ryu.app.wsgi import ControllerBase, WSGIApplication, route
 from webob import Response
 import json
+import struct
 import time
 import traceback
 
@@ -28,6 +38,12 @@ __email__ = 'dario.banfi@tum.de'
 
 API_INSTANCE_NAME = 'mp_controller_api_app'
 
+# Raw Ethernet header layout used by the packet-in dispatcher
+ETHERNET_HEADER_LENGTH = 14
+ETHERTYPE_OFFSET = 12
+VLAN_TAG_LENGTH = 4
+ETHERTYPE = struct.Struct('!H')
+
 
 class MultipathController(app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
@@ -39,6 +55,18 @@ class MultipathController(app_manager.RyuApp):
         # Random ethertype to evaluate latency
         self.PROBE_ETHERTYPE = 0x07C7
 
+        # Builds and parses the binary latency probes
+        self.probes = LatencyProbes(self.PROBE_ETHERTYPE)
+
+        # Ethertype - packet-in handler
+        self.packet_in_handlers = {
+            self.PROBE_ETHERTYPE: self._packet_in_probe,
+            ether_types.ETH_TYPE_LLDP: self._packet_in_lldp,
+            ether_types.ETH_TYPE_ARP: self._packet_in_arp,
+            ether_types.ETH_TYPE_IP: self._packet_in_ipv4,
+            ether_types.ETH_TYPE_IPV6: self._packet_in_ipv6,
+        }
+
         # Set to true once there is enoough informatio
         # to start multipath computation
         self.network_is_measured = False
@@ -64,24 +92,176 @@ class MultipathController(app_manager.RyuApp):
         # Maximum paths allowed for a multipath flow
         self.MAX_PATHS_PER_MULTIPATH_FLOW = 2
 
-        # Recalculates bucket only on addition or failures in the topology
+        # Path finding algorithm, one of network_topology.ALGORITHMS
+        self.PATH_FINDING_ALGORITHM = 'snapshot_dijkstra'
+
+        # Computes all-pairs latency/capacity matrices (requires numpy)
+        # to skip unreachable pairs and prune the path searches
+        self.USE_PATH_MATRICES = True
+
+        # Candidate paths computed per couple by the 'yen' algorithm
+        self.K_SHORTEST_PATHS = 8
+
+        # Constraint between the paths of a multipath flow chosen by the
+        # 'yen' algorithm: None, 'link', 'node' or 'srlg'
+        self.PATH_DISJOINTNESS = None
+
+        # Shared risk link groups, name - list of [dpid, port_no] links
+        # failing together, used by the 'srlg' disjointness
+        self.SHARED_RISK_LINK_GROUPS = {}
+
+        # Worker processes computing the edge pairs in parallel,
+        # 0 or 1 computes them in the controller process. Only used by
+        # snapshot based algorithms, experimental (see path_workers)
+        self.PATH_COMPUTATION_WORKERS = 0
+
+        # Routes all the edge couples together with a multi-commodity
+        # flow sharing the link capacities according to the traffic
+        # matrix, instead of giving every couple the full capacity.
+        # Every computation recomputes all the couples
+        self.GLOBAL_MULTICOMMODITY_FLOW = False
+
+        # Accuracy and maximum number of phases of the multi-commodity
+        # flow approximation, smaller epsilon needs more phases
+        self.MULTICOMMODITY_FLOW_EPSILON = 0.2
+        self.MULTICOMMODITY_FLOW_MAX_PHASES = 200
+
+        # Routes kept by the path cache, least recently used are evicted
+        self.PATH_CACHE_SIZE = 10000
+
+        # Relative latency change of a link which invalidates the cached
+        # routes, smaller changes keep the routes
+        self.PATH_CACHE_LATENCY_TOLERANCE = 0.1
+
+        # Protects the next hops of the multipath rules with fast-failover
+        # groups towards a loop free alternate neighbor, plus fallback
+        # rules along the lowest latency tree to every destination, so
+        # the switches reroute as soon as a port goes down. Adds a group
+        # per next hop and two fallback rules per destination on every
+        # switch
+        self.USE_FAST_FAILOVER = False
+
+        # Recalculates bucket only on addition or failures in the topology,
+        # port capacity changes are ignored
         self.UPDATE_FORWARDING_ON_TOPOLOGY_CHANGE_ONLY = False
 
         # Recomputes forwarding continuously reardless of congestion/failures
         self.UPDATE_FORWARDING_CONTINOUSLY = False
 
+        # Topology and capacity changes trigger one recomputation once
+        # no change arrived for RECOMPUTE_QUIET_PERIOD seconds, at most
+        # RECOMPUTE_MAX_DELAY seconds after the first change
+        self.USE_RECOMPUTE_TRIGGER = True
+        self.RECOMPUTE_QUIET_PERIOD = 1
+        self.RECOMPUTE_MAX_DELAY = 10
+
         # High priority
         self.PRIORITY_PROBE_PACKETS = 65000
 
-        # Monitoring frequency for port stats.
+        # Monitoring frequency for port stats, used until the activity
+        # of a switch is known
         self.MONITORING_PORT_STATS_FREQUENCY = 5
 
+        # Port stats interval bounds of busy and idle switches
+        self.MONITORING_MIN_INTERVAL = 1
+        self.MONITORING_MAX_INTERVAL = 20
+
+        # Latency probe interval of every link
+        self.MONITORING_PROBE_INTERVAL = 150
+
+        # Flow and group stats interval of the edge switches, used to
+        # build the traffic matrix
+        self.MONITORING_FLOW_STATS_INTERVAL = 10
+
+        # Echo request interval of every switch, the echo RTT is the
+        # controller to switch delay subtracted from the probes
+        self.MONITORING_ECHO_INTERVAL = 2
+        self.echo_calibrator = EchoCalibrator()
+
+        # Random variation of the intervals, as a fraction
+        self.MONITORING_JITTER = 0.2
+
+        # Spreads the stats requests and probes over time
+        self.monitor_scheduler = MonitorScheduler(self)
+
+        # Seconds after which a stats request without reply is retried
+        self.STATS_REQUEST_TIMEOUT = 2
+
+        # Retries before a switch is flagged as unresponsive and left
+        # out of the path computation
+        self.STATS_REQUEST_RETRIES = 2
+
+        # In-flight stats requests by xid
+        self.stats_requests = StatsRequestTracker(self)
+        self.stats_requesters = {
+            'port': self._request_port_stats,
+            'meter': self._request_meter_stats,
+            'flow': self._request_flow_stats,
+            'group': self._request_group_stats,
+        }
+
         self.MONITORING_PORT_STATS = False
 
+        # Utilization used to estimate the port capacity: 'last',
+        # 'ewma', 'peak' or a percentile like 'p95' of the rates in the
+        # last PORT_STATS_WINDOW seconds
+        self.PORT_UTILIZATION_ESTIMATE = 'ewma'
+        self.PORT_STATS_WINDOW = 30
+
+        # Fraction of the max capacity a port capacity has to change
+        # by to recompute the paths crossing it
+        self.PORT_CAPACITY_CHANGE_THRESHOLD = 0.05
+
+        # Installs OpenFlow meters rate limiting the table-miss and the
+        # probe rules. Requires meter support in the switches: the ones
+        # without it reject the rules referencing the meters, probes
+        # are then never received and no path is ever computed
+        self.USE_PUNT_METERS = False
+
+        # Meter ids and rates (packets/s) of the table-miss and probe
+        # rules, probes have their own meter so punt storms cannot
+        # starve them
+        self.METER_ID_TABLE_MISS = 1
+        self.PUNT_METER_RATE = 1000
+        self.PUNT_METER_BURST = 100
+        self.METER_ID_PROBES = 2
+        self.PROBE_METER_RATE = 1000
+        self.PROBE_METER_BURST = 100
+
+        # Packet-in events handled per second and per switch, probes
+        # are not counted
+        self.PUNT_BUDGET_RATE = 500
+        self.PUNT_BUDGET_BURST = 100
+
+        # Probes handled per second and per switch, a switch receives
+        # one probe per link every MONITORING_PROBE_INTERVAL, the burst
+        # covers the probes sent to all the peers at once
+        self.PROBE_BUDGET_RATE = 10
+        self.PROBE_BUDGET_BURST = 100
+        self.punt_budgets = PuntBudgets(self)
+
+        # Messages sent to a switch before waiting for a barrier reply
+        self.SEND_BATCH_SIZE = 50
+
+        # Batches which can wait for a barrier reply at the same time
+        self.SEND_MAX_OUTSTANDING_BATCHES = 2
+
+        # Seconds after which an unanswered barrier is given up
+        self.SEND_BARRIER_TIMEOUT = 5
+
+        # Queues and batches flow/group messages for every datapath
+        self.sender = OpenFlowSender(self)
+
         # Used for REST APIs
         wsgi = kwargs['wsgi']
         wsgi.register(MultipathRestController, {API_INSTANCE_NAME: self})
 
+        # Coalesces the change events into single recomputations
+        self.recompute_trigger = RecomputeTrigger(self, self.compute_paths)
+
+        # The computations yield to the hub, one runs at a time
+        self.computation_lock = hub.Semaphore()
+
         # Holds the topology data and structure
         self.topo_shape = NetworkTopology(self)
 
@@ -102,21 +282,55 @@ class MultipathController(app_manager.RyuApp):
         # Multipath computation module
         hub.spawn_after(5, self.multipath_computation)
 
-    def add_flow(self, datapath, priority, match, actions, buffer_id=None):
+    def add_flow(self, datapath, priority, match, actions, buffer_id=None,
+                 command=None, meter_id=None, cookie=0):
         ''' Adds a flow to a datapath '''
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
 
+        if command is None:
+            command = ofproto.OFPFC_ADD
+
         inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS,
                                              actions)]
+        if meter_id is not None:
+            inst.insert(0, parser.OFPInstructionMeter(meter_id,
+                                                      ofproto.OFPIT_METER))
         if buffer_id:
             mod = parser.OFPFlowMod(datapath=datapath, buffer_id=buffer_id,
+                                    cookie=cookie, command=command,
                                     priority=priority, match=match,
                                     instructions=inst)
         else:
-            mod = parser.OFPFlowMod(datapath=datapath, priority=priority,
+            mod = parser.OFPFlowMod(datapath=datapath, cookie=cookie,
+                                    command=command, priority=priority,
                                     match=match, instructions=inst)
-        datapath.send_msg(mod)
+        self.sender.send(datapath, mod)
+
+    def delete_flow(self, datapath, priority, match):
+        ''' Deletes the flow with exactly this priority and match '''
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+
+        mod = parser.OFPFlowMod(datapath=datapath,
+                                command=ofproto.OFPFC_DELETE_STRICT,
+                                priority=priority, match=match,
+                                out_port=ofproto.OFPP_ANY,
+                                out_group=ofproto.OFPG_ANY)
+        self.sender.send(datapath, mod)
+
+    def delete_flows_by_cookie(self, datapath, cookie, cookie_mask):
+        ''' Deletes the flows of every table matching a masked cookie '''
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+
+        mod = parser.OFPFlowMod(datapath=datapath, cookie=cookie,
+                                cookie_mask=cookie_mask,
+                                table_id=ofproto.OFPTT_ALL,
+                                command=ofproto.OFPFC_DELETE,
+                                out_port=ofproto.OFPP_ANY,
+                                out_group=ofproto.OFPG_ANY)
+        self.sender.send(datapath, mod)
 
     def _send_packet(self, datapath, port, pkt):
         ''' Instructs a datapath to output a packet to one of his ports '''
@@ -141,17 +355,33 @@ class MultipathController(app_manager.RyuApp):
         for dp_id, switch in self.topo_shape.dpid_to_switch.iteritems():
             switch.edge_port = len(switch.ports.keys())
 
-    def multipath_computation(self):
-        while True:
+    def request_recomputation(self, reason):
+        '''
+        Reports a change which needs the paths to be recomputed, see
+        RecomputeTrigger. Changes before the network is measured are
+        covered by the first computation, the continuous computation
+        picks them up by itself
+        '''
+        if self.USE_RECOMPUTE_TRIGGER and self.network_is_measured and \
+                not self.UPDATE_FORWARDING_CONTINOUSLY:
+            self.recompute_trigger.notify(reason)
+
+    def compute_paths(self):
+        with self.computation_lock:
             if not self.topo_shape.is_empty() and self.network_is_measured:
                 computation_start = time.time()
-                self.logger.info('Starting multipath computation sub-routine')
+                self.logger.info('Starting multipath computation '
+                                 'sub-routine')
                 self.topo_shape.multipath_computation()
                 self.logger.info(
                     'Multipath computation finished in %f seconds',
                     time.time() - computation_start
                 )
 
+    def multipath_computation(self):
+        while True:
+            self.compute_paths()
+
             self.MONITORING_PORT_STATS = True
             if self.UPDATE_FORWARDING_CONTINOUSLY:
                 hub.sleep(10)
@@ -165,14 +395,54 @@ class MultipathController(app_manager.RyuApp):
 
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
+
+        # Groups left by a previous connection would collide with the
+        # group ids allocated from scratch, their multipath flows are
+        # not in the shadow tables anymore (see forget_datapath)
+        self.sender.send(datapath, parser.OFPGroupMod(
+            datapath, command=ofproto.OFPGC_DELETE,
+            group_id=ofproto.OFPG_ALL))
+        self.delete_flows_by_cookie(datapath, COOKIE_TAG, TAG_MASK)
+
+        table_miss_meter = None
+        probe_meter = None
+        if self.USE_PUNT_METERS:
+            self.add_punt_meter(datapath, self.METER_ID_TABLE_MISS,
+                                self.PUNT_METER_RATE, self.PUNT_METER_BURST)
+            self.add_punt_meter(datapath, self.METER_ID_PROBES,
+                                self.PROBE_METER_RATE, self.PROBE_METER_BURST)
+            table_miss_meter = self.METER_ID_TABLE_MISS
+            probe_meter = self.METER_ID_PROBES
+
         match = parser.OFPMatch()
         actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER)]
-        self.add_flow(datapath, 1, match, actions)
+        self.add_flow(datapath, 1, match, actions, meter_id=table_miss_meter)
 
         # Installing the flow rules to send latency probe packets
         match = parser.OFPMatch(eth_type=self.PROBE_ETHERTYPE)
         actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER)]
-        self.add_flow(datapath, self.PRIORITY_PROBE_PACKETS, match, actions)
+        self.add_flow(datapath, self.PRIORITY_PROBE_PACKETS, match, actions,
+                      meter_id=probe_meter)
+
+    def add_punt_meter(self, datapath, meter_id, rate, burst):
+        '''
+        (Re)creates a packets per second meter dropping above rate
+        '''
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+
+        # A meter left by a previous connection would make the add fail
+        self.sender.send(datapath, parser.OFPMeterMod(
+            datapath, command=ofproto.OFPMC_DELETE, meter_id=meter_id))
+
+        bands = [parser.OFPMeterBandDrop(rate=rate, burst_size=burst)]
+        self.sender.send(datapath, parser.OFPMeterMod(
+            datapath,
+            command=ofproto.OFPMC_ADD,
+            flags=ofproto.OFPMF_PKTPS | ofproto.OFPMF_BURST,
+            meter_id=meter_id,
+            bands=bands
+        ))
 
     def add_default_for_all(self):
         for dpid, s in self.topo_shape.dpid_to_switch:
@@ -181,6 +451,13 @@ class MultipathController(app_manager.RyuApp):
     def stop_monitoring(self):
         self.keep_monitoring = False
 
+    def close(self):
+        '''
+        Called by the app manager when the application stops
+        '''
+        self.stop_monitoring()
+        self.topo_shape.close_workers()
+
 
 
     ##########################################
@@ -193,8 +470,34 @@ class MultipathController(app_manager.RyuApp):
         Switch features handler callback
         '''
         self.logger.debug('EventOFPSwitchFeatures')
-        self.add_default_flows(ev.msg.datapath)
+        datapath = ev.msg.datapath
+
+        # A switch connecting again is wiped by add_default_flows, what
+        # the controller knows about its previous connection is dropped
+        self.forget_datapath(datapath.id)
+        self.topo_shape.update_datapath(datapath)
+        self.add_default_flows(datapath)
+
+    def forget_datapath(self, dpid):
+        '''
+        Drops the queued messages, the shadow tables, the group ids and
+        the measurement state of a datapath
+        '''
+        self.sender.forget_datapath(dpid)
+        self.topo_shape.forget_datapath(dpid)
+        self.probes.forget_datapath(dpid)
+        self.stats_requests.forget_datapath(dpid)
+        self.echo_calibrator.forget_datapath(dpid)
+        self.punt_budgets.forget_datapath(dpid)
+
 
+    @set_ev_cls(ofp_event.EventOFPBarrierReply,
+                [CONFIG_DISPATCHER, MAIN_DISPATCHER])
+    def barrier_reply_handler(self, ev):
+        '''
+        Barrier reply callback, confirms a batch of sent messages
+        '''
+        self.sender.barrier_reply(ev.msg.datapath, ev.msg.xid)
 
     @set_ev_cls(event.EventSwitchEnter, MAIN_DISPATCHER)
     def switch_enter_handler(self, event):
@@ -204,6 +507,7 @@ class MultipathController(app_manager.RyuApp):
     @set_ev_cls(event.EventSwitchLeave, MAIN_DISPATCHER)
     def switch_leave_handler(self, event):
         self.logger.debug('EventSwitchLeave')
+        self.forget_datapath(event.switch.dp.id)
 
         # Redundant for Mininet emulated network since
         # you cannot remove switches/link once the topology
@@ -218,12 +522,10 @@ class MultipathController(app_manager.RyuApp):
 
     @set_ev_cls(event.EventLinkDelete, MAIN_DISPATCHER)
     def link_delete_handler(self, event):
-        self.logger.debug('EventLinkDelete %s' % event)
-        # Redundant for Mininet emulated network since
-        # you cannot remove switches/link once the topology
-        # has started
-
-        # self.topo_shape.remove_link(event)
+        self.logger.info('EventLinkDelete %s' % event)
+        # The fast-failover groups already reroute the traffic, the
+        # paths are recomputed without the link by the trigger
+        self.topo_shape.remove_link(event)
 
     @set_ev_cls(event.EventPortAdd, MAIN_DISPATCHER)
     def port_add_handler(self, event):
@@ -232,13 +534,8 @@ class MultipathController(app_manager.RyuApp):
 
     @set_ev_cls(event.EventPortDelete, MAIN_DISPATCHER)
     def port_delete_handler(self, event):
-        self.logger.debug('EventPortDelete')
-
-        # Redundant for Mininet emulated network since
-        # you cannot remove switches/link once the topology
-        # has started
-
-        # self.topo_shape.remove_port(event.port)
+        self.logger.info('EventPortDelete')
+        self.topo_shape.remove_port(event.port)
 
     ##########################################
     #              NETWORK MONITORING        #
@@ -256,29 +553,49 @@ class MultipathController(app_manager.RyuApp):
         # Then we start the periodic measurement of RTT times and port
         # utilization
 
-        counter = 0
+        scheduler = self.monitor_scheduler
+        synced_version = None
         while self.keep_monitoring:
-            if not self.topo_shape.is_empty():
-                self.logger.debug('Requesting port stats to '
-                                  'measure utilization')
-                self.logger.info('\n------------------')
-                for dpid, s in self.topo_shape.dpid_to_switch.iteritems():
-
-                    s.port_stats_request_time = time.time()
-
+            now = time.time()
+            # The tasks only change with the switches, links and edge
+            # ports
+            if synced_version != self.topo_shape.topology_version:
+                synced_version = self.topo_shape.topology_version
+                scheduler.sync(self.topo_shape.dpid_to_switch, now)
+            for task in scheduler.pop_due(now):
+                s = self.topo_shape.dpid_to_switch.get(task[1])
+                if s is None:
+                    continue
+
+                if task[0] == STATS:
                     # Requesting portstats to calculate controller
                     # to switch delay and congeston
-                    # if self.MONITORING_PORT_STATS:
                     self._request_port_stats(s)
+                    if self.USE_PUNT_METERS:
+                        self._request_meter_stats(s)
 
-                    # Calculating peering switches RTT (once every 10 portstats
-                    # so ~10 secs)
-                    if counter % 30 == 0:
-                        self.send_latency_probe_packet(s)
+                elif task[0] == ECHO:
+                    self.echo_calibrator.send(s.dp)
 
-                counter += 1
+                elif task[0] == FLOWS:
+                    if s.edge_port:
+                        self._request_flow_stats(s)
+                        self._request_group_stats(s)
 
-            hub.sleep(self.MONITORING_PORT_STATS_FREQUENCY)
+                elif task[0] == PROBE:
+                    # Calculating peering switches RTT
+                    port = s.ports.get(task[2])
+                    peer_switch = port and self.topo_shape.dpid_to_switch.get(
+                        port.peer_switch_dpid)
+                    if peer_switch in s.peer_to_local_port:
+                        self.send_latency_probe(s, peer_switch, task[2])
+
+            for datapath, kind, attempt in self.stats_requests.expire():
+                s = self.topo_shape.dpid_to_switch.get(datapath.id)
+                if s is not None:
+                    self.stats_requesters[kind](s, attempt)
+
+            hub.sleep(scheduler.sleep_time(time.time()))
 
         self.logger.info('Stopping monitor')
 
@@ -300,54 +617,62 @@ class MultipathController(app_manager.RyuApp):
         self.logger.info('Injecting latency probe packets')
 
         for peer_switch, peer_port in switch.peer_to_local_port.iteritems():
+            self.send_latency_probe(switch, peer_switch, peer_port)
 
-            self.logger.debug('Sending probe packet from %s to %s through '
-                              ' port %s',
-                              switch, peer_switch, peer_port
-                              )
-
-            actions = [switch.dp.ofproto_parser.OFPActionOutput(peer_port)]
-
-            pkt = packet.Packet()
-            pkt.add_protocol(ethernet.ethernet(ethertype=self.PROBE_ETHERTYPE,
-                                               dst=0x000000000001,
-                                               src=0x000000000000)
-                             )
-
-            pkt.serialize()
-            payload = '%d;%d;%f' % (
-                switch.dp.id, peer_switch.dp.id, time.time())
-            data = pkt.data + payload
-
-            out = switch.dp.ofproto_parser.OFPPacketOut(
-                datapath=switch.dp,
-                buffer_id=switch.dp.ofproto.OFP_NO_BUFFER,
-                data=data,
-                in_port=switch.dp.ofproto.OFPP_CONTROLLER,
-                actions=actions
-            )
+    def send_latency_probe(self, switch, peer_switch, peer_port):
+        '''
+        Injects a latency probe packet on the link to peer_switch
+        '''
+        self.logger.debug('Sending probe packet from %s to %s through '
+                          ' port %s',
+                          switch, peer_switch, peer_port
+                          )
+
+        actions = [switch.dp.ofproto_parser.OFPActionOutput(peer_port)]
+        data = self.probes.build(switch.dp.id, peer_switch.dp.id, peer_port)
+
+        out = switch.dp.ofproto_parser.OFPPacketOut(
+            datapath=switch.dp,
+            buffer_id=switch.dp.ofproto.OFP_NO_BUFFER,
+            data=data,
+            in_port=switch.dp.ofproto.OFPP_CONTROLLER,
+            actions=actions
+        )
 
-            switch.dp.send_msg(out)
+        switch.dp.send_msg(out)
 
-    def probe_packet_handler(self, pkt):
+    def probe_packet_handler(self, msg):
         '''
-        Handles a latency probe packets and computes the
-        delay between two switches
+        Handles a latency probe packet-in and computes the delay
+        between two switches. Returns False if the probe does not come
+        from a known link: it must be received by recv_dpid on the port
+        peering with send_dpid, which sent it on port_no
         '''
-        try:
-            receive_time = time.time()
-            # Ignoring 14 bytes of ethernet header
-            data = pkt.data[14:].split(';')
-            send_dpid = int(data[0])
-            recv_dpid = int(data[1])
-            inc_time = float(data[2])
-            sample_delay = receive_time - inc_time
-            self.topo_shape.dpid_to_switch[send_dpid].calculate_delay_to_peer(
-                self.topo_shape.dpid_to_switch[recv_dpid], sample_delay)
-            self.network_is_measured = True
-        except:
-            traceback.print_exc()
-            self.logger.error('Unable to parse incoming probe packet')
+        probe = self.probes.parse(msg.data)
+        if probe is None:
+            self.logger.debug('Dropping truncated probe')
+            return False
+        send_dpid, recv_dpid, port_no, sequence, sample_delay = probe
+
+        switch = self.topo_shape.dpid_to_switch.get(send_dpid)
+        peer_switch = self.topo_shape.dpid_to_switch.get(recv_dpid)
+        if recv_dpid != msg.datapath.id or switch is None or \
+                peer_switch is None or \
+                switch.peer_to_local_port.get(peer_switch) != port_no or \
+                peer_switch.peer_to_local_port.get(switch) != \
+                msg.match['in_port']:
+            self.logger.debug('Probe from unknown link %s - %s',
+                              send_dpid, recv_dpid)
+            return False
+
+        if not self.probes.accept(send_dpid, port_no, sequence):
+            self.logger.debug('Dropping outdated probe')
+            return True
+
+        self.topo_shape.update_link_latency(switch, peer_switch,
+                                            sample_delay)
+        self.network_is_measured = True
+        return True
 
     @set_ev_cls(ofp_event.EventOFPPortStatsReply, MAIN_DISPATCHER)
     def _port_stats_reply_handler(self, ev):
@@ -356,40 +681,51 @@ class MultipathController(app_manager.RyuApp):
         '''
 
         ports = ev.msg.body
-        port_stats_reply_time = time.time()
 
-        # Calculate switch-controller RTT
-        switch = self.topo_shape.dpid_to_switch[ev.msg.datapath.id]
-        switch.calculate_delay_to_controller(port_stats_reply_time)
+        switch = self._stats_reply_switch(ev.msg)
+        if switch is None:
+            return
 
-        sorted_port_table = sorted(ports, key=lambda l: l.port_no)
-        for stat in sorted_port_table:
-            if stat.port_no not in switch.ports:
+        receive_time = time.time()
+        for stat in ports:
+            port = switch.ports.get(stat.port_no)
+            if port is None:
                 continue
-            port = switch.ports[stat.port_no]
-            utilization = stat.tx_bytes + stat.rx_bytes
 
-            if port.last_request_time:
-                timedelta = port_stats_reply_time - port.last_request_time
-                datadelta = utilization - port.last_utilization_value
+            # Rates use the port duration reported by the switch
+            if port.stats.append(stat, receive_time) is None:
+                continue
 
-                utilization_bps = datadelta / timedelta
-                port.capacity = port.max_capacity - utilization_bps
+            utilization_bps = port.stats.estimate(
+                self.PORT_UTILIZATION_ESTIMATE, self.PORT_STATS_WINDOW)
+            capacity = port.max_capacity - utilization_bps
+
+            # Small variations do not trigger a recomputation
+            if abs(capacity - port.capacity) > \
+                    self.PORT_CAPACITY_CHANGE_THRESHOLD * port.max_capacity:
+                port.capacity = capacity
+                self.topo_shape.port_capacity_changed(
+                    switch.dp.id, stat.port_no)
+
+            self.logger.debug(
+                's[%s] p[%d] utilization %2.f max_capacity %s',
+                switch.dp.id, stat.port_no,
+                utilization_bps,
+                port.max_capacity
+            )
 
-                self.logger.info(
-                    's[%s] p[%d] utilization %2.f max_capacity %s',
-                    switch.dp.id, stat.port_no,
-                    utilization_bps,
-                    port.max_capacity
-                )
-            port.last_request_time = port_stats_reply_time
-            port.last_utilization_value = utilization
+        # Adapting the polling interval of the switch
+        self.monitor_scheduler.update_activity(switch)
 
     @set_ev_cls(ofp_event.EventOFPFlowStatsReply, MAIN_DISPATCHER)
     def _flow_stats_reply_handler(self, ev):
         '''
-        Handles a FLOW STATS reply
+        Handles a FLOW STATS reply of an ingress switch, updates the
+        traffic matrix
         '''
+        switch = self._stats_reply_switch(ev.msg)
+        if switch is None:
+            return
 
         self.logger.debug(
             'Receive flow stats response from: %016x at t: %f',
@@ -397,30 +733,26 @@ class MultipathController(app_manager.RyuApp):
             time.time()
         )
 
-        body = ev.msg.body
-
-        self.logger.debug('datapath         '
-                          'in-port  eth-dst         '
-                          'out-port packets  bytes')
-
-        self.logger.debug('---------------- '
-                          '-------- ----------------- '
-                          '-------- -------- --------')
-
-        self.logger.debug(ev.msg.body)
-        for stat in sorted(
-            [flow for flow in body if flow.priority == 1],
-            key=lambda flow: (flow.match['in_port'], flow.match['eth_dst'])
-        ):
-            self.logger.info(
-                '%016x %8x %17s %8x %8d %8d',
-                ev.msg.datapath.id,
-                stat.match['in_port'], stat.match['eth_dst'],
-                stat.instructions[0].actions[0].port,
-                stat.packet_count, stat.byte_count
-            )
+        traffic_matrix = self.topo_shape.traffic_matrix
+        traffic_matrix.flow_stats_reply(
+            switch, ev.msg.body, self.topo_shape.edge_networks())
+        traffic_matrix.expire(3 * self.MONITORING_FLOW_STATS_INTERVAL)
+
+    @set_ev_cls(ofp_event.EventOFPGroupStatsReply, MAIN_DISPATCHER)
+    def _group_stats_reply_handler(self, ev):
+        '''
+        Handles a GROUP STATS reply of an ingress switch, updates the
+        path split of the traffic matrix
+        '''
+        switch = self._stats_reply_switch(ev.msg)
+        if switch is None:
+            return
+
+        self.topo_shape.traffic_matrix.group_stats_reply(
+            switch.dp.id, ev.msg.body,
+            self.topo_shape.ingress_groups(switch))
 
-    def _request_flow_stats(self, switch):
+    def _request_flow_stats(self, switch, attempt=0):
         '''
         Requests flow stats for a switch
         '''
@@ -428,11 +760,25 @@ class MultipathController(app_manager.RyuApp):
             'Request flow stats for: %016x at t: %f',
             switch.dp.id, time.time()
         )
+        ofproto = switch.dp.ofproto
+        parser = switch.dp.ofproto_parser
+        # Only the ingress rules of the multipath flows
+        match = parser.OFPMatch(in_port=switch.edge_port)
+        req = parser.OFPFlowStatsRequest(
+            switch.dp, 0, ofproto.OFPTT_ALL, ofproto.OFPP_ANY,
+            ofproto.OFPG_ANY, 0, 0, match)
+        self.stats_requests.send(switch.dp, req, 'flow', attempt)
+
+    def _request_group_stats(self, switch, attempt=0):
+        '''
+        Requests group stats for a switch
+        '''
+        ofproto = switch.dp.ofproto
         parser = switch.dp.ofproto_parser
-        req = parser.OFPFlowStatsRequest(switch.dp)
-        switch.dp.send_msg(req)
+        req = parser.OFPGroupStatsRequest(switch.dp, 0, ofproto.OFPG_ALL)
+        self.stats_requests.send(switch.dp, req, 'group', attempt)
 
-    def _request_port_stats(self, switch):
+    def _request_port_stats(self, switch, attempt=0):
         '''
         Request port statistic to a switch
         '''
@@ -443,7 +789,47 @@ class MultipathController(app_manager.RyuApp):
         ofproto = switch.dp.ofproto
         parser = switch.dp.ofproto_parser
         req = parser.OFPPortStatsRequest(switch.dp, 0, ofproto.OFPP_ANY)
-        switch.dp.send_msg(req)
+        self.stats_requests.send(switch.dp, req, 'port', attempt)
+
+    def _request_meter_stats(self, switch, attempt=0):
+        '''
+        Request the packet-in meter drop counters to a switch
+        '''
+        ofproto = switch.dp.ofproto
+        parser = switch.dp.ofproto_parser
+        req = parser.OFPMeterStatsRequest(switch.dp, 0, ofproto.OFPM_ALL)
+        self.stats_requests.send(switch.dp, req, 'meter', attempt)
+
+    def _stats_reply_switch(self, msg):
+        '''
+        Matches a stats reply with its request and updates the
+        switch-controller delay with the RTT. Returns the Switch
+        '''
+        rtt = self.stats_requests.reply(msg)
+        switch = self.topo_shape.dpid_to_switch.get(msg.datapath.id)
+        # The stats RTT includes the stats collection time, it is only
+        # used until the echo calibration has a sample
+        if switch is not None and rtt is not None and \
+                not self.echo_calibrator.calibrated(switch.dp.id):
+            switch.update_delay_to_controller(rtt)
+        return switch
+
+    @set_ev_cls(ofp_event.EventOFPEchoReply,
+                [CONFIG_DISPATCHER, MAIN_DISPATCHER])
+    def _echo_reply_handler(self, ev):
+        '''
+        Calibrates the switch-controller delay with the echo RTT
+        '''
+        dpid = ev.msg.datapath.id
+        srtt = self.echo_calibrator.reply(dpid, ev.msg.data)
+        switch = self.topo_shape.dpid_to_switch.get(dpid)
+        if srtt is not None and switch is not None:
+            switch.delay_to_controller = srtt / 2
+
+    @set_ev_cls(ofp_event.EventOFPMeterStatsReply, MAIN_DISPATCHER)
+    def _meter_stats_reply_handler(self, ev):
+        self._stats_reply_switch(ev.msg)
+        self.punt_budgets.meter_stats_reply(ev.msg.datapath.id, ev.msg.body)
 
     ##########################################
     #             PACKET IN HANDLER          #
@@ -451,36 +837,55 @@ class MultipathController(app_manager.RyuApp):
 
     @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
     def _packet_in_handler(self, ev):
+        '''
+        Dispatches the packet-in on the ethertype read from the raw
+        bytes, only the handlers which need it decode the packet
+        '''
         msg = ev.msg
-        pkt = packet.Packet(msg.data)
-
-        pkt_ethernet = pkt.get_protocols(ethernet.ethernet)[0]
-        datapath = msg.datapath
-        port = msg.match['in_port']
+        data = msg.data
 
-        # Checking if it's the probe packet for RTT estimation
-        if pkt_ethernet.ethertype == self.PROBE_ETHERTYPE:
-            self.probe_packet_handler(pkt)
+        if len(data) < ETHERNET_HEADER_LENGTH:
+            return
+        ethertype = ETHERTYPE.unpack_from(data, ETHERTYPE_OFFSET)[0]
+        # Single 802.1Q tag, the ethertype follows the tag
+        if ethertype == ether_types.ETH_TYPE_8021Q and \
+                len(data) >= ETHERNET_HEADER_LENGTH + VLAN_TAG_LENGTH:
+            ethertype = ETHERTYPE.unpack_from(
+                data, ETHERTYPE_OFFSET + VLAN_TAG_LENGTH)[0]
+
+        # Probes and other punts have separate budgets
+        if not self.punt_budgets.allow(
+                msg.datapath.id, ethertype == self.PROBE_ETHERTYPE):
             return
 
-        # Ignoring LLDP Packets
-        try:
-            LLDPPacket.lldp_parse(msg.data)
-            self.logger.debug('Received LLDP Packet')
+        handler = self.packet_in_handlers.get(ethertype)
+        if handler is None:
+            self.logger.debug('Unknown ethertype 0x%04x', ethertype)
             return
-        except:
-            pass
+        handler(msg)
+
+    def _packet_in_probe(self, msg):
+        self.punt_budgets.count_probe(msg.datapath.id,
+                                      self.probe_packet_handler(msg))
 
-        self.logger.debug('EventOFPPacketIn %s' % pkt)
+    def _packet_in_lldp(self, msg):
+        # LLDP is handled by the Ryu topology discovery
+        self.logger.debug('Received LLDP Packet')
 
-        # Handling ARP
+    def _packet_in_arp(self, msg):
+        pkt = packet.Packet(msg.data)
         pkt_arp = pkt.get_protocol(arp.arp)
         if pkt_arp:
-            self._handle_arp(msg, datapath, port, pkt, pkt_arp)
-            return
+            self._handle_arp(msg, msg.datapath, msg.match['in_port'], pkt,
+                             pkt_arp)
 
+    def _packet_in_ipv4(self, msg):
+        pkt = packet.Packet(msg.data)
+        pkt_ethernet = pkt.get_protocol(ethernet.ethernet)
         pkt_ipv4 = pkt.get_protocol(ipv4.ipv4)
         pkt_icmp = pkt.get_protocol(icmp.icmp)
+        datapath = msg.datapath
+        port = msg.match['in_port']
 
         # Handling ICMPv4
         if pkt_icmp:
@@ -491,10 +896,14 @@ class MultipathController(app_manager.RyuApp):
         # Handing IPv4
         if pkt_ipv4:
             self._handle_ipv4(datapath, port, pkt_ethernet, pkt_ipv4)
-            return
 
+    def _packet_in_ipv6(self, msg):
+        pkt = packet.Packet(msg.data)
+        pkt_ethernet = pkt.get_protocol(ethernet.ethernet)
         pkt_ipv6 = pkt.get_protocol(ipv6.ipv6)
         pkt_icmp = pkt.get_protocol(icmpv6.icmpv6)
+        datapath = msg.datapath
+        port = msg.match['in_port']
 
         # Handling ICMPv6
         if pkt_icmp:
@@ -503,12 +912,8 @@ class MultipathController(app_manager.RyuApp):
             return
 
         # Handing IPv6
-        if pkt_ipv4:
-            self._handle_ipv6(datapath, port, pkt_ethernet, pkt_ipv4)
-            return
-
-        # Unhandled
-        self.logger.debug('Unknown packet %s' % str(pkt))
+        if pkt_ipv6:
+            self._handle_ipv6(datapath, port, pkt_ethernet, pkt_ipv6)
 
     def _handle_arp(self, msg, datapath, in_port_no, pkt, pkt_arp):
 
@@ -550,6 +955,8 @@ class MultipathRestController(ControllerBase):
             weight = int(kwargs['weight'])
             multipath_controller.topo_shape.dpid_to_switch[
                 dp_id].ports[port_no].set_max_capacity(weight)
+            multipath_controller.topo_shape.port_capacity_changed(
+                dp_id, port_no)
         except:
             traceback.print_exc()
             return Response(content_type='text/html', body='Failure!\n')
@@ -567,6 +974,7 @@ class MultipathRestController(ControllerBase):
             port_no = int(kwargs['port_no'])
             multipath_controller.topo_shape.dpid_to_switch[
                 dp_id].edge_port = port_no
+            multipath_controller.topo_shape.mark_topology_changed()
         except:
             traceback.print_exc()
             return Response(content_type='text/html', body='Failure!\n')
@@ -585,6 +993,7 @@ class MultipathRestController(ControllerBase):
                 dp_id].ip_network = ip_net
             multipath_controller.topo_shape.dpid_to_switch[
                 dp_id].ip_netmask = netmask
+            multipath_controller.topo_shape.mark_topology_changed()
         except:
             traceback.print_exc()
             return Response(content_type='text/html', body='Failure!\n')
@@ -617,34 +1026,187 @@ class MultipathRestController(ControllerBase):
     def configure_controller_parameters(self, req, **kwargs):
         multipath_controller = self.mp_instance
 
-        config = json.loads(req.body)
+        configuration = Configuration(multipath_controller)
+        try:
+            parameters = json.loads(req.body)
+        except ValueError as e:
+            return Response(status=400, content_type='text/html',
+                            body='Configuration rejected: invalid JSON: '
+                            '%s\n' % e)
+        configuration.load_parameters(parameters, ignore_unknown=True)
+        if configuration.errors:
+            return Response(
+                status=400, content_type='text/html',
+                body='Configuration rejected: %s\n' %
+                '; '.join(configuration.errors))
+        configuration.apply()
 
-        if 'max_hop_difference' in config.keys():
-            multipath_controller.MAX_HOP_DIFFERENCE = config['max_hop_difference']
-        if 'mdi_reordering' in config.keys():
-            multipath_controller.MDI_REORDERING_THRESHOLD = float(
-                config['mdi_reordering']
-            )
-        if 'mdi_drop' in config.keys():
-            multipath_controller.MDI_DROP_THRESHOLD = float(
-                config['mdi_drop']
-            )
-        if 'max_paths' in config.keys():
-            multipath_controller.MAX_PATHS_PER_MULTIPATH_FLOW = int(
-                config['max_paths']
-            )
-        if 'min_multipath_capacity' in config.keys():
-            multipath_controller.MIN_MULTIPATH_CAPACITY = int(
-                config['min_multipath_capacity']
-            )
+        return Response(content_type='text/html',
+                        body='Configuration accepted\n')
+
+    @route('multipath', '/multipath/bulk_configuration', methods=['POST'])
+    def bulk_configuration(self, req, **kwargs):
+        '''
+        Validates and applies a whole configuration document (parameters,
+        port capacities, edge ports and ip networks, see
+        bulk_configuration), nothing is applied if any part is invalid
+        '''
+        multipath_controller = self.mp_instance
+
+        configuration = Configuration(multipath_controller)
+        try:
+            configuration.load(json.loads(req.body))
+        except ValueError as e:
+            return Response(
+                status=400, content_type='application/json',
+                body=json.dumps({'errors': ['invalid JSON: %s' % e]}))
+        except ConfigurationError as e:
+            return Response(
+                status=400, content_type='application/json',
+                body=json.dumps({'errors': e.errors}))
+        configuration.apply()
+
+        if configuration.recompute:
+            if multipath_controller.USE_RECOMPUTE_TRIGGER:
+                multipath_controller.request_recomputation('configuration')
+            else:
+                hub.spawn(multipath_controller.compute_paths)
+
+        return Response(
+            content_type='application/json',
+            body=json.dumps(configuration.summary()))
+
+    @route('multipath', '/multipath/send_stats', methods=['GET'])
+    def send_stats(self, req, **kwargs):
+        '''
+        Returns the per-switch install throughput of the send queues
+        '''
+        multipath_controller = self.mp_instance
 
-        if 'monitoring_frequency_seconds' in config.keys():
-            multipath_controller.MONITORING_PORT_STATS_FREQUENCY = int(
-                config['monitoring_frequency_seconds']
+        return Response(content_type='application/json',
+                        body=json.dumps(multipath_controller.sender.stats()))
+
+    @route('multipath', '/multipath/port_stats', methods=['GET'])
+    def port_stats(self, req, **kwargs):
+        '''
+        Returns the utilization summary of every port: last, ewma,
+        peak and percentiles of the rates in PORT_STATS_WINDOW
+        '''
+        multipath_controller = self.mp_instance
+        window = multipath_controller.PORT_STATS_WINDOW
+
+        stats = {}
+        for dpid, switch in \
+                multipath_controller.topo_shape.dpid_to_switch.iteritems():
+            stats[dpid] = dict(
+                (port_no, port.stats.summary(window))
+                for port_no, port in switch.ports.iteritems()
             )
 
-        return Response(content_type='text/html',
-                        body='Configuration accepted\n')
+        return Response(content_type='application/json',
+                        body=json.dumps(stats))
+
+    @route('multipath', '/multipath/monitor_schedule', methods=['GET'])
+    def monitor_schedule(self, req, **kwargs):
+        '''
+        Returns the activity and port stats interval of every switch
+        '''
+        multipath_controller = self.mp_instance
+
+        return Response(
+            content_type='application/json',
+            body=json.dumps(multipath_controller.monitor_scheduler.stats()))
+
+    @route('multipath', '/multipath/traffic_matrix', methods=['GET'])
+    def traffic_matrix(self, req, **kwargs):
+        '''
+        Returns the demand in bytes/s between the edge switches and its
+        split among the paths
+        '''
+        multipath_controller = self.mp_instance
+        traffic_matrix = multipath_controller.topo_shape.traffic_matrix
+
+        return Response(content_type='application/json',
+                        body=json.dumps(traffic_matrix.matrix()))
+
+    @route('multipath', '/multipath/controller_delay', methods=['GET'])
+    def controller_delay(self, req, **kwargs):
+        '''
+        Returns the echo smoothed RTT and RTT variance of every switch
+        '''
+        multipath_controller = self.mp_instance
+
+        return Response(
+            content_type='application/json',
+            body=json.dumps(multipath_controller.echo_calibrator.stats()))
+
+    @route('multipath', '/multipath/stats_requests', methods=['GET'])
+    def stats_requests(self, req, **kwargs):
+        '''
+        Returns the in-flight, timed out stats requests and the
+        unresponsive switches
+        '''
+        multipath_controller = self.mp_instance
+
+        return Response(
+            content_type='application/json',
+            body=json.dumps(multipath_controller.stats_requests.stats()))
+
+    @route('multipath', '/multipath/punt_stats', methods=['GET'])
+    def punt_stats(self, req, **kwargs):
+        '''
+        Returns the per-switch packet-in counters: accepted, dropped
+        by the budget, probes and packets dropped by the meters
+        '''
+        multipath_controller = self.mp_instance
+
+        return Response(
+            content_type='application/json',
+            body=json.dumps(multipath_controller.punt_budgets.stats()))
+
+    @route('multipath', '/multipath/path_cache_stats', methods=['GET'])
+    def path_cache_stats(self, req, **kwargs):
+        '''
+        Returns the hit/miss counters of the path cache
+        '''
+        multipath_controller = self.mp_instance
+        path_cache = multipath_controller.topo_shape.path_cache
+
+        return Response(content_type='application/json',
+                        body=json.dumps(path_cache.stats()))
+
+    @route('multipath', '/multipath/recompute_trigger', methods=['GET'])
+    def recompute_trigger_stats(self, req, **kwargs):
+        '''
+        Returns the pending change events and the recomputations run
+        '''
+        multipath_controller = self.mp_instance
+
+        return Response(
+            content_type='application/json',
+            body=json.dumps(multipath_controller.recompute_trigger.stats()))
+
+    @route('multipath', '/multipath/flow_table_stats', methods=['GET'])
+    def flow_table_stats(self, req, **kwargs):
+        '''
+        Returns the rule generation and the garbage collection counters
+        '''
+        multipath_controller = self.mp_instance
+        flow_tables = multipath_controller.topo_shape.flow_tables
+
+        return Response(content_type='application/json',
+                        body=json.dumps(flow_tables.stats()))
+
+    @route('multipath', '/multipath/group_ids', methods=['GET'])
+    def group_ids(self, req, **kwargs):
+        '''
+        Returns the group ids used and free on every datapath
+        '''
+        multipath_controller = self.mp_instance
+        group_ids = multipath_controller.topo_shape.group_ids
+
+        return Response(content_type='application/json',
+                        body=json.dumps(group_ids.stats()))
 
     @route('multipath',
            '/multipath/change_bucket_weight/{dp_id}/{group_id}/{rules}',
@@ -0,0 +1,293 @@
+#!/usr/bin/python
+
+import heapq
+import logging
+
+__author__ = 'Dario Banfi'
+__license__ = 'Apache 2.0'
+__version__ = '1.0'
+__email__ = 'dario.banfi@tum.de'
+
+'''
+Multi-commodity flow on a GraphSnapshot. Every round is a maximum
+concurrent flow with the Garg-Koenemann approximation, commodities of
+the same source are routed on one shortest path tree as in Fleischer's
+variant. Every link has a length, initially delta / capacity; flow is
+pushed on the shortest paths and the length of a link grows
+exponentially with the flow crossing it, so that congested links are
+avoided. The flow is finally scaled to respect the capacities.
+The solver runs on the controller hub, pause is called after every
+phase to let the other greenthreads run
+'''
+
+logger = logging.getLogger(__name__)
+
+# Concurrent flows routed on the capacity left by the previous ones
+FILL_ROUNDS = 4
+
+# Couples missing less than this fraction of the demand are satisfied
+SATISFIED_DEMAND = 0.01
+
+
+class MultiCommodityFlow(object):
+
+    def __init__(self, graph, capacity, epsilon=0.2, max_phases=200,
+                 pause=None):
+        '''
+        capacity[link] is the capacity of every snapshot link, links
+        with no capacity are not used
+        '''
+        self.graph = graph
+        self.capacity = capacity
+        self.epsilon = epsilon
+        self.max_phases = max_phases
+        self.pause = pause
+
+    def _shortest_path_tree(self, source, length):
+        '''
+        Dijkstra from source on the link lengths, links without
+        capacity have an infinite length. Returns the link reaching
+        every switch
+        '''
+        graph = self.graph
+        offsets = graph.offsets
+        targets = graph.targets
+        infinity = float('inf')
+
+        distance = {source: 0}
+        previous_link = {}
+        done = set()
+        heap = [(0, source)]
+        while heap:
+            dist, node = heapq.heappop(heap)
+            if node in done:
+                continue
+            done.add(node)
+            for link in xrange(offsets[node], offsets[node + 1]):
+                if length[link] == infinity:
+                    continue
+                peer = targets[link]
+                peer_dist = dist + length[link]
+                if peer_dist < distance.get(peer, float('inf')):
+                    distance[peer] = peer_dist
+                    previous_link[peer] = link
+                    heapq.heappush(heap, (peer_dist, peer))
+        return previous_link
+
+    def _tree_path(self, previous_link, source, destination):
+        if destination not in previous_link:
+            return None
+        links = []
+        node = destination
+        while node != source:
+            link = previous_link[node]
+            links.append(link)
+            node = self.graph.sources[link]
+        links.reverse()
+        return links
+
+    def solve(self, demands, max_paths=None):
+        '''
+        demands is (src index, dst index) - demand.
+        Progressive filling: a concurrent flow is routed for the
+        demands left, every couple is capped at its demand and the
+        flow is subtracted from the capacities, then the couples not
+        satisfied are routed again on the remaining capacity, for
+        FILL_ROUNDS rounds. Couples held back by a congested link so
+        do not limit the others.
+        With max_paths every couple keeps only its largest paths.
+        Returns (flows, ratio) where flows is (src index, dst index) -
+        links tuple - flow and ratio the fraction of the total demand
+        which is routed
+        '''
+        capacity = list(self.capacity)
+        remaining = dict((pair, float(demand))
+                         for pair, demand in demands.iteritems()
+                         if demand > 0 and pair[0] != pair[1])
+        total_demand = sum(remaining.itervalues())
+        flows = {}
+
+        for _ in xrange(FILL_ROUNDS):
+            round_flows = self._concurrent_flow(remaining, capacity)
+            routed_couples = set()
+            for pair, pair_flows in round_flows.iteritems():
+                routed = sum(pair_flows.itervalues())
+                if routed <= 0:
+                    continue
+                routed_couples.add(pair)
+                scale = min(1.0, remaining[pair] / routed)
+                pair_total = flows.setdefault(pair, {})
+                for links, flow in pair_flows.iteritems():
+                    flow *= scale
+                    pair_total[links] = pair_total.get(links, 0) + flow
+                    for link in links:
+                        capacity[link] -= flow
+                        if capacity[link] <= self.capacity[link] * 1e-9:
+                            capacity[link] = 0
+                remaining[pair] -= routed * scale
+
+            # Couples without any path left are not routed again
+            remaining = dict(
+                (pair, demand) for pair, demand in remaining.iteritems()
+                if pair in routed_couples and
+                demand > demands[pair] * SATISFIED_DEMAND
+            )
+            if not remaining:
+                break
+
+        if max_paths is not None:
+            self._limit_paths(flows, max_paths)
+
+        if not total_demand:
+            return flows, 0
+        routed = sum(sum(pair_flows.itervalues())
+                     for pair_flows in flows.itervalues())
+        logger.info('Multi-commodity flow: %f of the demand routed',
+                    routed / total_demand)
+        return flows, routed / total_demand
+
+    def _limit_paths(self, flows, max_paths):
+        '''
+        Keeps the max_paths largest paths of every couple, the flow of
+        the dropped paths is moved to the kept ones where the links have
+        capacity left
+        '''
+        load = [0.0] * len(self.capacity)
+        missing = {}
+        for pair, pair_flows in flows.items():
+            kept = sorted(pair_flows.iteritems(),
+                          key=lambda links_flow: links_flow[1],
+                          reverse=True)[:max_paths]
+            missing[pair] = sum(pair_flows.itervalues()) - \
+                sum(flow for links, flow in kept)
+            flows[pair] = dict(kept)
+            for links, flow in kept:
+                for link in links:
+                    load[link] += flow
+
+        for pair, pair_flows in flows.iteritems():
+            for links in sorted(pair_flows, key=pair_flows.get,
+                                reverse=True):
+                if missing[pair] <= 0:
+                    break
+                extra = min([missing[pair]] +
+                            [self.capacity[link] - load[link]
+                             for link in links])
+                if extra <= 0:
+                    continue
+                pair_flows[links] += extra
+                missing[pair] -= extra
+                for link in links:
+                    load[link] += extra
+
+    def _concurrent_flow(self, demands, capacity):
+        '''
+        Garg-Koenemann maximum concurrent flow of the demands on the
+        capacities. Returns (src index, dst index) - links tuple - flow,
+        scaled to respect the capacities
+        '''
+        epsilon = self.epsilon
+        link_count = sum(1 for c in capacity if c > 0)
+        if not link_count or not demands:
+            return {}
+
+        # Scaling the demands so that the optimal ratio is at most 1,
+        # no source can send and no destination receive more than its
+        # links capacity. This bounds the number of phases
+        out_capacity = {}
+        in_capacity = {}
+        for link, link_capacity in enumerate(capacity):
+            if link_capacity > 0:
+                source = self.graph.sources[link]
+                target = self.graph.targets[link]
+                out_capacity[source] = out_capacity.get(source, 0) + \
+                    link_capacity
+                in_capacity[target] = in_capacity.get(target, 0) + \
+                    link_capacity
+
+        # Couples whose source cannot send or destination cannot
+        # receive are left out, they would zero the bound of the others
+        demands = dict(
+            ((src, dst), demand) for (src, dst), demand in demands.iteritems()
+            if out_capacity.get(src, 0) > 0 and in_capacity.get(dst, 0) > 0
+        )
+        if not demands:
+            return {}
+
+        out_demand = {}
+        in_demand = {}
+        for (src, dst), demand in demands.iteritems():
+            out_demand[src] = out_demand.get(src, 0) + demand
+            in_demand[dst] = in_demand.get(dst, 0) + demand
+        bound = min(
+            [out_capacity.get(src, 0) / float(demand)
+             for src, demand in out_demand.iteritems()] +
+            [in_capacity.get(dst, 0) / float(demand)
+             for dst, demand in in_demand.iteritems()]
+        )
+        if bound <= 0:
+            return {}
+        demands = dict((pair, demand * bound)
+                       for pair, demand in demands.iteritems())
+
+        delta = (1 + epsilon) / ((1 + epsilon) * link_count) ** (1.0 / epsilon)
+        length = [delta / c if c > 0 else float('inf') for c in capacity]
+        # D = sum of length * capacity, the algorithm stops at 1
+        volume = delta * link_count
+
+        by_source = {}
+        for (src, dst), demand in demands.iteritems():
+            by_source.setdefault(src, []).append(dst)
+
+        flows = dict((pair, {}) for pair in demands)
+        phases = 0
+        while volume < 1 and phases < self.max_phases:
+            phases += 1
+            for source, destinations in by_source.iteritems():
+                remaining = dict((dst, demands[source, dst])
+                                 for dst in destinations)
+                while volume < 1 and remaining:
+                    tree = self._shortest_path_tree(source, length)
+                    for dst in remaining.keys():
+                        links = self._tree_path(tree, source, dst)
+                        if links is None:
+                            # Unreachable, the commodity cannot be routed
+                            del remaining[dst]
+                            continue
+                        flow = min(remaining[dst],
+                                   min(capacity[link] for link in links))
+                        pair_flows = flows[source, dst]
+                        key = tuple(links)
+                        pair_flows[key] = pair_flows.get(key, 0) + flow
+                        for link in links:
+                            increase = length[link] * epsilon * flow / \
+                                capacity[link]
+                            length[link] += increase
+                            volume += increase * capacity[link]
+                        remaining[dst] -= flow
+                        if remaining[dst] <= 0:
+                            del remaining[dst]
+                        if volume >= 1:
+                            break
+            if self.pause is not None:
+                self.pause()
+
+        # The flow pushed is feasible once divided by the largest
+        # link congestion
+        load = [0.0] * len(capacity)
+        for pair_flows in flows.itervalues():
+            for links, flow in pair_flows.iteritems():
+                for link in links:
+                    load[link] += flow
+        congestion = max(load[link] / capacity[link]
+                         for link in xrange(len(capacity))
+                         if capacity[link] > 0)
+        if congestion <= 0:
+            return {}
+
+        for pair_flows in flows.itervalues():
+            for links in pair_flows:
+                pair_flows[links] /= congestion
+        logger.debug('Concurrent flow of %d couples in %d phases',
+                     len(demands), phases)
+        return flows
@@ -1,11 +1,22 @@
 #!/usr/bin/python
 
 from itertools import tee, islice, chain, izip
+from ryu.lib import hub
 from switch import Port, Switch
+from flow_table import FlowPlan, FlowTableManager, COOKIE_TAG, TAG_MASK
+from group_ids import GroupIds
+from graph_snapshot import GraphSnapshot
+from multicommodity_flow import MultiCommodityFlow
+from path_matrices import PathMatrices
+from path_cache import PathCache
+from path_workers import PathWorkers, PathWorkerError
+from traffic_matrix import TrafficMatrix
+import path_matrices
 import logging
-import time
-import random
+import heapq
 import itertools
+import collections
+import functools
 
 __author__ = 'Dario Banfi'
 __license__ = 'Apache 2.0'
@@ -20,6 +31,150 @@ __email__ = 'dario.banfi@tum.de'
 
 logger = logging.getLogger(__name__)
 
+# Kinds of the group keys, (kind, src dpid, dst dpid, in_port)
+SELECT_GROUP = 'select'
+REORDERING_GROUP = 'reordering'
+FAILOVER_GROUP = 'failover'
+
+# Owner of the fallback rules towards a destination, (FAILOVER_RULES,
+# dst dpid)
+FAILOVER_RULES = 'failover_rules'
+
+
+class MultipathLimits(object):
+
+    '''
+    Picklable copy of the controller parameters which stop the
+    search of new paths for a multipath flow
+    '''
+
+    def __init__(self, controller):
+        self.max_paths = controller.MAX_PATHS_PER_MULTIPATH_FLOW
+        self.max_hop_difference = controller.MAX_HOP_DIFFERENCE
+        self.mdi_drop_threshold = controller.MDI_DROP_THRESHOLD
+        self.min_capacity = controller.MIN_MULTIPATH_CAPACITY
+
+    def max_path_latency(self, first_latency):
+        '''
+        Highest latency a path can have without exceeding
+        MDI_DROP_THRESHOLD against the first path of the multipath flow
+        '''
+        if self.mdi_drop_threshold >= 0.5:
+            return None
+        return first_latency * (0.5 + self.mdi_drop_threshold) / \
+            (0.5 - self.mdi_drop_threshold)
+
+
+def delay_imbalance(delays):
+    '''
+    The delay imbalance metric checks all the path delays and
+    computes the maximum inbalance between them:
+    Eg : [50,50,50] 3 paths with the same delay, so the delay
+    imbalance will be 0
+    Eg : [50,60,300] 3 paths and different delays, the value will be 0.35
+
+    The value ranges from [0 to 0.5] where 0 is no imbalance
+    '''
+    max_delay_imbalance = 0
+    for x, y in itertools.combinations(delays, 2):
+        try:
+            max_delay_imbalance = max(
+                max_delay_imbalance, abs((x/(x+y))-0.5)
+            )
+        except ZeroDivisionError:
+            max_delay_imbalance = 0
+
+    logger.info(
+        'Max delay imbalance for %s is %f',
+        delays,
+        max_delay_imbalance
+    )
+
+    return max_delay_imbalance
+
+
+def select_paths(find_route, limits):
+    '''
+    Greedy multipath selection for a src, dst couple.
+    find_route(max_latency) returns the lowest latency path on the
+    residual capacities, the capacity of every selected path is then
+    subtracted. Returns a list of (path, capacity, latency)
+    '''
+    paths = []
+    previous_path = None
+    max_latency = None
+
+    while True:
+        shortest_path = find_route(max_latency)
+        if shortest_path and previous_path is None:
+            previous_path = shortest_path
+            # Next paths above this latency would be dropped anyway
+            max_latency = limits.max_path_latency(previous_path.latency())
+
+        # Limiting the number of paths in a multipath flow
+        path_limit_reached = len(paths) + 1 > limits.max_paths
+
+        path_delays = []
+
+        if shortest_path is None:
+            logger.info('Path computation Algorithm terminates '
+                        '- NO MORE PATHS')
+            break
+        else:
+            path_delays.append(shortest_path.latency())
+            path_delays.append(previous_path.latency())
+
+        # Stopping algorithm on MAX_HOP_DIFFERENCE
+        if limits.max_hop_difference != -1 and (shortest_path.length() - previous_path.length()) > limits.max_hop_difference:
+            logger.info('Path computation Algorithm terminates '
+                        ' - MAX HOP REACHED')
+            break
+
+        # Stopping algorithm on MDI_DROP_THRESHOLD
+        if (delay_imbalance(path_delays) > limits.mdi_drop_threshold):
+            logger.info('Path computation Algorithm '
+                        'terminates - MDI_DROP_THRESHOLD REACHED')
+            break
+        if path_limit_reached:
+            logger.info('Path computation Algorithm terminates '
+                        '- PATH LIMIT REACHED')
+            break
+
+        capacity = shortest_path.capacity()
+        latency = shortest_path.latency()
+        logger.info('Computed path %s capacity %f latency %f',
+                    shortest_path, capacity, latency)
+        paths.append((shortest_path, capacity, latency))
+        shortest_path.decrease_capacity(capacity)
+
+    return paths
+
+
+def compute_pair_chunk(task):
+    '''
+    Worker process entry point, computes the paths of a list of
+    (src_index, dst_index) couples on a GraphSnapshot.
+    Returns a list of ((src_index, dst_index), paths) where paths
+    are (node indices, link indices, capacity, latency)
+    '''
+    graph, matrices, algorithm_name, limits, pairs = task
+    algorithm = ALGORITHMS[algorithm_name](None, limits.min_capacity, False)
+    algorithm.set_snapshot(graph, matrices)
+
+    results = []
+    for src_index, dst_index in pairs:
+        paths = []
+        if matrices is None or matrices.max_capacity(
+                src_index, dst_index) > limits.min_capacity:
+            find_route = functools.partial(
+                algorithm.find_route_indices, src_index, dst_index)
+            for path, capacity, latency in select_paths(find_route, limits):
+                paths.append((path.node_indices, path.links,
+                              capacity, latency))
+            graph.restore_capacities()
+        results.append(((src_index, dst_index), paths))
+    return results
+
 
 class NetworkTopology():
 
@@ -30,24 +185,69 @@ class NetworkTopology():
         # Datapath id - Switch dict
         self.dpid_to_switch = {}
 
-        # Dictionary containing the output of the controller
-        # path computation algorithm
+        # Output of the controller path computation algorithm, indexed
+        # dst - src - node - in_port - out_port - (capacity, latency)
         self.mp_config = {}
 
+        # (dpid, port_no) - set of (src_dpid, dst_dpid) pairs whose saved
+        # paths cross that port
+        self.port_to_pairs = {}
+
+        # (src_dpid, dst_dpid) - set of (dpid, port_no) used by its paths
+        self.pair_to_ports = {}
+
+        # Ports whose capacity changed since the last computation
+        self.changed_ports = set()
+
+        # Set on topology changes, forces the next computation to redo
+        # every edge pair
+        self.full_recompute_needed = True
+
+        # Demand between the edge switches measured on the ingress rules
+        self.traffic_matrix = TrafficMatrix()
+
+        # Dpids of the switches which do not answer the stats requests,
+        # left out of the path computation
+        self.unresponsive_switches = set()
+
+        # Snapshot of the topology the computation runs on
+        self.graph = None
+
+        # Incremented on every topology change, the monitor reschedules
+        # its tasks when it moves
+        self.topology_version = 0
+
+        # All-pairs latency/capacity matrices of the snapshot, used to
+        # prune pairs and paths, None when disabled or without numpy
+        self.matrices = None
+
+        # Worker processes used when PATH_COMPUTATION_WORKERS > 1
+        self.workers = None
+
+        # Routes found by the path finding algorithm, shared by the
+        # successive computations until the topology changes
+        self.path_cache = PathCache(controller.PATH_CACHE_SIZE)
+
+        # (dpid, port_no) - latency of the link when the cached routes
+        # were last invalidated for it
+        self.announced_latency = {}
+
         # Path finding algorithm used inside the max-flow to find
         # forwarding paths
-        self.pathfindinding_algo = Dijkstra(
-            self.dpid_to_switch,
-            controller.MIN_MULTIPATH_CAPACITY,
-            controller.UPDATE_FORWARDING_ON_TOPOLOGY_CHANGE_ONLY,
-        )
+        self.algorithm_name = None
+        self.pathfindinding_algo = None
+        self.set_algorithm(controller.PATH_FINDING_ALGORITHM)
+
+        # Shadow of the flows and groups installed on the datapaths
+        self.flow_tables = FlowTableManager(controller)
 
-        # Dictionary containg multipath group id for a specific tuple
-        # node, src, dst, in_port
-        self.multipath_group_ids = {}
+        # Group ids per datapath, keyed by (kind, src dpid, dst dpid,
+        # in_port) and held by the installed plans
+        self.group_ids = GroupIds()
 
-        # Group id numbers already in use
-        self.group_ids = []
+        # (src dpid, dst dpid) - set of (dpid, group key) held by the
+        # plan installed for the couple
+        self.pair_group_keys = {}
 
         # Default priority for output rules and splitting groups
         self.PRIORITY_DEFAULT = 32768
@@ -55,6 +255,13 @@ class NetworkTopology():
         # A bit higher priority for the reordering one so that
         self.PRIORITY_REORDERING = 32800
 
+        # Fallback rules towards the destinations, only used by traffic
+        # rerouted by a fast-failover group
+        self.PRIORITY_FAILOVER = 16384
+
+        # Dst index - latency tree of the current snapshot
+        self.failover_trees = {}
+
         # Maximum paths allowed for a multipath flow
         controller.MAX_PATHS_PER_MULTIPATH_FLOW = 2
 
@@ -64,6 +271,109 @@ class NetworkTopology():
     def is_empty(self):
         return len(self.dpid_to_switch) == 0
 
+    def set_algorithm(self, name):
+        '''
+        Selects the path finding algorithm by name, see ALGORITHMS
+        '''
+        self.algorithm_name = name
+        self.pathfindinding_algo = ALGORITHMS[name](
+            self.dpid_to_switch,
+            self.controller.MIN_MULTIPATH_CAPACITY,
+            self.controller.UPDATE_FORWARDING_ON_TOPOLOGY_CHANGE_ONLY,
+        )
+        self.pathfindinding_algo.set_path_cache(self.path_cache)
+        self.path_cache.new_generation()
+        self.full_recompute_needed = True
+
+    def mark_topology_changed(self):
+        '''
+        Marks the topology as modified so that the next computation
+        recalculates all the edge pairs
+        '''
+        self.path_cache.new_generation()
+        self.full_recompute_needed = True
+        self.topology_version += 1
+        self.controller.request_recomputation('topology')
+
+    def set_switch_responsive(self, dpid, responsive):
+        '''
+        Flags a switch which stopped answering (or answers again) the
+        stats requests, the paths are recomputed without it
+        '''
+        if responsive:
+            self.unresponsive_switches.discard(dpid)
+        else:
+            self.unresponsive_switches.add(dpid)
+        self.mark_topology_changed()
+
+    def edge_networks(self):
+        '''
+        Returns the ip network - dpid dict of the edge switches
+        '''
+        return dict(
+            (switch.ip_network, dpid)
+            for dpid, switch in self.dpid_to_switch.iteritems()
+            if switch.edge_port and switch.ip_network
+        )
+
+    def ingress_groups(self, switch):
+        '''
+        Returns the group id - (src dpid, dst dpid) dict of the
+        multipath groups splitting the traffic entering at switch
+        '''
+        dpid = switch.dp.id
+        return dict(
+            (group_id, (src, dst))
+            for (node, (kind, src, dst, in_port)), group_id in
+            self.group_ids.ids.iteritems()
+            if node == dpid and kind == SELECT_GROUP and src == dpid and
+            in_port == switch.edge_port
+        )
+
+    def routable_switches(self):
+        '''
+        Returns the dpid - Switch dict the paths are computed on
+        '''
+        if not self.unresponsive_switches:
+            return self.dpid_to_switch
+        return dict(
+            (dpid, switch) for dpid, switch in self.dpid_to_switch.iteritems()
+            if dpid not in self.unresponsive_switches
+        )
+
+    def port_capacity_changed(self, dpid, port_no):
+        '''
+        Records a capacity change on a port, the pairs whose paths
+        cross it will be recomputed on the next computation.
+        Ignored when UPDATE_FORWARDING_ON_TOPOLOGY_CHANGE_ONLY is set
+        '''
+        if self.controller.UPDATE_FORWARDING_ON_TOPOLOGY_CHANGE_ONLY:
+            return
+        self.changed_ports.add((dpid, port_no))
+        self.controller.request_recomputation('capacity')
+
+    def update_link_latency(self, switch, peer_switch, delay):
+        '''
+        Adds a delay sample to the link from switch to peer_switch.
+        When the smoothed latency moves by more than
+        PATH_CACHE_LATENCY_TOLERANCE the cached routes are invalidated:
+        all of them if it decreased, since any route could now be
+        shorter through the link, only the ones crossing it otherwise
+        '''
+        port = switch.ports[switch.peer_to_local_port[peer_switch]]
+        link = (switch.dp.id, port.port_no)
+        reference = self.announced_latency.get(link, port.latency)
+        switch.calculate_delay_to_peer(peer_switch, delay)
+
+        tolerance = self.controller.PATH_CACHE_LATENCY_TOLERANCE
+        if abs(port.latency - reference) <= tolerance * reference:
+            return
+        if port.latency < reference:
+            self.path_cache.new_generation()
+        else:
+            self.path_cache.invalidate_link(link)
+        self.announced_latency[link] = port.latency
+
     ##########################################
     #            TOPOLOGY CREATION           #
     ##########################################
@@ -77,7 +387,7 @@ class NetworkTopology():
             self.dpid_to_switch[switch.dp.id] = s
             for port in switch.ports:
                 self.add_port(port)
-            self.pathfindinding_algo.topology_last_update = time.time()
+            self.mark_topology_changed()
 
     def remove_switch(self, switch):
         '''
@@ -85,7 +395,28 @@ class NetworkTopology():
         '''
         if switch and switch.dp.id in self.dpid_to_switch:
             del self.dpid_to_switch[switch.dp.id]
-            self.pathfindinding_algo.topology_last_update = time.time()
+            self.forget_datapath(switch.dp.id)
+            self.controller.sender.forget_datapath(switch.dp.id)
+            self.mark_topology_changed()
+
+    def forget_datapath(self, dpid):
+        '''
+        Drops what was installed on a datapath, its rules are sent
+        again by the next computation
+        '''
+        self.flow_tables.forget_datapath(dpid)
+        self.forget_group_ids(dpid)
+
+    def update_datapath(self, datapath):
+        '''
+        Points a known switch to the datapath of its new connection,
+        everything is recomputed and installed again on it
+        '''
+        switch = self.dpid_to_switch.get(datapath.id)
+        if switch is not None and switch.dp is not datapath:
+            switch.dp = datapath
+            self.forget_datapath(datapath.id)
+            self.mark_topology_changed()
 
     def add_port(self, port):
         '''
@@ -94,7 +425,7 @@ class NetworkTopology():
         port = Port(port)
         switch = self.dpid_to_switch[port.dpid]
         switch.ports[port.port_no] = port
-        self.pathfindinding_algo.topology_last_update = time.time()
+        self.mark_topology_changed()
 
     def remove_port(self, port):
         '''
@@ -104,10 +435,15 @@ class NetworkTopology():
         try:
             switch = self.dpid_to_switch[port.dpid]
             del switch.ports[port.port_no]
-            self.pathfindinding_algo.topology_last_update = time.time()
         except KeyError:
             return
 
+        # The link of the port is gone as well
+        for peer, port_no in switch.peer_to_local_port.items():
+            if port_no == port.port_no:
+                del switch.peer_to_local_port[peer]
+        self.mark_topology_changed()
+
     def _update_port_link(self, dpid, port):
         '''
         Updates a port
@@ -134,7 +470,7 @@ class NetworkTopology():
             port=event.link.dst, peer=event.link.src, is_edge=False)
         self._update_port_link(src_port.dpid, src_port)
         self._update_port_link(dst_port.dpid, dst_port)
-        self.pathfindinding_algo.topology_last_update = time.time()
+        self.mark_topology_changed()
 
     def __remove_link(self, port):
         if port.dpid in self.dpid_to_switch:
@@ -149,7 +485,7 @@ class NetworkTopology():
         '''
         try:
             switch_1 = self.dpid_to_switch[event.link.src.dpid]
-            switch_2 = self.dpid_to_switch[event.link6.dst.dpid]
+            switch_2 = self.dpid_to_switch[event.link.dst.dpid]
             del switch_1.peer_to_local_port[switch_2]
             del switch_2.peer_to_local_port[switch_1]
 
@@ -158,17 +494,27 @@ class NetworkTopology():
 
         self.__remove_link(event.link.src)
         self.__remove_link(event.link.dst)
-        self.pathfindinding_algo.topology_last_update = time.time()
+        self.mark_topology_changed()
 
     ##########################################
     #                PATH SETUP              #
     ##########################################
 
     def multipath_computation(self):
+        '''
+        Computes the forwarding paths between the edge switches.
+        After a topology change every edge pair is computed, otherwise
+        only the pairs whose saved paths cross a port with a changed
+        capacity and the pairs which were never computed.
+        With GLOBAL_MULTICOMMODITY_FLOW the pairs share the capacities,
+        so every pair is always computed.
+        '''
         edges = []
-        self.mp_config = {}
 
-        for dpid, switch in self.dpid_to_switch.iteritems():
+        # Switches which stopped answering are left out of the paths
+        switches = self.routable_switches()
+
+        for dpid, switch in switches.iteritems():
             #  Updating the capacity_maxflow variable which will be
             # modified by the algorithm with the realtime monitored capacity
             for port_no, port in switch.ports.iteritems():
@@ -177,13 +523,121 @@ class NetworkTopology():
             if switch.edge_port:
                 edges.append(switch)
 
+        if self.full_recompute_needed or \
+                self.controller.GLOBAL_MULTICOMMODITY_FLOW:
+            self.mp_config = {}
+            self.port_to_pairs = {}
+            self.pair_to_ports = {}
+            affected_pairs = None
+        else:
+            affected_pairs = self.affected_pairs(self.changed_ports)
+
+        self.full_recompute_needed = False
+        self.changed_ports = set()
+
+        # The flows added by this computation carry a new cookie
+        self.flow_tables.new_generation()
+
+        # The algorithms run on a snapshot of the current topology
+        self.graph = GraphSnapshot(switches)
+        self.matrices = None
+        if self.controller.USE_PATH_MATRICES:
+            if path_matrices.available():
+                self.matrices = PathMatrices(
+                    self.graph, self.controller.MIN_MULTIPATH_CAPACITY)
+            else:
+                logger.warning('numpy not available, path matrices '
+                               'are disabled')
+        self.failover_trees = {}
+        self.pathfindinding_algo.dpid_to_switch = switches
+        self.pathfindinding_algo.configure(self.controller)
+        self.pathfindinding_algo.set_snapshot(self.graph, self.matrices)
+
         # Calculate forwarding paths between all edges couples
         logger.info('%s', self.dpid_to_switch)
-        for edge_couple in itertools.permutations(edges, 2):
-            self.calculate_multipath(edge_couple[0], edge_couple[1])
-            self.create_flow_rules(edge_couple[0], edge_couple[1])
+        all_pairs = set((src.dp.id, dst.dp.id)
+                        for src, dst in itertools.permutations(edges, 2))
+        owners = set(all_pairs)
+        if self.controller.USE_FAST_FAILOVER:
+            owners.update((FAILOVER_RULES, dst.dp.id) for dst in edges)
+        for owner in set(self.flow_tables.owner_flows).union(
+                self.pair_group_keys).difference(owners):
+            self.remove_pair_rules(owner)
+
+        pairs = []
+        for src, dst in itertools.permutations(edges, 2):
+            pair = (src.dp.id, dst.dp.id)
+            # Couples without paths cross no port which could change,
+            # they are retried on every computation
+            if affected_pairs is not None and self.pair_to_ports.get(pair) \
+                    and pair not in affected_pairs:
+                continue
+            self.forget_pair(src, dst)
+            self.pair_to_ports[pair] = set()
+            pairs.append((src, dst))
+
+        # The couples carrying the most traffic are computed and their
+        # rules queued first, the others keep their order
+        rank = dict((pair, index) for index, pair in
+                    enumerate(self.traffic_matrix.active_pairs()))
+        pairs.sort(key=lambda (src, dst): rank.get((src.dp.id, dst.dp.id),
+                                                   len(rank)))
+
+        # The pairs are independent, every computation starts from the
+        # same capacities, so they can be split among worker processes
+        if self.controller.GLOBAL_MULTICOMMODITY_FLOW:
+            self.calculate_multipath_global(pairs)
+        elif self.controller.PATH_COMPUTATION_WORKERS > 1 and \
+                self.pathfindinding_algo.snapshot_search and len(pairs) > 1:
+            self.calculate_multipath_parallel(pairs)
+        else:
+            for src, dst in pairs:
+                self.calculate_multipath(src, dst)
+
+        for src, dst in pairs:
+            self.create_flow_rules(src, dst)
             logger.info('-' * 20)
 
+        if self.controller.USE_FAST_FAILOVER:
+            for dst in edges:
+                self.create_failover_rules(dst)
+
+        # Old generations left without flows are deleted once the new
+        # rules are confirmed by the switches
+        self.flow_tables.sweep()
+        self.recycle_group_ids()
+
+        logger.info('Path cache %s', self.path_cache.stats())
+
+    def affected_pairs(self, ports):
+        '''
+        Returns the (src_dpid, dst_dpid) pairs whose paths cross
+        any of the given (dpid, port_no) ports
+        '''
+        pairs = set()
+        for port in ports:
+            pairs.update(self.port_to_pairs.get(port, ()))
+        return pairs
+
+    def forget_pair(self, src, dst):
+        '''
+        Removes the saved paths of a pair from the multipath config and
+        from the port dependency index
+        '''
+        pair = (src.dp.id, dst.dp.id)
+        for port in self.pair_to_ports.pop(pair, ()):
+            pairs = self.port_to_pairs.get(port)
+            if pairs is not None:
+                pairs.discard(pair)
+                if not pairs:
+                    del self.port_to_pairs[port]
+
+        dst_config = self.mp_config.get(dst)
+        if dst_config is not None:
+            dst_config.pop(src, None)
+            if not dst_config:
+                del self.mp_config[dst]
+
     def restore_capacities(self):
         '''
         Restores max_flow capacities modified by the algorithm
@@ -191,58 +645,153 @@ class NetworkTopology():
         for dpid, switch in self.dpid_to_switch.iteritems():
             for port_no, port in switch.ports.iteritems():
                 port.restore_capacity()
+        if self.graph is not None:
+            self.graph.restore_capacities()
 
     def calculate_multipath(self, src, dst):
 
-        paths = []
-        previous_path = None
-
-        while True:
-            shortest_path = self.pathfindinding_algo.find_route(src, dst)
-            if shortest_path and previous_path is None:
-                previous_path = shortest_path
+        # Pairs without any usable path are skipped before searching
+        if self.matrices is not None:
+            src_index = self.graph.index_of[src.dp.id]
+            dst_index = self.graph.index_of[dst.dp.id]
+            if self.matrices.max_capacity(src_index, dst_index) <= \
+                    self.controller.MIN_MULTIPATH_CAPACITY:
+                logger.info('No path with enough capacity from %s to %s',
+                            src, dst)
+                return
+
+        self.pathfindinding_algo.start_pair(src, dst)
+        find_route = functools.partial(
+            self.pathfindinding_algo.find_route, src, dst)
+        limits = MultipathLimits(self.controller)
+        for path, capacity, latency in select_paths(find_route, limits):
+            self.save_path(src, dst, path, capacity, latency)
 
-            # Limiting the number of paths in a multipath flow
-            path_limit_reached = len(paths) + 1 > self.controller.MAX_PATHS_PER_MULTIPATH_FLOW
+        self.restore_capacities()
 
-            path_delays = []
+    def calculate_multipath_parallel(self, pairs):
+        '''
+        Computes the paths of the (src, dst) couples in the worker
+        processes on a pickled copy of the snapshot and saves them.
+        If a worker fails the couples are computed here and the workers
+        are started again by the next computation
+        '''
+        graph = self.graph
+        workers = self.controller.PATH_COMPUTATION_WORKERS
+        pool = self.worker_pool(workers)
+        limits = MultipathLimits(self.controller)
+
+        index_pairs = [(graph.index_of[src.dp.id], graph.index_of[dst.dp.id])
+                       for src, dst in pairs]
+        chunk_size = max(1, len(index_pairs) // (workers * 4))
+        tasks = [
+            (graph, self.matrices, self.algorithm_name, limits,
+             index_pairs[i:i + chunk_size])
+            for i in xrange(0, len(index_pairs), chunk_size)
+        ]
 
-            if shortest_path is None:
-                logger.info('Path computation Algorithm terminates '
-                            '- NO MORE PATHS')
-                break
-            else:
-                path_delays.append(shortest_path.latency())
-                path_delays.append(previous_path.latency())
+        try:
+            results = pool.map(tasks)
+        except PathWorkerError:
+            logger.exception('Parallel path computation failed')
+            self.close_workers()
+            for src, dst in pairs:
+                self.calculate_multipath(src, dst)
+            return
 
-            # Stopping algorithm on MAX_HOP_DIFFERENCE
-            if self.controller.MAX_HOP_DIFFERENCE != -1 and (shortest_path.length() - previous_path.length()) > self.controller.MAX_HOP_DIFFERENCE:
-                logger.info('Path computation Algorithm terminates '
-                            ' - MAX HOP REACHED')
-                break
+        for (src_index, dst_index), paths in results:
+            src = graph.switches[src_index]
+            dst = graph.switches[dst_index]
+            for node_indices, links, capacity, latency in paths:
+                self.save_path(src, dst,
+                               SnapshotPath(graph, node_indices, links),
+                               capacity, latency)
 
-            # Stopping algorithm on MDI_DROP_THRESHOLD
-            if (self.mdi(path_delays) > self.controller.MDI_DROP_THRESHOLD):
-                logger.info('Path computation Algorithm '
-                            'terminates - MDI_DROP_THRESHOLD REACHED')
-                break
-            if path_limit_reached is None:
-                logger.info('Path computation Algorithm terminates '
-                            '- PATH LIMIT REACHED')
-                break
+    def calculate_multipath_global(self, pairs):
+        '''
+        Routes the (src, dst) couples together with a multi-commodity
+        flow on the link capacities. The demands come from the traffic
+        matrix, couples without a measured demand get
+        MIN_MULTIPATH_CAPACITY, or all share the capacity when nothing
+        was measured. The flow paths of every couple are then filtered by
+        the usual multipath limits
+        '''
+        graph = self.graph
+        min_capacity = self.controller.MIN_MULTIPATH_CAPACITY
+        capacity = [c if c > min_capacity else 0
+                    for c in graph.max_capacity]
+
+        demands = {}
+        for src, dst in pairs:
+            demands[graph.index_of[src.dp.id], graph.index_of[dst.dp.id]] = \
+                self.traffic_matrix.demand(src.dp.id, dst.dp.id)
+        if not any(demands.itervalues()):
+            # The couples share the whole capacity
+            default_demand = max(capacity or [0])
+        else:
+            default_demand = min_capacity
+        for pair, demand in demands.iteritems():
+            if not demand:
+                demands[pair] = default_demand
+
+        solver = MultiCommodityFlow(
+            graph, capacity, self.controller.MULTICOMMODITY_FLOW_EPSILON,
+            self.controller.MULTICOMMODITY_FLOW_MAX_PHASES,
+            pause=functools.partial(hub.sleep, 0))
+        limits = MultipathLimits(self.controller)
+        flows, ratio = solver.solve(demands, limits.max_paths)
+        logger.info('Multi-commodity flow routes %f of the demand', ratio)
+
+        for src, dst in pairs:
+            pair_flows = flows.get(
+                (graph.index_of[src.dp.id], graph.index_of[dst.dp.id]), {})
+            largest = sorted(pair_flows.iteritems(),
+                             key=lambda links_flow: links_flow[1],
+                             reverse=True)
+            paths = []
+            for links, flow in largest:
+                # The largest path is always kept so the couple stays
+                # routed
+                if flow <= min_capacity and paths:
+                    continue
+                node_indices = [graph.sources[links[0]]] + \
+                    [graph.targets[link] for link in links]
+                path = FlowPath(
+                    [graph.switches[index] for index in node_indices], flow)
+                paths.append((graph.path_latency(links), path))
+            paths.sort(key=lambda latency_path: latency_path[0])
+
+            def find_route(max_latency, paths=paths):
+                if not paths:
+                    return None
+                latency, path = paths.pop(0)
+                if max_latency is not None and latency > max_latency:
+                    del paths[:]
+                    return None
+                return path
 
-            paths.append(shortest_path)
+            for path, flow, latency in select_paths(find_route, limits):
+                self.save_path(src, dst, path, flow, latency)
+            self.restore_capacities()
 
-            capacity = shortest_path.capacity()
-            latency = shortest_path.latency()
-            logger.info('Computed path %s capacity %f latency %f' %
-                        (shortest_path, capacity, latency))
-            self.save_path(src, dst, shortest_path, capacity, latency)
-            shortest_path.decrease_capacity(capacity)
+    def worker_pool(self, workers):
+        '''
+        Returns the worker processes for the path computation,
+        restarted if the number of workers changed
+        '''
+        if self.workers is None or len(self.workers) != workers:
+            self.close_workers()
+            self.workers = PathWorkers(workers)
+        return self.workers
 
-        self.restore_capacities()
+    def close_workers(self):
+        if self.workers is not None:
+            self.workers.close()
+            self.workers = None
 
     def save_path(self, src, dst, path, capacity, latency):
+        pair = (src.dp.id, dst.dp.id)
+        pair_ports = self.pair_to_ports.setdefault(pair, set())
         for previous_node, node, next_node in path.iter_previous_and_next():
             if node == src:
                 input_intf = node.edge_port
@@ -254,80 +803,98 @@ class NetworkTopology():
             else:
                 output_intf = node.peer_to_local_port[next_node]
 
-            if (dst, src, node, input_intf, output_intf) in self.mp_config:
-                self.mp_config[
-                    dst, src, node, input_intf, output_intf
-                    ] += (capacity, latency)
+            for port_no in (input_intf, output_intf):
+                pair_ports.add((node.dp.id, port_no))
+                self.port_to_pairs.setdefault(
+                    (node.dp.id, port_no), set()).add(pair)
+
+            in_config = self.mp_config.setdefault(dst, {}).setdefault(
+                src, {}).setdefault(node, {}).setdefault(input_intf, {})
+            if output_intf in in_config:
+                # Paths sharing the hop add up their capacity
+                previous_capacity, previous_latency = in_config[output_intf]
+                in_config[output_intf] = (previous_capacity + capacity,
+                                          max(previous_latency, latency))
             else:
-                self.mp_config[dst, src, node, input_intf, output_intf] = (
-                    capacity, latency)
+                in_config[output_intf] = (capacity, latency)
 
-    def generate_openflow_gid(self):
+    def forget_group_ids(self, dpid):
         '''
-        Returns a random OpenFlow group id
+        Drops the group ids of a removed datapath, the plans holding
+        them do not release them anymore
         '''
-        n = random.randint(0, 2**32)
-        while n in self.group_ids:
-            n = random.randint(0, 2**32)  # lol
-        return n
+        self.group_ids.forget_datapath(dpid)
+        for group_keys in self.pair_group_keys.itervalues():
+            for group_key in [group_key for group_key in group_keys
+                              if group_key[0] == dpid]:
+                group_keys.discard(group_key)
 
-    def mdi(self, rules):
+    def release_pair_groups(self, pair, group_keys=None):
         '''
-        The delay imbalance metric checks all the path delays and
-        computes the maximum inbalance between them:
-        Eg : [50,50,50] 3 paths with the same delay, so the delay
-        imbalance will be 0
-        Eg : [50,60,300] 3 paths and different delays, the value will be 0.35
-
-        The value ranges from [0 to 0.5] where 0 is no imbalance
+        Replaces the group keys held by the plan of a couple, the ids
+        no longer used by any plan are freed. Their groups were deleted
+        by the commit of the plan
         '''
-        max_delay_imbalance = 0
-        for x, y in itertools.combinations(rules, 2):
-            try:
-                max_delay_imbalance = max(
-                    max_delay_imbalance, abs((x/(x+y))-0.5)
-                )
-            except ZeroDivisionError:
-                max_delay_imbalance = 0
+        for dpid, key in self.pair_group_keys.pop(pair, ()):
+            self.group_ids.release(dpid, key)
+        if group_keys:
+            self.pair_group_keys[pair] = group_keys
 
-        logger.info(
-            'Max delay imbalance for %s is %f',
-            rules,
-            max_delay_imbalance
-        )
+    def recycle_group_ids(self):
+        '''
+        Makes the group ids freed by the computation reusable once the
+        switches confirm the deletion of their groups
+        '''
+        for dpid, allocator, group_ids in self.group_ids.take_retired():
+            switch = self.dpid_to_switch.get(dpid)
+            if switch is None:
+                continue
+            self.controller.sender.when_applied(
+                switch.dp, functools.partial(allocator.recycle, group_ids))
+
+    def remove_pair_rules(self, pair):
+        '''
+        Removes the flows and groups installed for a couple (or the
+        fallback rules of a destination) which is not routed anymore
+        '''
+        logger.info('Removing the rules of %s', pair)
+        self.flow_tables.commit(FlowPlan(pair))
+        self.release_pair_groups(pair)
 
-        return max_delay_imbalance
+    def mdi(self, rules):
+        '''
+        Maximum delay imbalance of a list of delays, see delay_imbalance
+        '''
+        return delay_imbalance(rules)
 
     def create_flow_rules(self, src, dst):
         '''
         Creates flow rules from a src to a dst switch
         '''
 
-        # Do the magic
-        mp_dict = {}
-        for k, v in self.mp_config.iteritems():
-            reduce(
-                lambda a, b: a.setdefault(b, {}), k[:-1], mp_dict)[k[-1]] = v
+        # Rules and groups are collected in a plan and only the
+        # differences with what is installed are sent to the switches
+        pair = (src.dp.id, dst.dp.id)
+        plan = FlowPlan(pair)
+        group_keys = set()
+        pair_config = self.mp_config.get(dst, {}).get(src, {})
 
-        if not mp_dict:
-            return
-
-        for node in mp_dict[dst][src]:
+        for node in pair_config:
 
             # The switch has multiple paths converging
             max_delay_imbalance = -1
             in_latencies = []
             in_ports = 0
 
-            for in_port in mp_dict[dst][src][node]:
+            for in_port in pair_config[node]:
                 in_ports += 1
                 out_rules = {}
                 out_total_capacity = 0
                 out_total_latency = 0
 
-                for out_port in mp_dict[dst][src][node][in_port]:
-                    capacity = mp_dict[dst][src][node][in_port][out_port][0]
-                    latency = mp_dict[dst][src][node][in_port][out_port][1]
+                for out_port in pair_config[node][in_port]:
+                    capacity = pair_config[node][in_port][out_port][0]
+                    latency = pair_config[node][in_port][out_port][1]
                     out_rules[out_port] = (capacity, latency)
                     out_total_capacity += capacity
                     out_total_latency += latency
@@ -336,7 +903,6 @@ class NetworkTopology():
                 in_latencies.append(latency)
 
                 group_id = None
-                group_new = False
 
                 # The switch is splitting traffic in multipath
                 if len(out_rules) > 1:
@@ -345,15 +911,9 @@ class NetworkTopology():
                         only_delays
                     )
 
-                    if (node, src, dst, in_port) not in self.multipath_group_ids:
-                        group_new = True
-                        self.multipath_group_ids[
-                            node, src, dst, in_port
-                        ] = self.generate_openflow_gid()
-
-                    group_id = self.multipath_group_ids[
-                        node, src, dst, in_port
-                    ]
+                    key = (SELECT_GROUP, src.dp.id, dst.dp.id, in_port)
+                    group_id = self.group_ids.acquire(node.dp.id, key)
+                    group_keys.add((node.dp.id, key))
 
                 # Adding flow out_rules
                 ofp = node.dp.ofproto
@@ -371,7 +931,7 @@ class NetworkTopology():
                     in_port=in_port
                 )
 
-                # Sending SELECT Rules
+                # SELECT Rules
                 if group_id:
                     buckets = []
                     for port, (capacity, latency) in out_rules.iteritems():
@@ -386,83 +946,67 @@ class NetworkTopology():
                             ofp_parser.OFPActionOutput(port, 2000)
                         ]
                         if(bucket_weight > 0):
+                            # Buckets of a port which went down are
+                            # skipped by the switch
                             buckets.append(
                                 ofp_parser.OFPBucket(
                                     weight=bucket_weight,
+                                    watch_port=port,
                                     actions=bucket_action
                                 )
                             )
-                    # If GROUP Was new, we send a GROUP_ADD
-                    if group_new:
-                        logger.info(
-                            'GROUP_ADD for %s from %s to %s port '
-                            '%d GROUP_ID %d out_rules %s',
-                            node, src, dst, in_port, group_id, buckets
-                        )
-                        logger.info('GROUP_ADD_BUCKETS %s', buckets)
-
-                        req = ofp_parser.OFPGroupMod(
-                            node.dp, ofp.OFPGC_ADD, ofp.OFPGT_SELECT, group_id,
-                            buckets
-                        )
-                        node.dp.send_msg(req)
 
-                    # If the GROUP already existed, we send a GROUP_MOD to
-                    # eventually adjust the buckets with current link
-                    # utilization
-                    else:
-                        req = ofp_parser.OFPGroupMod(
-                            node.dp, ofp.OFPGC_MODIFY, ofp.OFPGT_SELECT,
-                            group_id, buckets)
-                        node.dp.send_msg(req)
-                        logger.info('GROUP_MOD for %s from %s to %s port %d '
-                                    'GROUP_ID %d out_rules %s',
-                                    node, src, dst, in_port, group_id, buckets
-                                    )
-                        logger.info('GROUP_MOD_BUCKETS %s', buckets)
+                    logger.info('SELECT group for %s from %s to %s port '
+                                '%d GROUP_ID %d buckets %s',
+                                node, src, dst, in_port, group_id, buckets)
+                    plan.add_group(node.dp, ofp.OFPGT_SELECT, group_id,
+                                   buckets)
 
                     actions = [ofp_parser.OFPActionGroup(group_id)]
-                    self.controller.add_flow(node.dp, self.PRIORITY_DEFAULT,
-                                             match_ip, actions, buffer_id=None)
-                    self.controller.add_flow(node.dp, 1, match_arp,
-                                             actions, buffer_id=None)
+                    plan.add_flow(node.dp, self.PRIORITY_DEFAULT,
+                                  match_ip, actions)
+                    plan.add_flow(node.dp, 1, match_arp, actions)
 
-                # Sending OUTPUT Rules
+                # OUTPUT Rules
                 else:
                     logger.info('Match for %s from %s to %s port '
                                 '%d out_rules %s',
                                 node, src, dst, in_port, out_rules)
                     port, rate = out_rules.popitem()
                     actions = [ofp_parser.OFPActionOutput(port)]
-                    self.controller.add_flow(node.dp, self.PRIORITY_DEFAULT,
-                                             match_ip, actions, buffer_id=None)
-                    self.controller.add_flow(
-                        node.dp, self.PRIORITY_DEFAULT,
-                        match_arp, actions, buffer_id=None
-                    )
+                    failover_id = self.create_failover_group(
+                        plan, group_keys, node, src, dst, in_port, port)
+                    if failover_id is not None:
+                        actions = [ofp_parser.OFPActionGroup(failover_id)]
+                    plan.add_flow(node.dp, self.PRIORITY_DEFAULT,
+                                  match_ip, actions)
+                    plan.add_flow(node.dp, self.PRIORITY_DEFAULT,
+                                  match_arp, actions)
 
             # Creating the reordering group if there are multiple paths
             # converging on the node and their delay imbalance is above the
             # threeshold
             if in_ports > 1 and self.mdi(in_latencies) > self.controller.MDI_REORDERING_THRESHOLD:
                 self.create_reordering_group(
-                    node, src, dst, mp_dict[dst][src][node]
+                    plan, node, src, dst, pair_config[node], group_keys
                 )
 
-    def create_reordering_group(self, node, src, dst, in_to_out_ports):
+        self.flow_tables.commit(plan)
+        self.release_pair_groups(pair, group_keys)
+
+    def create_reordering_group(self, plan, node, src, dst, in_to_out_ports,
+                                group_keys):
 
-        ofp = node.dp.ofproto
         ofp_parser = node.dp.ofproto_parser
-        group_id = self.generate_openflow_gid()
+        key = (REORDERING_GROUP, src.dp.id, dst.dp.id, None)
+        group_id = self.group_ids.acquire(node.dp.id, key)
+        group_keys.add((node.dp.id, key))
         out_port_no = in_to_out_ports.values()[0].keys()[0]
         buckets = []
         bucket_action = [ofp_parser.OFPActionOutput(out_port_no, 2000)]
         buckets.append(ofp_parser.OFPBucket(actions=bucket_action))
-        req = ofp_parser.OFPGroupMod(
-            node.dp, ofp.OFPGC_ADD, self.OPENFLOW_GROUP_REORDERING,
-            group_id, buckets
-        )
-        node.dp.send_msg(req)
+        plan.add_group(node.dp, self.OPENFLOW_GROUP_REORDERING, group_id,
+                       buckets)
 
         logger.info(
             'REORDERING at %s to port %d GROUP_ID %d',
@@ -477,8 +1021,126 @@ class NetworkTopology():
                 ipv4_dst=(dst.ip_network, dst.ip_netmask)
             )
             actions = [ofp_parser.OFPActionGroup(group_id)]
-            self.controller.add_flow(node.dp, self.PRIORITY_REORDERING,
-                                     match, actions, buffer_id=None)
+            plan.add_flow(node.dp, self.PRIORITY_REORDERING, match, actions)
+
+    def failover_tree(self, dst):
+        '''
+        Returns the (distance, next_link) latency tree of the snapshot
+        towards dst
+        '''
+        dst_index = self.graph.index_of[dst.dp.id]
+        tree = self.failover_trees.get(dst_index)
+        if tree is None:
+            tree = self.failover_trees[dst_index] = \
+                self.graph.latency_tree(dst_index)
+        return tree
+
+    def backup_port(self, node, dst, in_port, primary_port):
+        '''
+        Returns the port of node towards a loop free alternate for dst:
+        a neighbor, other than the primary one, whose latency tree path
+        to dst does not cross node, so the fallback rules never bring
+        the traffic back. The one with the lowest latency is chosen,
+        None if there is none
+        '''
+        graph = self.graph
+        node_index = graph.index_of.get(node.dp.id)
+        dst_index = graph.index_of.get(dst.dp.id)
+        if node_index is None or dst_index is None:
+            return None
+        distance, next_link = self.failover_tree(dst)
+
+        best = None
+        for link in xrange(graph.offsets[node_index],
+                           graph.offsets[node_index + 1]):
+            port_no = graph.ports[link]
+            peer = graph.targets[link]
+            # Sending back through in_port would need OFPP_IN_PORT
+            if port_no in (primary_port, in_port) or peer not in distance:
+                continue
+
+            hop = peer
+            while hop != dst_index and hop != node_index:
+                hop = graph.targets[next_link[hop]]
+            if hop == node_index:
+                continue
+
+            latency = graph.latency[link] + distance[peer]
+            if best is None or latency < best[0]:
+                best = (latency, port_no)
+
+        if best is None:
+            return None
+        return best[1]
+
+    def create_failover_group(self, plan, group_keys, node, src, dst,
+                              in_port, out_port):
+        '''
+        Protects the output of node to out_port with a fast-failover
+        group whose second bucket outputs to the backup port, the
+        switch uses it as soon as out_port goes down.
+        Returns the group id or None if there is no backup
+        '''
+        if not self.controller.USE_FAST_FAILOVER or \
+                out_port == node.edge_port or self.graph is None:
+            return None
+        backup_port = self.backup_port(node, dst, in_port, out_port)
+        if backup_port is None:
+            logger.info('No backup for %s from %s to %s port %d',
+                        node, src, dst, out_port)
+            return None
+
+        ofp = node.dp.ofproto
+        ofp_parser = node.dp.ofproto_parser
+        key = (FAILOVER_GROUP, src.dp.id, dst.dp.id, in_port)
+        group_id = self.group_ids.acquire(node.dp.id, key)
+        group_keys.add((node.dp.id, key))
+
+        buckets = [
+            ofp_parser.OFPBucket(
+                watch_port=port_no,
+                actions=[ofp_parser.OFPActionOutput(port_no)])
+            for port_no in (out_port, backup_port)
+        ]
+        logger.info('FAILOVER at %s from %s to %s port %d backup %d '
+                    'GROUP_ID %d', node, src, dst, out_port, backup_port,
+                    group_id)
+        plan.add_group(node.dp, ofp.OFPGT_FF, group_id, buckets)
+        return group_id
+
+    def create_failover_rules(self, dst):
+        '''
+        Installs on every switch a low priority rule forwarding the
+        traffic to dst along its latency tree, whatever the in_port.
+        It carries the traffic diverted by the fast-failover groups to
+        ports where no multipath rule matches, IPv4 and ARP alike
+        '''
+        owner = (FAILOVER_RULES, dst.dp.id)
+        plan = FlowPlan(owner)
+        graph = self.graph
+        distance, next_link = self.failover_tree(dst)
+
+        for index in distance:
+            node = graph.switches[index]
+            ofp_parser = node.dp.ofproto_parser
+            if node == dst:
+                out_port = dst.edge_port
+            else:
+                out_port = graph.ports[next_link[index]]
+            actions = [ofp_parser.OFPActionOutput(out_port)]
+            match_ip = ofp_parser.OFPMatch(
+                eth_type=0x0800,
+                ipv4_dst=(dst.ip_network, dst.ip_netmask)
+            )
+            match_arp = ofp_parser.OFPMatch(
+                eth_type=0x0806,
+                arp_tpa=(dst.ip_network, dst.ip_netmask)
+            )
+            plan.add_flow(node.dp, self.PRIORITY_FAILOVER, match_ip, actions)
+            plan.add_flow(node.dp, self.PRIORITY_FAILOVER, match_arp,
+                          actions)
+
+        self.flow_tables.commit(plan)
 
     def compute_bucket_weight(self, total_capacity, capacity, total_latency,
                               latency, max_delay_imbalance):
@@ -545,7 +1207,7 @@ class NetworkTopology():
             group_id, buckets
         )
 
-        datapath.send_msg(req)
+        self.controller.sender.send(datapath, req)
 
     def remove_flow_rules(self, datapath, table_id, match, instructions):
         '''Create OFP flow mod message to remove flows from table'''
@@ -559,20 +1221,24 @@ class NetworkTopology():
         return flow_mod
 
     def delete_all_flows(self, switch):
+        '''
+        Deletes the multipath flows and groups installed on a switch,
+        the default flows are kept. The next computation installs the
+        rules again
+        '''
+        ofp = switch.dp.ofproto
+        ofp_parser = switch.dp.ofproto_parser
 
-        for dpid, node in self.dpid_to_switch.iteritems():
-            ofp_parser = switch.dp.ofproto_parser
-
-            empty_match = ofp_parser.OFPMatch()
-            instructions = []
-            flow_mod = self.remove_flow_rules(
-                switch.dp, 0,
-                empty_match, instructions
-            )
-            switch.dp.send_msg(flow_mod)
+        self.controller.delete_flows_by_cookie(switch.dp, COOKIE_TAG,
+                                               TAG_MASK)
+        self.controller.sender.send(switch.dp, ofp_parser.OFPGroupMod(
+            switch.dp, command=ofp.OFPGC_DELETE, group_id=ofp.OFPG_ALL))
+        self.flow_tables.forget_datapath(switch.dp.id)
+        self.forget_group_ids(switch.dp.id)
+        self.mark_topology_changed()
 
 
-class Path:
+class Path(object):
 
     def __init__(self, node):
         self.nodes = [node]
@@ -606,6 +1272,20 @@ class Path:
                 next_port = node.peer_to_local_port[next_node]
                 node.ports[next_port].capacity_maxflow -= capacity
 
+    def link_ports(self):
+        '''
+        Returns the (dpid, port_no) links traversed by the path
+        '''
+        return [(node.dp.id, node.peer_to_local_port[next_node])
+                for node, next_node in izip(self.nodes, self.nodes[1:])]
+
+    def link_capacities(self):
+        '''
+        Returns the residual capacity of the links, in link_ports order
+        '''
+        return [node.ports[node.peer_to_local_port[next_node]].capacity_maxflow
+                for node, next_node in izip(self.nodes, self.nodes[1:])]
+
     def get_nodes_without(self, node):
         retval = list(self.nodes)
         retval.remove(node)
@@ -624,27 +1304,203 @@ class Path:
         return s
 
 
+class SnapshotPath(Path):
+
+    '''
+    Path computed on a GraphSnapshot, capacity and latency are read
+    from the snapshot arrays through the link indices
+    '''
+
+    def __init__(self, graph, node_indices, links):
+        self.graph = graph
+        self.node_indices = node_indices
+        self.links = links
+
+    @property
+    def nodes(self):
+        # Switches are not available in the worker processes, only
+        # the indices are used there
+        return [self.graph.switches[index] for index in self.node_indices]
+
+    def length(self):
+        return len(self.node_indices)
+
+    def capacity(self):
+        return self.graph.path_capacity(self.links)
+
+    def latency(self):
+        return self.graph.path_latency(self.links)
+
+    def decrease_capacity(self, capacity):
+        self.graph.decrease_capacity(self.links, capacity)
+
+    def link_ports(self):
+        return [self.graph.link_port(link) for link in self.links]
+
+    def link_capacities(self):
+        capacity = self.graph.capacity_maxflow
+        return [capacity[link] for link in self.links]
+
+    def __str__(self):
+        return '   '.join(
+            str(self.graph.dpids[index]) for index in self.node_indices)
+
+
+class FlowPath(Path):
+
+    '''
+    Path carrying a fixed amount of flow, as computed by a max-flow
+    decomposition
+    '''
+
+    def __init__(self, nodes, flow):
+        self.nodes = list(nodes)
+        self.flow = flow
+
+    def capacity(self):
+        return self.flow
+
+
 class Algorithm(object):
 
     ''' Algorithm base class '''
 
+    # True for algorithms which only need the GraphSnapshot and can
+    # run in the worker processes through find_route_indices
+    snapshot_search = False
+
     def __init__(self, dpid_to_switch, mintravcap, topochangeupdate):
         self.dpid_to_switch = dpid_to_switch
-        self.topology_last_update = time.time()
         self.min_trasverse_capacity = mintravcap
         self.update_forwarding_only_on_topology_change = topochangeupdate
+        self.graph = None
+        self.matrices = None
+        self.path_cache = None
+
+    def set_path_cache(self, path_cache):
+        '''
+        Sets the PathCache used by the algorithms which support it
+        '''
+        self.path_cache = path_cache
 
+    def set_snapshot(self, graph, matrices=None):
+        '''
+        Sets the GraphSnapshot of the current computation and its
+        PathMatrices if available
+        '''
+        self.graph = graph
+        self.matrices = matrices
+
+
+    def configure(self, controller):
+        '''
+        Reads the controller parameters, called before every computation
+        '''
+        self.min_trasverse_capacity = controller.MIN_MULTIPATH_CAPACITY
 
-    def find_route(self, src, dst):
+    def start_pair(self, src, dst):
+        '''
+        Called before the paths of a src, dst couple are searched,
+        algorithms computing all the paths at once reset here
+        '''
+        pass
+
+    def find_route(self, src, dst, max_latency=None):
         '''
             Sub-classes implement this method to calculate
-            to calculate the paths
+            to calculate the paths. Paths above max_latency can
+            be discarded by the search
          '''
         logger.error('Algorithm not implemented')
         return None
 
 
-class Dijkstra(Algorithm):
+class CachedAlgorithm(Algorithm):
+
+    '''
+        Base class of the single path searches whose result only depends
+        on the topology, the link latencies and the set of links which
+        cannot be traversed (residual capacity <= min_trasverse_capacity).
+        find_route looks the route up in the PathCache using that set as
+        signature, sub-classes implement compute_route
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super(CachedAlgorithm, self).__init__(*args, **kwargs)
+        # (dpid, port_no) links blocked before any path is selected
+        self.baseline_blocked_links = frozenset()
+        self.blocked_links = set()
+        # Last returned path, its capacity may have been decreased
+        self.last_path = None
+
+    def set_snapshot(self, graph, matrices=None):
+        super(CachedAlgorithm, self).set_snapshot(graph, matrices)
+        if self.path_cache is not None:
+            self.baseline_blocked_links = frozenset(
+                link for link, capacity in self.link_capacities()
+                if capacity <= self.min_trasverse_capacity
+            )
+        self.start_pair(None, None)
+
+    def start_pair(self, src, dst):
+        # Capacities are restored between the pairs
+        self.blocked_links = set(self.baseline_blocked_links)
+        self.last_path = None
+
+    def link_capacities(self):
+        '''
+        Yields (dpid, port_no), residual capacity of every link
+        '''
+        for dpid, switch in self.dpid_to_switch.iteritems():
+            for port_no, port in switch.ports.iteritems():
+                if not port.is_edge:
+                    yield (dpid, port_no), port.capacity_maxflow
+
+    def find_route(self, source, destination, max_latency=None):
+        if self.path_cache is None:
+            return self.compute_route(source, destination, max_latency)
+
+        # Only the links of the last returned path can have been
+        # decreased since the previous call
+        if self.last_path is not None:
+            for link, capacity in izip(self.last_path.link_ports(),
+                                       self.last_path.link_capacities()):
+                if capacity <= self.min_trasverse_capacity:
+                    self.blocked_links.add(link)
+
+        key = (source.dp.id, destination.dp.id, max_latency,
+               frozenset(self.blocked_links))
+        hit, route = self.path_cache.get(key)
+        path = None
+        if hit and route is not None:
+            path = self.path_from_route(destination, route)
+        if not hit or (route is not None and path is None):
+            path = self.compute_route(source, destination, max_latency)
+            self.path_cache.put(
+                key, None if path is None else tuple(path.link_ports()))
+
+        self.last_path = path
+        return path
+
+    def path_from_route(self, destination, route):
+        '''
+        Builds the path of a cached route, None if its links are
+        no longer known
+        '''
+        try:
+            nodes = [self.dpid_to_switch[dpid] for dpid, port_no in route]
+        except KeyError:
+            return None
+        path = Path(destination)
+        path.nodes[0:0] = nodes
+        return path
+
+    def compute_route(self, source, destination, max_latency=None):
+        logger.error('Algorithm not implemented')
+        return None
+
+
+class Dijkstra(CachedAlgorithm):
 
     class Heap(object):
 
@@ -721,27 +1577,8 @@ class Dijkstra(Algorithm):
         def __repr__(self):
             return str(self.heap)
 
-    def __init__(self, *args, **kwargs):
-        super(Dijkstra, self).__init__(*args, **kwargs)
-        self.paths = {}
-        self.route_last_update = time.time()
-
-    def find_route(self, source, destination):
+    def compute_route(self, source, destination, max_latency=None):
         logger.info('Searching route from %s to %s' % (source, destination))
-        if self.update_forwarding_only_on_topology_change:
-            if self.route_last_update < self.topology_last_update:
-                self.paths = {}
-                self.route_last_update = time.time()
-        else:
-            self.paths = {}
-            self.route_last_update = time.time()
-
-        logger.debug('self.topology_last_update %s' %
-                     self.topology_last_update)
-
-        if (source, destination) in self.paths:
-            logger.info('Path pre-computed')
-            return self.paths[source, destination]
 
         pq = Dijkstra.Heap()
         distance = {}
@@ -775,7 +1612,6 @@ class Dijkstra(Algorithm):
                 while previous[switch]:
                     calculated_path.insert(0, previous[switch])
                     switch = previous[switch]
-                self.paths[source, destination] = calculated_path
                 if calculated_path.length() == 1:
                     return None
                 else:
@@ -800,3 +1636,477 @@ class Dijkstra(Algorithm):
                     previous[peer_switch] = switch
 
         return None
+
+
+class HeapqDijkstra(CachedAlgorithm):
+
+    '''
+        Dijkstra on the Switch objects using heapq with lazy deletion:
+        only discovered switches are pushed and outdated entries are
+        skipped when popped
+    '''
+
+    def compute_route(self, source, destination, max_latency=None):
+        return self.search(source, destination, max_latency=max_latency)
+
+    def search(self, source, destination, excluded_switches=(),
+               excluded_links=(), max_latency=None):
+        '''
+        Lowest latency path avoiding the excluded switches and the
+        excluded (dpid, port_no) links
+        '''
+        logger.debug('Searching route from %s to %s', source, destination)
+
+        distance = {source: 0}
+        previous = {}
+        done = set()
+        # Entries are (distance, dpid, switch), the dpid breaks ties
+        heap = [(0, source.dp.id, source)]
+
+        while heap:
+            dist, dpid, switch = heapq.heappop(heap)
+            if switch in done:
+                continue
+            done.add(switch)
+
+            if not switch.has_peer_capacity():
+                logger.debug('No peer capacity')
+                return None
+
+            if switch == destination:
+                break
+
+            for port_no, port in switch.ports.iteritems():
+                if port.capacity_maxflow <= self.min_trasverse_capacity:
+                    continue
+                peer_switch = self.dpid_to_switch.get(port.peer_switch_dpid,
+                                                      None)
+                if peer_switch is None or peer_switch in excluded_switches \
+                        or (dpid, port_no) in excluded_links:
+                    continue
+
+                peer_dist = dist + port.latency
+                if max_latency is not None and peer_dist > max_latency:
+                    continue
+                if peer_dist < distance.get(peer_switch, float('inf')):
+                    distance[peer_switch] = peer_dist
+                    previous[peer_switch] = switch
+                    heapq.heappush(
+                        heap, (peer_dist, peer_switch.dp.id, peer_switch))
+        else:
+            return None
+
+        if destination == source:
+            return None
+
+        calculated_path = Path(destination)
+        switch = destination
+        while switch in previous:
+            switch = previous[switch]
+            calculated_path.insert(0, switch)
+        return calculated_path
+
+
+class YenKShortestPaths(HeapqDijkstra):
+
+    '''
+        Computes the K_SHORTEST_PATHS loopless paths from src to dst
+        with Yen's algorithm once per couple, then find_route returns
+        them in latency order skipping the candidates which have no
+        residual capacity left or violate PATH_DISJOINTNESS with the
+        paths already returned:
+        'link' - no common links
+        'node' - no common switches besides src and dst
+        'srlg' - no common link and no two links in the same
+                 shared risk group (SHARED_RISK_LINK_GROUPS)
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super(YenKShortestPaths, self).__init__(*args, **kwargs)
+        self.k = 8
+        self.disjointness = None
+        # (dpid, port_no) - set of shared risk group names
+        self.link_to_groups = {}
+        self.pair = None
+        self.candidates = []
+        self.used_links = set()
+        self.used_switches = set()
+        self.used_groups = set()
+
+    def configure(self, controller):
+        super(YenKShortestPaths, self).configure(controller)
+        self.k = controller.K_SHORTEST_PATHS
+        self.disjointness = controller.PATH_DISJOINTNESS
+        self.link_to_groups = {}
+        for name, links in controller.SHARED_RISK_LINK_GROUPS.iteritems():
+            for dpid, port_no in links:
+                self.link_to_groups.setdefault(
+                    (dpid, port_no), set()).add(name)
+
+    def start_pair(self, src, dst):
+        self.pair = None
+        self.candidates = []
+        self.used_links = set()
+        self.used_switches = set()
+        self.used_groups = set()
+
+    def find_route(self, source, destination, max_latency=None):
+        if self.pair != (source, destination):
+            self.start_pair(source, destination)
+            self.pair = (source, destination)
+            self.candidates = self.k_shortest_paths(source, destination)
+
+        while self.candidates:
+            path = self.candidates.pop(0)
+            if max_latency is not None and path.latency() > max_latency:
+                self.candidates = []
+                return None
+            if path.capacity() <= self.min_trasverse_capacity:
+                continue
+            if not self._is_disjoint(path):
+                continue
+            self._use(path)
+            return path
+
+        return None
+
+    def k_shortest_paths(self, source, destination):
+        '''
+        Yen's algorithm, returns up to k loopless paths sorted by
+        latency
+        '''
+        first = self.search(source, destination)
+        if first is None:
+            return []
+
+        paths = [first]
+        seen = set([tuple(first.nodes)])
+        candidates = []
+        counter = itertools.count()
+
+        while len(paths) < self.k:
+            previous = paths[-1]
+            for index in xrange(len(previous.nodes) - 1):
+                spur = previous.nodes[index]
+                root = previous.nodes[:index + 1]
+
+                # Links leaving the spur switch on paths sharing the root
+                excluded_links = set()
+                for path in paths:
+                    if path.nodes[:index + 1] == root:
+                        excluded_links.add(path.link_ports()[index])
+
+                spur_path = self.search(spur, destination,
+                                        excluded_switches=set(root[:-1]),
+                                        excluded_links=excluded_links)
+                if spur_path is None:
+                    continue
+
+                nodes = root[:-1] + spur_path.nodes
+                if tuple(nodes) in seen:
+                    continue
+                seen.add(tuple(nodes))
+                path = Path(nodes[0])
+                path.nodes = nodes
+                heapq.heappush(candidates,
+                               (path.latency(), next(counter), path))
+
+            if not candidates:
+                break
+            paths.append(heapq.heappop(candidates)[2])
+
+        logger.info('%d candidate paths from %s to %s',
+                    len(paths), source, destination)
+        return paths
+
+    def _is_disjoint(self, path):
+        links = path.link_ports()
+        if self.disjointness in ('link', 'srlg') and \
+                self.used_links.intersection(links):
+            return False
+        if self.disjointness == 'node' and \
+                self.used_switches.intersection(path.nodes[1:-1]):
+            return False
+        if self.disjointness == 'srlg':
+            for link in links:
+                if self.used_groups.intersection(
+                        self.link_to_groups.get(link, ())):
+                    return False
+        return True
+
+    def _use(self, path):
+        links = path.link_ports()
+        self.used_links.update(links)
+        self.used_switches.update(path.nodes[1:-1])
+        for link in links:
+            self.used_groups.update(self.link_to_groups.get(link, ()))
+
+
+class DinicMaxFlow(Algorithm):
+
+    '''
+        Computes the max-flow from src to dst over capacity_maxflow with
+        Dinic's algorithm, then decomposes it into paths. find_route
+        returns the paths one at a time in latency order
+    '''
+
+    EPSILON = 1e-9
+
+    def __init__(self, *args, **kwargs):
+        super(DinicMaxFlow, self).__init__(*args, **kwargs)
+        self.pair = None
+        self.paths = []
+
+    def start_pair(self, src, dst):
+        self.pair = None
+        self.paths = []
+
+    def find_route(self, source, destination, max_latency=None):
+        if self.pair != (source, destination):
+            self.pair = (source, destination)
+            self.paths = self._decompose(source, destination)
+
+        if not self.paths:
+            return None
+        latency, path = self.paths.pop(0)
+        if max_latency is not None and latency > max_latency:
+            self.paths = []
+            return None
+        return path
+
+    def _build_residual_graph(self):
+        '''
+        Residual graph as parallel lists: arc e goes to head[e] with
+        residual capacity cap[e], rev[e] is its reverse arc.
+        Returns (adjacency, head, cap, rev, latency, original capacity)
+        '''
+        adjacency = dict((dpid, []) for dpid in self.dpid_to_switch)
+        head = []
+        cap = []
+        rev = []
+        latency = []
+        original = []
+
+        for dpid, switch in self.dpid_to_switch.iteritems():
+            for port_no, port in switch.ports.iteritems():
+                if port.peer_switch_dpid not in adjacency or \
+                        port.capacity_maxflow <= self.min_trasverse_capacity:
+                    continue
+                forward = len(head)
+                for to, capacity in ((port.peer_switch_dpid,
+                                      port.capacity_maxflow), (dpid, 0)):
+                    head.append(to)
+                    cap.append(capacity)
+                    latency.append(port.latency)
+                    original.append(capacity)
+                rev.extend([forward + 1, forward])
+                adjacency[dpid].append(forward)
+                adjacency[port.peer_switch_dpid].append(forward + 1)
+
+        return adjacency, head, cap, rev, latency, original
+
+    def _levels(self, adjacency, head, cap, source):
+        level = {source: 0}
+        queue = collections.deque([source])
+        while queue:
+            node = queue.popleft()
+            for arc in adjacency[node]:
+                if cap[arc] > self.EPSILON and head[arc] not in level:
+                    level[head[arc]] = level[node] + 1
+                    queue.append(head[arc])
+        return level
+
+    def _blocking_flow(self, adjacency, head, cap, rev, level, source,
+                       sink):
+        '''
+        Saturates the level graph with an iterative DFS
+        '''
+        next_arc = dict((node, 0) for node in level)
+        total = 0
+        stack = [source]
+        arcs = []
+
+        while stack:
+            node = stack[-1]
+            if node == sink:
+                pushed = min(cap[arc] for arc in arcs)
+                for arc in arcs:
+                    cap[arc] -= pushed
+                    cap[rev[arc]] += pushed
+                total += pushed
+                stack = [source]
+                arcs = []
+                continue
+
+            node_arcs = adjacency[node]
+            while next_arc[node] < len(node_arcs):
+                arc = node_arcs[next_arc[node]]
+                peer = head[arc]
+                if cap[arc] > self.EPSILON and \
+                        level.get(peer) == level[node] + 1:
+                    stack.append(peer)
+                    arcs.append(arc)
+                    break
+                next_arc[node] += 1
+            else:
+                # Dead end, the arc leading here is not used anymore
+                stack.pop()
+                if arcs:
+                    arcs.pop()
+                    next_arc[stack[-1]] += 1
+
+        return total
+
+    def _decompose(self, source, destination):
+        '''
+        Max-flow from source to destination decomposed into paths,
+        the lowest latency path is extracted first.
+        Returns a list of (latency, FlowPath)
+        '''
+        src = source.dp.id
+        dst = destination.dp.id
+        if src == dst:
+            return []
+
+        adjacency, head, cap, rev, latency, original = \
+            self._build_residual_graph()
+
+        max_flow = 0
+        while True:
+            level = self._levels(adjacency, head, cap, src)
+            if dst not in level:
+                break
+            max_flow += self._blocking_flow(
+                adjacency, head, cap, rev, level, src, dst)
+
+        # Flow on the forward arcs
+        flow = {}
+        for dpid, node_arcs in adjacency.iteritems():
+            for arc in node_arcs:
+                if original[arc] > 0 and original[arc] - cap[arc] > \
+                        self.EPSILON:
+                    flow[arc] = original[arc] - cap[arc]
+
+        # Flow going both ways on a link cancels out
+        for arc in flow.keys():
+            tail = head[rev[arc]]
+            for opposite in adjacency[head[arc]]:
+                if head[opposite] == tail and opposite in flow and \
+                        arc in flow:
+                    cancel = min(flow[arc], flow[opposite])
+                    flow[arc] -= cancel
+                    flow[opposite] -= cancel
+
+        logger.info('Max-flow from %s to %s is %f', source, destination,
+                    max_flow)
+
+        paths = []
+        while True:
+            arcs = self._lowest_latency_flow_path(
+                adjacency, head, rev, latency, flow, src, dst)
+            if arcs is None:
+                break
+            amount = min(flow[arc] for arc in arcs)
+            for arc in arcs:
+                flow[arc] -= amount
+            if amount <= self.min_trasverse_capacity:
+                continue
+            nodes = [self.dpid_to_switch[src]]
+            nodes.extend(self.dpid_to_switch[head[arc]] for arc in arcs)
+            paths.append((sum(latency[arc] for arc in arcs),
+                          FlowPath(nodes, amount)))
+
+        paths.sort(key=lambda path: path[0])
+        return paths
+
+    def _lowest_latency_flow_path(self, adjacency, head, rev, latency, flow,
+                                  src, dst):
+        distance = {src: 0}
+        previous_arc = {}
+        done = set()
+        heap = [(0, src)]
+        while heap:
+            dist, node = heapq.heappop(heap)
+            if node in done:
+                continue
+            done.add(node)
+            if node == dst:
+                break
+            for arc in adjacency[node]:
+                if flow.get(arc, 0) <= self.EPSILON:
+                    continue
+                peer = head[arc]
+                peer_dist = dist + latency[arc]
+                if peer_dist < distance.get(peer, float('inf')):
+                    distance[peer] = peer_dist
+                    previous_arc[peer] = arc
+                    heapq.heappush(heap, (peer_dist, peer))
+        else:
+            return None
+
+        arcs = []
+        node = dst
+        while node != src:
+            arc = previous_arc[node]
+            arcs.append(arc)
+            node = head[rev[arc]]
+        arcs.reverse()
+        return arcs
+
+
+class SnapshotDijkstra(CachedAlgorithm):
+
+    '''
+        Dijkstra running on the arrays of the GraphSnapshot instead
+        of the Switch and Port objects
+    '''
+
+    snapshot_search = True
+
+    def link_capacities(self):
+        graph = self.graph
+        for link, capacity in enumerate(graph.capacity_maxflow):
+            yield graph.link_port(link), capacity
+
+    def path_from_route(self, destination, route):
+        graph = self.graph
+        try:
+            links = [graph.link_of[link] for link in route]
+        except KeyError:
+            return None
+        node_indices = [graph.sources[link] for link in links]
+        node_indices.append(graph.index_of[destination.dp.id])
+        return SnapshotPath(graph, node_indices, links)
+
+    def compute_route(self, source, destination, max_latency=None):
+        return self.find_route_indices(
+            self.graph.index_of[source.dp.id],
+            self.graph.index_of[destination.dp.id],
+            max_latency
+        )
+
+    def find_route_indices(self, src_index, dst_index, max_latency=None):
+        graph = self.graph
+        lower_bound = None
+        if max_latency is not None and self.matrices is not None:
+            lower_bound = self.matrices.latency_to(dst_index)
+        route = graph.shortest_path(
+            src_index,
+            dst_index,
+            self.min_trasverse_capacity,
+            max_latency,
+            lower_bound
+        )
+        if route is None:
+            return None
+        return SnapshotPath(graph, *route)
+
+
+# Path finding algorithms selectable through the configuration
+ALGORITHMS = {
+    'dijkstra': HeapqDijkstra,
+    'legacy_dijkstra': Dijkstra,
+    'maxflow': DinicMaxFlow,
+    'yen': YenKShortestPaths,
+    'snapshot_dijkstra': SnapshotDijkstra,
+}
@@ -0,0 +1,109 @@
+#!/usr/bin/python
+
+import collections
+import logging
+
+__author__ = 'Dario Banfi'
+__license__ = 'Apache 2.0'
+__version__ = '1.0'
+__email__ = 'dario.banfi@tum.de'
+
+'''
+LRU cache of the routes computed by the path finding algorithms.
+Routes are keyed by (src dpid, dst dpid, latency bound, residual
+capacity signature) and are valid for one topology generation,
+links whose latency grows invalidate only the routes crossing them
+'''
+
+logger = logging.getLogger(__name__)
+
+
+class PathCache(object):
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+
+        # Key - route, least recently used first
+        self.entries = collections.OrderedDict()
+
+        # (dpid, port_no) - keys of the routes crossing the link
+        self.link_to_keys = {}
+
+        # Increased on every topology change, drops all the routes
+        self.generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        '''
+        Returns (True, route) on a hit, (False, None) otherwise.
+        A route can be None when no path exists
+        '''
+        route = self.entries.pop(key, self)
+        if route is self:
+            self.misses += 1
+            return False, None
+        # Moving the entry to the most recently used end
+        self.entries[key] = route
+        self.hits += 1
+        return True, route
+
+    def put(self, key, route):
+        '''
+        Stores a route, the tuple of (dpid, port_no) links it crosses
+        or None
+        '''
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = route
+        if route is not None:
+            for link in route:
+                self.link_to_keys.setdefault(link, set()).add(key)
+
+        while len(self.entries) > self.max_size:
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def new_generation(self):
+        '''
+        Topology changed, every route is dropped
+        '''
+        self.generation += 1
+        self.invalidations += len(self.entries)
+        self.entries.clear()
+        self.link_to_keys.clear()
+
+    def invalidate_link(self, link):
+        '''
+        Drops the routes crossing a (dpid, port_no) link
+        '''
+        for key in self.link_to_keys.pop(link, ()):
+            if key in self.entries:
+                self._remove(key)
+                self.invalidations += 1
+
+    def _remove(self, key):
+        route = self.entries.pop(key)
+        if route is None:
+            return
+        for link in route:
+            keys = self.link_to_keys.get(link)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.link_to_keys[link]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'generation': self.generation,
+            'size': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': float(self.hits) / lookups if lookups else 0,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
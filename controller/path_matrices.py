@@ -0,0 +1,90 @@
+#!/usr/bin/python
+
+import logging
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__author__ = 'Dario Banfi'
+__license__ = 'Apache 2.0'
+__version__ = '1.0'
+__email__ = 'dario.banfi@tum.de'
+
+'''
+All-pairs lowest latency and widest path (bottleneck capacity)
+matrices of a GraphSnapshot, computed with NumPy.
+Row and column indices are the snapshot switch indices
+'''
+
+logger = logging.getLogger(__name__)
+
+
+def available():
+    ''' True if NumPy can be imported '''
+    return numpy is not None
+
+
+class PathMatrices(object):
+
+    def __init__(self, graph, min_capacity):
+        if numpy is None:
+            raise ImportError('PathMatrices requires numpy')
+
+        n = len(graph)
+        sources = numpy.array(graph.sources, dtype=numpy.intp)
+        targets = numpy.array(graph.targets, dtype=numpy.intp)
+        link_latency = numpy.array(graph.latency, dtype=numpy.float64)
+        link_capacity = numpy.array(graph.capacity, dtype=numpy.float64)
+
+        # Links the path computation is allowed to traverse
+        usable = link_capacity > min_capacity
+        sources = sources[usable]
+        targets = targets[usable]
+
+        # Direct link matrices, parallel links keep the best value
+        self.link_latency = numpy.full((n, n), numpy.inf)
+        numpy.minimum.at(self.link_latency, (sources, targets),
+                         link_latency[usable])
+        numpy.fill_diagonal(self.link_latency, 0)
+
+        self.link_capacity = numpy.zeros((n, n))
+        numpy.maximum.at(self.link_capacity, (sources, targets),
+                         link_capacity[usable])
+        numpy.fill_diagonal(self.link_capacity, numpy.inf)
+
+        self.latency = self.link_latency.copy()
+        self.capacity = self.link_capacity.copy()
+
+        # Floyd-Warshall, every intermediate switch k relaxes all the
+        # pairs at once
+        latency = self.latency
+        capacity = self.capacity
+        for k in xrange(n):
+            numpy.minimum(latency, latency[:, k, None] + latency[None, k, :],
+                          out=latency)
+            numpy.maximum(capacity,
+                          numpy.minimum(capacity[:, k, None],
+                                        capacity[None, k, :]),
+                          out=capacity)
+
+    def reachable(self, source, destination):
+        return numpy.isfinite(self.latency[source, destination])
+
+    def min_latency(self, source, destination):
+        ''' Lowest latency from source to destination '''
+        return self.latency[source, destination]
+
+    def max_capacity(self, source, destination):
+        ''' Largest bottleneck capacity of a path from source to
+        destination '''
+        return self.capacity[source, destination]
+
+    def latency_to(self, destination):
+        '''
+        Lowest latency from every switch to destination, as a list
+        indexed by switch. It is a lower bound for the path searches
+        since residual capacities can only remove links
+        '''
+        return self.latency[:, destination].tolist()
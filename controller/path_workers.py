@@ -0,0 +1,154 @@
+#!/usr/bin/python
+
+from eventlet import tpool
+import cPickle as pickle
+import logging
+import os
+import subprocess
+import sys
+import traceback
+
+__author__ = 'Dario Banfi'
+__license__ = 'Apache 2.0'
+__version__ = '1.0'
+__email__ = 'dario.banfi@tum.de'
+
+'''
+Worker processes of the parallel path computation (experimental).
+Workers are fresh interpreters running this module, started with
+close_fds: they inherit neither the eventlet hub nor the datapath and
+WSGI sockets of the controller. Tasks and results are pickled over
+their stdin/stdout, the controller waits for them in an OS thread
+(eventlet tpool) so the hub keeps serving the switches meanwhile.
+A worker exits when its stdin is closed, also if the controller dies.
+If a worker fails the whole set is killed, the other workers may still
+hold results of the failed computation
+'''
+
+logger = logging.getLogger(__name__)
+
+
+class PathWorkerError(Exception):
+    pass
+
+
+class PathWorker(object):
+
+    def __init__(self):
+        script = os.path.splitext(os.path.abspath(__file__))[0] + '.py'
+        self.process = subprocess.Popen(
+            [sys.executable, script],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            close_fds=True
+        )
+
+    def send(self, tasks):
+        pickle.dump(tasks, self.process.stdin, pickle.HIGHEST_PROTOCOL)
+        self.process.stdin.flush()
+
+    def receive(self):
+        ok, results = pickle.load(self.process.stdout)
+        if not ok:
+            raise PathWorkerError('Path worker failed:\n%s' % results)
+        return results
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+
+    def kill(self):
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+
+
+class PathWorkers(object):
+
+    '''
+    Fixed set of worker processes computing compute_pair_chunk tasks
+    '''
+
+    def __init__(self, size):
+        self.workers = [PathWorker() for _ in xrange(size)]
+
+    def __len__(self):
+        return len(self.workers)
+
+    def map(self, tasks):
+        '''
+        Returns the results of all the tasks, in no particular order.
+        Blocks the calling greenthread only. Raises PathWorkerError if
+        a worker fails, the workers are then killed and the set cannot
+        be used anymore
+        '''
+        return tpool.execute(self._map, tasks)
+
+    def _map(self, tasks):
+        try:
+            # Every worker reads all its tasks before answering, so all
+            # of them are sent before the first results are read
+            shares = [tasks[i::len(self.workers)]
+                      for i in xrange(len(self.workers))]
+            busy = []
+            for worker, share in zip(self.workers, shares):
+                if share:
+                    worker.send(share)
+                    busy.append(worker)
+
+            results = []
+            for worker in busy:
+                results.extend(worker.receive())
+            return results
+        except PathWorkerError:
+            self.kill()
+            raise
+        except Exception as e:
+            # A dead worker closes its pipes (EOFError, IOError)
+            self.kill()
+            raise PathWorkerError('Path worker died: %r' % (e,))
+
+    def kill(self):
+        for worker in self.workers:
+            try:
+                worker.kill()
+            except OSError:
+                pass
+        self.workers = []
+
+    def close(self):
+        for worker in self.workers:
+            try:
+                worker.close()
+            except (IOError, OSError):
+                logger.warning('Path worker %d already exited',
+                               worker.process.pid)
+        self.workers = []
+
+
+def main():
+    from network_topology import compute_pair_chunk
+
+    # Only the results go to the controller, anything printed by the
+    # computation ends up on stderr
+    output = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    while True:
+        try:
+            tasks = pickle.load(sys.stdin)
+        except EOFError:
+            break
+        try:
+            results = []
+            for task in tasks:
+                results.extend(compute_pair_chunk(task))
+            answer = (True, results)
+        except Exception:
+            answer = (False, traceback.format_exc())
+        pickle.dump(answer, output, pickle.HIGHEST_PROTOCOL)
+        output.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+#!/usr/bin/python
+
+from array import array
+import logging
+import math
+
+__author__ = 'Dario Banfi'
+__license__ = 'Apache 2.0'
+__version__ = '1.0'
+__email__ = 'dario.banfi@tum.de'
+
+'''
+Time series of the port statistics replies. Every port keeps the last
+samples in a ring buffer, rates are computed on the duration reported
+by the switch so that the control channel jitter does not show up as
+rate noise. Switches whose duration does not advance (e.g. always 0)
+fall back to the time the controller received the replies
+'''
+
+logger = logging.getLogger(__name__)
+
+# Samples kept per port
+PORT_STATS_HISTORY = 64
+
+# Weight of the newest rate in the moving average
+EWMA_ALPHA = 0.3
+
+# Fields of a sample, in ring buffer order
+FIELDS = ('duration', 'tx_bytes', 'rx_bytes', 'tx_packets', 'rx_packets',
+          'tx_dropped', 'rx_dropped', 'rate')
+FIELD_COUNT = len(FIELDS)
+DURATION, TX_BYTES, RX_BYTES, TX_PACKETS, RX_PACKETS, TX_DROPPED, \
+    RX_DROPPED, RATE = range(FIELD_COUNT)
+
+
+def check_estimate(method):
+    '''
+    Returns the utilization estimate method if valid, see
+    PortTimeSeries.estimate
+    '''
+    if method in ('last', 'ewma', 'peak'):
+        return method
+    try:
+        percent = float(method[1:]) if method.startswith('p') else None
+    except (ValueError, AttributeError):
+        percent = None
+    if percent is None or not 0 < percent <= 100:
+        raise ValueError('Unknown utilization estimate %s' % method)
+    return method
+
+
+class PortTimeSeries(object):
+
+    '''
+    Ring buffer of port statistics samples. rate is the tx + rx
+    bytes/s since the previous sample, ewma the exponentially weighted
+    average of the rates
+    '''
+
+    def __init__(self, size=PORT_STATS_HISTORY, alpha=EWMA_ALPHA):
+        self.size = size
+        self.alpha = alpha
+        self.samples = array('d', [0]) * (size * FIELD_COUNT)
+        # Number of samples stored and position of the next one
+        self.count = 0
+        self.position = 0
+        self.ewma = None
+
+        # The switch duration does not advance, the samples are timed
+        # with the receive time of the replies until it moves again
+        self.receive_clock = False
+        self.switch_duration = None
+
+    def __len__(self):
+        return self.count
+
+    def _offset(self, age):
+        ''' Offset of the sample age samples before the last one '''
+        return ((self.position - 1 - age) % self.size) * FIELD_COUNT
+
+    def get(self, field, age=0):
+        return self.samples[self._offset(age) + field]
+
+    def append(self, stat, receive_time=None):
+        '''
+        Adds an OFPPortStats sample received at receive_time (controller
+        clock), returns the rate since the previous sample or None
+        '''
+        switch_duration = stat.duration_sec + stat.duration_nsec / 1e9
+        if self.receive_clock and switch_duration != self.switch_duration:
+            logger.info('Port duration advances again, using the switch '
+                        'time of the replies')
+            self.receive_clock = False
+            self.reset()
+        self.switch_duration = switch_duration
+
+        if self.receive_clock and receive_time is not None:
+            duration = receive_time
+        else:
+            duration = switch_duration
+        values = (duration, stat.tx_bytes, stat.rx_bytes, stat.tx_packets,
+                  stat.rx_packets, stat.tx_dropped, stat.rx_dropped)
+
+        rate = None
+        if self.count:
+            elapsed = duration - self.get(DURATION)
+            delta = stat.tx_bytes + stat.rx_bytes - \
+                self.get(TX_BYTES) - self.get(RX_BYTES)
+            if elapsed < 0 or delta < 0:
+                # The port was recreated, its counters restarted
+                self.reset()
+            elif elapsed > 0:
+                rate = delta / elapsed
+            elif receive_time is not None and not self.receive_clock:
+                logger.info('Port duration does not advance, using the '
+                            'receive time of the replies')
+                self.receive_clock = True
+                self.reset()
+                return self.append(stat, receive_time)
+            else:
+                # Same timestamp, nothing to add
+                return None
+
+        offset = self.position * FIELD_COUNT
+        self.samples[offset:offset + FIELD_COUNT - 1] = array('d', values)
+        self.samples[offset + RATE] = rate if rate is not None else 0
+        self.position = (self.position + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+        if rate is not None:
+            if self.ewma is None:
+                self.ewma = rate
+            else:
+                self.ewma += self.alpha * (rate - self.ewma)
+        return rate
+
+    def reset(self):
+        self.count = 0
+        self.position = 0
+        self.ewma = None
+
+    def last_rate(self):
+        if self.count < 2:
+            return None
+        return self.get(RATE)
+
+    def rates(self, window=None):
+        '''
+        Rates of the samples in the last window seconds of switch time,
+        most recent first
+        '''
+        if self.count < 2:
+            return []
+        last = self.get(DURATION)
+        rates = []
+        # The oldest sample has no rate
+        for age in xrange(self.count - 1):
+            if window is not None and last - self.get(DURATION, age) > window:
+                break
+            rates.append(self.get(RATE, age))
+        return rates
+
+    def peak(self, window=None):
+        rates = self.rates(window)
+        return max(rates) if rates else None
+
+    def percentile(self, percent, window=None):
+        ''' Nearest-rank percentile of the rates '''
+        rates = sorted(self.rates(window))
+        if not rates:
+            return None
+        rank = int(math.ceil(percent / 100.0 * len(rates))) - 1
+        return rates[min(max(rank, 0), len(rates) - 1)]
+
+    def estimate(self, method, window=None):
+        '''
+        Utilization estimate: 'last', 'ewma', 'peak' or 'pNN' for a
+        percentile
+        '''
+        if method == 'last':
+            return self.last_rate()
+        if method == 'ewma':
+            return self.ewma
+        if method == 'peak':
+            return self.peak(window)
+        return self.percentile(float(check_estimate(method)[1:]), window)
+
+    def summary(self, window=None):
+        return {
+            'samples': self.count,
+            'last': self.last_rate(),
+            'ewma': self.ewma,
+            'peak': self.peak(window),
+            'p50': self.percentile(50, window),
+            'p95': self.percentile(95, window),
+            'tx_dropped': self.get(TX_DROPPED) if self.count else 0,
+            'rx_dropped': self.get(RX_DROPPED) if self.count else 0,
+        }
@@ -0,0 +1,136 @@
+#!/usr/bin/python
+
+from latency_probe import monotonic_ns
+import logging
+
+__author__ = 'Dario Banfi'
+__license__ = 'Apache 2.0'
+__version__ = '1.0'
+__email__ = 'dario.banfi@tum.de'
+
+'''
+Controller side rate limiting of the packet-in events.
+Every datapath has a token bucket of PUNT_BUDGET_RATE packets per
+second and PUNT_BUDGET_BURST packets, punts above it are dropped
+before being decoded. Latency probes have their own bucket of
+PROBE_BUDGET_RATE and PROBE_BUDGET_BURST, so punt storms do not starve
+them and spoofing the probe ethertype does not bypass the budget
+'''
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket(object):
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last_update = monotonic_ns()
+
+    def consume(self):
+        now = monotonic_ns()
+        self.tokens = min(
+            self.burst,
+            self.tokens + (now - self.last_update) / 1e9 * self.rate
+        )
+        self.last_update = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class PuntBudgets(object):
+
+    def __init__(self, controller):
+        self.controller = controller
+
+        # Dpid - TokenBucket of the punts and of the probes
+        self.buckets = {}
+        self.probe_buckets = {}
+
+        # Dpid - packet-in events accepted, dropped, probes from known
+        # links, probes dropped and probes from unknown links
+        self.accepted = {}
+        self.dropped = {}
+        self.probes = {}
+        self.dropped_probes = {}
+        self.invalid_probes = {}
+
+        # Dpid - meter id - packets dropped by the switch meter band
+        self.meter_drops = {}
+
+    def bucket(self, buckets, dpid, rate, burst):
+        bucket = buckets.get(dpid)
+        # Recreated when the budget is reconfigured
+        if bucket is None or bucket.rate != rate or bucket.burst != burst:
+            bucket = TokenBucket(rate, burst)
+            buckets[dpid] = bucket
+        return bucket
+
+    def allow(self, dpid, probe=False):
+        '''
+        True if a packet-in of the datapath can be handled, probes are
+        served by their own bucket
+        '''
+        if probe:
+            bucket = self.bucket(self.probe_buckets, dpid,
+                                 self.controller.PROBE_BUDGET_RATE,
+                                 self.controller.PROBE_BUDGET_BURST)
+            if bucket.consume():
+                return True
+            self.count_drop(self.dropped_probes, dpid, 'Probe')
+            return False
+
+        bucket = self.bucket(self.buckets, dpid,
+                             self.controller.PUNT_BUDGET_RATE,
+                             self.controller.PUNT_BUDGET_BURST)
+        if bucket.consume():
+            self.accepted[dpid] = self.accepted.get(dpid, 0) + 1
+            return True
+        self.count_drop(self.dropped, dpid, 'Punt')
+        return False
+
+    def count_drop(self, counters, dpid, name):
+        dropped = counters.get(dpid, 0) + 1
+        counters[dpid] = dropped
+        if dropped & (dropped - 1) == 0:
+            # Logging on powers of two only, drops come in storms
+            logger.warning('%s budget of %s exceeded, %d packets dropped',
+                           name, dpid, dropped)
+
+    def count_probe(self, dpid, known_link):
+        '''
+        Counts a probe within the budget, as a probe only if it came
+        from a known link
+        '''
+        counters = self.probes if known_link else self.invalid_probes
+        counters[dpid] = counters.get(dpid, 0) + 1
+
+    def meter_stats_reply(self, dpid, body):
+        drops = self.meter_drops.setdefault(dpid, {})
+        for stat in body:
+            drops[stat.meter_id] = sum(
+                band.packet_band_count for band in stat.band_stats)
+
+    def forget_datapath(self, dpid):
+        for counters in (self.buckets, self.probe_buckets, self.accepted,
+                         self.dropped, self.probes, self.dropped_probes,
+                         self.invalid_probes, self.meter_drops):
+            counters.pop(dpid, None)
+
+    def stats(self):
+        stats = {}
+        for dpid in set(self.accepted) | set(self.dropped) | \
+                set(self.probes) | set(self.dropped_probes) | \
+                set(self.invalid_probes) | set(self.meter_drops):
+            stats[dpid] = {
+                'accepted': self.accepted.get(dpid, 0),
+                'dropped': self.dropped.get(dpid, 0),
+                'probes': self.probes.get(dpid, 0),
+                'dropped_probes': self.dropped_probes.get(dpid, 0),
+                'invalid_probes': self.invalid_probes.get(dpid, 0),
+                'meter_drops': self.meter_drops.get(dpid, {}),
+            }
+        return stats
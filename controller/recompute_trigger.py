@@ -0,0 +1,94 @@
+#!/usr/bin/python
+
+from ryu.lib import hub
+from latency_probe import monotonic_ns
+import collections
+import logging
+
+__author__ = 'Dario Banfi'
+__license__ = 'Apache 2.0'
+__version__ = '1.0'
+__email__ = 'dario.banfi@tum.de'
+
+'''
+Coalescing trigger of the path recomputation. Topology and capacity
+change events are collected, the computation runs once no event
+arrived for RECOMPUTE_QUIET_PERIOD seconds, or RECOMPUTE_MAX_DELAY
+seconds after the first one if events keep coming. A single computation
+covers all the accumulated changes, events arriving meanwhile trigger
+the next one
+'''
+
+logger = logging.getLogger(__name__)
+
+
+def now_seconds():
+    return monotonic_ns() / 1e9
+
+
+class RecomputeTrigger(object):
+
+    def __init__(self, controller, compute):
+        self.controller = controller
+        self.compute = compute
+
+        # Times of the first and last event not computed yet
+        self.first_event = None
+        self.last_event = None
+
+        # Reason - number of events not computed yet
+        self.reasons = collections.Counter()
+
+        # A greenthread is waiting for the quiet period
+        self.waiting = False
+
+        self.computations = 0
+        self.coalesced_events = 0
+
+    def notify(self, reason):
+        now = now_seconds()
+        if self.first_event is None:
+            self.first_event = now
+        self.last_event = now
+        self.reasons[reason] += 1
+
+        if not self.waiting:
+            self.waiting = True
+            hub.spawn(self._wait)
+
+    def deadline(self):
+        return min(self.last_event + self.controller.RECOMPUTE_QUIET_PERIOD,
+                   self.first_event + self.controller.RECOMPUTE_MAX_DELAY)
+
+    def _wait(self):
+        try:
+            while self.first_event is not None:
+                now = now_seconds()
+                deadline = self.deadline()
+                if now < deadline:
+                    hub.sleep(deadline - now)
+                    continue
+
+                reasons = dict(self.reasons)
+                events = sum(reasons.itervalues())
+                self.first_event = None
+                self.last_event = None
+                self.reasons.clear()
+
+                logger.info('Recomputing the paths for %d events %s',
+                            events, reasons)
+                self.computations += 1
+                self.coalesced_events += events
+                self.compute()
+        finally:
+            self.waiting = False
+
+    def stats(self):
+        pending = sum(self.reasons.itervalues())
+        return {
+            'pending_events': pending,
+            'next_computation': self.deadline() - now_seconds()
+            if pending else None,
+            'computations': self.computations,
+            'coalesced_events': self.coalesced_events,
+        }
@@ -0,0 +1,247 @@
+#!/usr/bin/python
+
+from ryu.lib import hub
+from flow_table import match_key
+import collections
+import itertools
+import logging
+import time
+
+__author__ = 'Dario Banfi'
+__license__ = 'Apache 2.0'
+__version__ = '1.0'
+__email__ = 'dario.banfi@tum.de'
+
+'''
+Batched OpenFlow message sending. Messages are queued per datapath,
+messages touching the same flow or group are coalesced and the queue
+is sent in bursts, each one followed by a barrier request
+'''
+
+logger = logging.getLogger(__name__)
+
+
+class DatapathSendQueue(object):
+
+    '''
+    Messages waiting to be sent to a datapath and the batches that
+    still wait for their barrier reply
+    '''
+
+    def __init__(self, datapath):
+        self.dp = datapath
+
+        # Coalescing key - message, in sending order
+        self.pending = collections.OrderedDict()
+
+        # Barrier xid - (number of messages in the batch, send time)
+        self.outstanding = {}
+
+        self.flush_scheduled = False
+
+        # Callbacks waiting for the queue to be fully applied
+        self.idle_callbacks = []
+
+        # Install throughput accounting
+        self.sent_messages = 0
+        self.coalesced_messages = 0
+        self.confirmed_messages = 0
+        self.confirmed_batches = 0
+        self.install_time = 0
+        self.last_rate = 0
+
+    def is_idle(self):
+        return not self.pending and not self.outstanding
+
+    def stats(self):
+        rate = 0
+        if self.install_time > 0:
+            rate = self.confirmed_messages / self.install_time
+        return {
+            'pending': len(self.pending),
+            'outstanding_batches': len(self.outstanding),
+            'sent_messages': self.sent_messages,
+            'coalesced_messages': self.coalesced_messages,
+            'confirmed_messages': self.confirmed_messages,
+            'confirmed_batches': self.confirmed_batches,
+            'messages_per_second': rate,
+            'last_batch_messages_per_second': self.last_rate,
+        }
+
+
+class OpenFlowSender(object):
+
+    '''
+    Per-datapath send queues. Batch size, number of batches waiting
+    for a barrier and the barrier timeout are read from the controller
+    '''
+
+    def __init__(self, controller):
+        self.controller = controller
+
+        # dpid - DatapathSendQueue
+        self.queues = {}
+
+        # Key for messages which cannot be coalesced
+        self._unique = itertools.count()
+
+    def queue(self, datapath):
+        '''
+        Returns the send queue of a datapath, creating it if needed
+        '''
+        queue = self.queues.get(datapath.id)
+        if queue is None or queue.dp is not datapath:
+            queue = DatapathSendQueue(datapath)
+            self.queues[datapath.id] = queue
+        return queue
+
+    def forget_datapath(self, dpid):
+        self.queues.pop(dpid, None)
+
+    def send(self, datapath, msg):
+        '''
+        Queues a message for a datapath. A pending message for the same
+        flow or group is replaced by the new one
+        '''
+        queue = self.queue(datapath)
+        key = self._coalescing_key(datapath, msg)
+
+        previous = queue.pending.get(key)
+        if previous is not None:
+            self._merge(datapath, previous, msg)
+            queue.pending[key] = msg
+            queue.coalesced_messages += 1
+        else:
+            queue.pending[key] = msg
+
+        self._schedule_flush(queue)
+
+    def when_applied(self, datapath, callback):
+        '''
+        Calls callback once every message queued so far for the datapath
+        has been confirmed by a barrier reply
+        '''
+        queue = self.queue(datapath)
+        if queue.is_idle():
+            callback()
+        else:
+            queue.idle_callbacks.append(callback)
+
+    def barrier_reply(self, datapath, xid):
+        '''
+        Handles the barrier reply closing a batch
+        '''
+        queue = self.queues.get(datapath.id)
+        if queue is None or xid not in queue.outstanding:
+            return
+
+        messages, send_time = queue.outstanding.pop(xid)
+        elapsed = max(time.time() - send_time, 1e-6)
+        queue.confirmed_messages += messages
+        queue.confirmed_batches += 1
+        queue.install_time += elapsed
+        queue.last_rate = messages / elapsed
+        self._batch_done(queue)
+
+    def _barrier_timeout(self, queue, xid):
+        '''
+        Gives up on the barrier of a batch, so the queue keeps draining
+        '''
+        if xid not in queue.outstanding:
+            return
+
+        messages, _ = queue.outstanding.pop(xid)
+        logger.warning('dp %s did not answer barrier %d, %d messages '
+                       'unconfirmed', queue.dp.id, xid, messages)
+        self._batch_done(queue)
+
+    def _batch_done(self, queue):
+        if queue.pending:
+            self.flush(queue)
+        elif queue.is_idle():
+            logger.info('dp %s applied all queued messages, %f msg/s',
+                        queue.dp.id, queue.stats()['messages_per_second'])
+            self._run_idle_callbacks(queue)
+
+    def stats(self):
+        return dict((dpid, queue.stats())
+                    for dpid, queue in self.queues.iteritems())
+
+    def flush(self, queue):
+        '''
+        Sends pending messages in batches followed by a barrier, as long
+        as the number of batches waiting for a reply is below the limit.
+        Messages left pending are sent when a barrier is answered or
+        times out
+        '''
+        queue.flush_scheduled = False
+        dp = queue.dp
+        now = time.time()
+
+        while queue.pending and \
+                len(queue.outstanding) < \
+                self.controller.SEND_MAX_OUTSTANDING_BATCHES:
+            batch = 0
+            while queue.pending and batch < self.controller.SEND_BATCH_SIZE:
+                key, msg = queue.pending.popitem(last=False)
+                dp.send_msg(msg)
+                batch += 1
+
+            barrier = dp.ofproto_parser.OFPBarrierRequest(dp)
+            dp.send_msg(barrier)
+            queue.outstanding[barrier.xid] = (batch, now)
+            queue.sent_messages += batch
+            hub.spawn_after(self.controller.SEND_BARRIER_TIMEOUT,
+                            self._barrier_timeout, queue, barrier.xid)
+
+        if queue.is_idle():
+            self._run_idle_callbacks(queue)
+
+    def _schedule_flush(self, queue):
+        # Messages queued until the current greenthread yields are
+        # sent together
+        if not queue.flush_scheduled:
+            queue.flush_scheduled = True
+            hub.spawn(self.flush, queue)
+
+    def _run_idle_callbacks(self, queue):
+        callbacks = queue.idle_callbacks
+        queue.idle_callbacks = []
+        for callback in callbacks:
+            callback()
+
+    def _coalescing_key(self, datapath, msg):
+        ofp = datapath.ofproto
+        parser = datapath.ofproto_parser
+
+        if isinstance(msg, parser.OFPFlowMod) and msg.command in (
+                ofp.OFPFC_ADD, ofp.OFPFC_MODIFY_STRICT,
+                ofp.OFPFC_DELETE_STRICT):
+            return ('flow', msg.table_id, msg.priority, match_key(msg.match))
+        if isinstance(msg, parser.OFPGroupMod):
+            return ('group', msg.group_id)
+        return ('unique', next(self._unique))
+
+    def _merge(self, datapath, previous, msg):
+        '''
+        A message replacing a pending creation has to create the entry
+        itself, as the creation will never be sent. A group creation
+        replacing a pending deletion finds the group still installed,
+        it has to modify it instead
+        '''
+        ofp = datapath.ofproto
+        parser = datapath.ofproto_parser
+
+        if isinstance(msg, parser.OFPFlowMod):
+            if previous.command == ofp.OFPFC_ADD and \
+                    msg.command == ofp.OFPFC_MODIFY_STRICT:
+                # The modify keeps the cookie of the flow it replaces
+                msg.command = ofp.OFPFC_ADD
+                msg.cookie = previous.cookie
+                msg.cookie_mask = previous.cookie_mask
+        elif previous.command == ofp.OFPGC_ADD and \
+                msg.command == ofp.OFPGC_MODIFY:
+            msg.command = ofp.OFPGC_ADD
+        elif previous.command == ofp.OFPGC_DELETE and \
+                msg.command == ofp.OFPGC_ADD:
+            msg.command = ofp.OFPGC_MODIFY
@@ -0,0 +1,132 @@
+#!/usr/bin/python
+
+from latency_probe import monotonic_ns
+import logging
+
+__author__ = 'Dario Banfi'
+__license__ = 'Apache 2.0'
+__version__ = '1.0'
+__email__ = 'dario.banfi@tum.de'
+
+'''
+Tracking of the in-flight statistics requests. Every request is
+recorded by (dpid, xid) with its send time, the matching reply gives
+the switch-controller RTT. Requests without a reply within
+STATS_REQUEST_TIMEOUT are retried up to STATS_REQUEST_RETRIES times.
+When the port stats requests run out of retries the switch is flagged
+as unresponsive until it answers again, the other kinds (e.g. meter
+stats on a switch without meters) do not tell whether it forwards
+'''
+
+logger = logging.getLogger(__name__)
+
+# Request kinds whose failure flags the switch as unresponsive
+LIVENESS_KINDS = ('port',)
+
+
+def now_seconds():
+    return monotonic_ns() / 1e9
+
+
+class StatsRequestTracker(object):
+
+    def __init__(self, controller):
+        self.controller = controller
+
+        # (dpid, xid) - (datapath, kind, time of the request or of the
+        # last part of its reply, attempt, first part received)
+        self.pending = {}
+
+        # Dpids of the switches which exhausted the retries
+        self.unresponsive = set()
+
+        self.sent_requests = 0
+        self.timed_out_requests = 0
+
+    def send(self, datapath, request, kind, attempt=0):
+        '''
+        Sends a stats request of a kind ('port', 'meter', 'flow')
+        '''
+        datapath.set_xid(request)
+        self.pending[datapath.id, request.xid] = (
+            datapath, kind, now_seconds(), attempt, False)
+        self.sent_requests += 1
+        datapath.send_msg(request)
+
+    def reply(self, msg):
+        '''
+        Matches a stats reply with its request. Returns the RTT in
+        seconds for the first part of a reply, None for the following
+        parts and unknown replies
+        '''
+        dpid = msg.datapath.id
+        key = (dpid, msg.xid)
+        request = self.pending.get(key)
+        if request is None:
+            logger.debug('Stats reply %s of %s without request',
+                         msg.xid, dpid)
+            return None
+
+        datapath, kind, last_time, attempt, received = request
+        now = now_seconds()
+        rtt = None
+        if not received:
+            # The next parts of a multipart reply carry no RTT
+            rtt = now - last_time
+        self.pending[key] = (datapath, kind, now, attempt, True)
+
+        if not msg.flags & msg.datapath.ofproto.OFPMPF_REPLY_MORE:
+            del self.pending[key]
+
+        # Only the kinds which flag the switch can clear the flag
+        if kind in LIVENESS_KINDS and dpid in self.unresponsive:
+            logger.info('Switch %s answers again', dpid)
+            self.unresponsive.discard(dpid)
+            self.controller.topo_shape.set_switch_responsive(dpid, True)
+        return rtt
+
+    def expire(self):
+        '''
+        Drops the requests without a reply, or without the next part of
+        their reply, for STATS_REQUEST_TIMEOUT.
+        Returns the (datapath, kind, attempt) requests to retry, the
+        switches without port stats retries left are flagged as
+        unresponsive
+        '''
+        timeout = self.controller.STATS_REQUEST_TIMEOUT
+        now = now_seconds()
+        retries = []
+        for key, (datapath, kind, last_time, attempt, _) in \
+                self.pending.items():
+            if now - last_time < timeout:
+                continue
+            del self.pending[key]
+            self.timed_out_requests += 1
+
+            if attempt < self.controller.STATS_REQUEST_RETRIES:
+                retries.append((datapath, kind, attempt + 1))
+            elif kind not in LIVENESS_KINDS:
+                logger.warning('Switch %s does not answer %s stats '
+                               'requests', datapath.id, kind)
+            elif datapath.id not in self.unresponsive:
+                logger.warning('Switch %s does not answer %s stats '
+                               'requests', datapath.id, kind)
+                self.unresponsive.add(datapath.id)
+                self.controller.topo_shape.set_switch_responsive(
+                    datapath.id, False)
+        return retries
+
+    def forget_datapath(self, dpid):
+        for key in [key for key in self.pending if key[0] == dpid]:
+            del self.pending[key]
+        if dpid in self.unresponsive:
+            self.unresponsive.discard(dpid)
+            self.controller.topo_shape.set_switch_responsive(dpid, True)
+
+    def stats(self):
+        return {
+            'pending': len(self.pending),
+            'sent': self.sent_requests,
+            'timed_out': self.timed_out_requests,
+            'unresponsive': sorted(self.unresponsive),
+        }
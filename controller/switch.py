@@ -3,6 +3,7 @@
 from ryu.topology import switches
 from ryu.topology.switches import Port as Port_type
 from ryu.ofproto.ofproto_v1_0_parser import OFPPhyPort
+from port_stats import PortTimeSeries
 
 import netaddr
 import logging
@@ -42,11 +43,8 @@ class Port(switches.Port):
         # Used for the algorithm
         self.capacity_maxflow = self.capacity
 
-        # Last time port stats were requested
-        self.last_request_time = None
-
-        # Last utilization value computed for the port
-        self.last_utilization_value = None
+        # Port statistics samples received from the switch
+        self.stats = PortTimeSeries()
 
         # Edge ports are ports which are connected to the host networks
         # Every port is initialized as edge_port by default
@@ -127,30 +125,19 @@ class Switch(switches.Switch):
 
         self.delay_to_controller = 0
 
-        self.port_stats_request_time = 0
-
-    def calculate_delay_to_controller(self, timedelta):
+    def update_delay_to_controller(self, rtt):
         '''
-        Smoothes the sample delay to controller with previous
-        measurements
+        Smoothes the switch-controller delay, half of the RTT of a
+        stats request, with previous measurements
         '''
-        if self.port_stats_request_time != 0:
-
-            sample_delay = (timedelta - self.port_stats_request_time) / 2
+        sample_delay = rtt / 2
 
-            # Smoothed RTT, like TCP
-            if self.delay_to_controller == 0:
-                self.delay_to_controller = sample_delay
-            else:
-                self.delay_to_controller = 0.875 * \
-                    self.delay_to_controller + 0.125 * sample_delay
-
-            self.port_stats_request_time = 0
+        # Smoothed RTT, like TCP
+        if self.delay_to_controller == 0:
+            self.delay_to_controller = sample_delay
         else:
-            logger.error(
-                'Trying to calculate switch-controller delay '
-                'without initial time value'
-                         )
+            self.delay_to_controller = 0.875 * \
+                self.delay_to_controller + 0.125 * sample_delay
 
     def calculate_delay_to_peer(self, peer_switch, delay):
         '''
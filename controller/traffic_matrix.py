@@ -0,0 +1,159 @@
+#!/usr/bin/python
+
+from latency_probe import monotonic_ns
+from port_stats import EWMA_ALPHA
+import logging
+
+__author__ = 'Dario Banfi'
+__license__ = 'Apache 2.0'
+__version__ = '1.0'
+__email__ = 'dario.banfi@tum.de'
+
+'''
+Demand matrix between the edge switches, in bytes/s.
+The multipath IPv4 rules of an ingress switch match on the source and
+destination edge networks, their byte counters give the traffic of
+every (src dpid, dst dpid) couple. The stats of the ingress SELECT
+groups give how that traffic is split among the paths
+'''
+
+logger = logging.getLogger(__name__)
+
+ETH_TYPE_IP = 0x0800
+
+
+def match_network(match, field):
+    '''
+    Returns the address of a possibly masked match field or None
+    '''
+    if field not in match:
+        return None
+    value = match[field]
+    if isinstance(value, tuple):
+        return value[0]
+    return value
+
+
+class RateCounter(object):
+
+    '''
+    Byte counter of a flow or bucket, the rate uses the duration
+    reported by the switch when available
+    '''
+
+    def __init__(self):
+        self.time = None
+        self.byte_count = None
+        self.rate = None
+        self.ewma = None
+        self.last_seen = None
+
+    def update(self, byte_count, time):
+        self.last_seen = monotonic_ns() / 1e9
+        if self.time is not None and time > self.time and \
+                byte_count >= self.byte_count:
+            self.rate = (byte_count - self.byte_count) / (time - self.time)
+            if self.ewma is None:
+                self.ewma = self.rate
+            else:
+                self.ewma += EWMA_ALPHA * (self.rate - self.ewma)
+        elif self.time is not None and (time < self.time or
+                                        byte_count < self.byte_count):
+            # The flow was reinstalled, its counters restarted
+            self.rate = None
+        self.time = time
+        self.byte_count = byte_count
+
+
+class TrafficMatrix(object):
+
+    def __init__(self):
+        # (src dpid, dst dpid) - RateCounter of the ingress rule
+        self.pairs = {}
+
+        # (src dpid, dst dpid) - group id - list of bucket RateCounter
+        self.buckets = {}
+
+    def flow_stats_reply(self, switch, body, network_to_dpid):
+        '''
+        Updates the demand of the couples starting at switch with the
+        stats of its IPv4 rules matching on the edge port
+        '''
+        for stat in body:
+            match = stat.match
+            if match.get('eth_type') != ETH_TYPE_IP or \
+                    match.get('in_port') != switch.edge_port:
+                continue
+            src = network_to_dpid.get(match_network(match, 'ipv4_src'))
+            dst = network_to_dpid.get(match_network(match, 'ipv4_dst'))
+            if src != switch.dp.id or dst is None:
+                continue
+
+            counter = self.pairs.get((src, dst))
+            if counter is None:
+                counter = self.pairs[src, dst] = RateCounter()
+            counter.update(stat.byte_count,
+                           stat.duration_sec + stat.duration_nsec / 1e9)
+
+    def group_stats_reply(self, dpid, body, group_to_pair):
+        '''
+        Updates the per-bucket rates of the ingress groups,
+        group_to_pair maps the group ids of the switch to their couple
+        '''
+        for stat in body:
+            pair = group_to_pair.get(stat.group_id)
+            if pair is None:
+                continue
+            duration = stat.duration_sec + stat.duration_nsec / 1e9
+            counters = self.buckets.setdefault(pair, {}).setdefault(
+                stat.group_id, [])
+            while len(counters) < len(stat.bucket_stats):
+                counters.append(RateCounter())
+            del counters[len(stat.bucket_stats):]
+            for counter, bucket in zip(counters, stat.bucket_stats):
+                counter.update(bucket.byte_count, duration)
+
+    def expire(self, max_age):
+        '''
+        Drops the couples whose rules were not seen for max_age seconds
+        '''
+        now = monotonic_ns() / 1e9
+        for pair, counter in self.pairs.items():
+            if now - counter.last_seen > max_age:
+                del self.pairs[pair]
+                self.buckets.pop(pair, None)
+
+    def demand(self, src_dpid, dst_dpid):
+        ''' Smoothed demand of a couple in bytes/s, 0 if unknown '''
+        counter = self.pairs.get((src_dpid, dst_dpid))
+        if counter is None or counter.ewma is None:
+            return 0
+        return counter.ewma
+
+    def active_pairs(self, min_rate=0):
+        '''
+        Couples carrying more than min_rate bytes/s, highest demand
+        first
+        '''
+        pairs = [(self.demand(*pair), pair) for pair in self.pairs]
+        pairs.sort(reverse=True)
+        return [pair for rate, pair in pairs if rate > min_rate]
+
+    def matrix(self):
+        '''
+        Returns src dpid - dst dpid - {'demand', 'rate', 'split'} where
+        split are the bucket rates of the ingress groups
+        '''
+        matrix = {}
+        for (src, dst), counter in self.pairs.iteritems():
+            split = dict(
+                (group_id, [bucket.rate for bucket in counters])
+                for group_id, counters in
+                self.buckets.get((src, dst), {}).iteritems()
+            )
+            matrix.setdefault(src, {})[dst] = {
+                'demand': counter.ewma,
+                'rate': counter.rate,
+                'split': split,
+            }
+        return matrix
@@ -1,32 +1,33 @@
-# Configuring controller parameters
+# Configuring controller parameters, MAXIMUM port speeds ~ 7 Mb/s,
+# the subnet and the edge port of the switches in a single request
 curl -X POST -d '{
-    "max_hop_difference": 1,
-    "mdi_reordering": 0.8,
-    "mdi_drop": 0.8,
-    "max_paths": 2,
-    "min_multipath_capacity": 100,
-    "monitoring_frequency_seconds" : 5
- }' http://localhost:8080/multipath/configuration
-
-
-#  Setting MAXIMUM port speeds ~ 7 Mb/s
-curl http://localhost:8080/multipath/set_port_weight/2/2/876000
-curl http://localhost:8080/multipath/set_port_weight/3/1/876000
-curl http://localhost:8080/multipath/set_port_weight/4/2/876000
-curl http://localhost:8080/multipath/set_port_weight/5/1/876000
-
-
-# Setting the subnet of the switches
-curl http://localhost:8080/multipath/set_ip_network/1/10.0.0.1/255.255.255.255
-curl http://localhost:8080/multipath/set_ip_network/6/10.0.0.2/255.255.255.255
-curl http://localhost:8080/multipath/set_ip_network/4/10.0.0.3/255.255.255.255
-curl http://localhost:8080/multipath/set_ip_network/5/10.0.0.4/255.255.255.255
-
-# Setting the edge ports
-curl http://localhost:8080/multipath/set_edge_port/1/3
-curl http://localhost:8080/multipath/set_edge_port/6/3
-curl http://localhost:8080/multipath/set_edge_port/4/3
-curl http://localhost:8080/multipath/set_edge_port/5/3
+    "parameters": {
+        "max_hop_difference": 1,
+        "mdi_reordering": 0.8,
+        "mdi_drop": 0.8,
+        "max_paths": 2,
+        "min_multipath_capacity": 100,
+        "monitoring_frequency_seconds" : 5
+    },
+    "port_capacities": [
+        {"dpid": 2, "port_no": 2, "capacity": 876000},
+        {"dpid": 3, "port_no": 1, "capacity": 876000},
+        {"dpid": 4, "port_no": 2, "capacity": 876000},
+        {"dpid": 5, "port_no": 1, "capacity": 876000}
+    ],
+    "ip_networks": [
+        {"dpid": 1, "ip": "10.0.0.1", "netmask": "255.255.255.255"},
+        {"dpid": 6, "ip": "10.0.0.2", "netmask": "255.255.255.255"},
+        {"dpid": 4, "ip": "10.0.0.3", "netmask": "255.255.255.255"},
+        {"dpid": 5, "ip": "10.0.0.4", "netmask": "255.255.255.255"}
+    ],
+    "edge_ports": [
+        {"dpid": 1, "port_no": 3},
+        {"dpid": 6, "port_no": 3},
+        {"dpid": 4, "port_no": 3},
+        {"dpid": 5, "port_no": 3}
+    ]
+ }' http://localhost:8080/multipath/bulk_configuration
 
 # Starting multipath computation
-curl http://localhost:8080/multipath/start_path_computation
\ No newline at end of file
+curl http://localhost:8080/multipath/start_path_computation